@@ -11,4 +11,4 @@ db.createUser({
 });
 db.points.createIndex(
     { "location": "2dsphere" }
-  );
\ No newline at end of file
+  );
@@ -17,6 +17,18 @@ unittest() {
     rm -rf testing.sqlite
 }
 
+backfill() {
+    set -x
+    echo "Rebuilding accumulated indicators from weather data history"
+    python -m src.indicators
+}
+
+benchmark() {
+    set -x
+    echo "Benchmarking the location job scheduling engines"
+    python -m src.scheduler_benchmark "$@"
+}
+
 prodinit() {
     set -x
     echo "Production instance"
@@ -39,6 +51,10 @@ Commands:
         test:
             - set environment variables
             - run unittests
+        backfill:
+            - rebuild accumulated indicators from the stored weather data
+        benchmark [--jobs N]:
+            - compare the scheduling overhead of the location job engines
 "
 
 CMD="$1"
@@ -53,6 +69,12 @@ case "$CMD" in
     test)
         unittest
         ;;
+    backfill)
+        backfill
+        ;;
+    benchmark)
+        benchmark "$@"
+        ;;
     help|--help|-h)
         echo "$USAGE"
         ;;
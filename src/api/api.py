@@ -2,12 +2,22 @@ import logging
 from typing import Annotated, List
 
 from fastapi import APIRouter, Depends, Query, Request, HTTPException
+from pymongo.errors import ExecutionTimeout
 
 from src.api.deps import authenticate_request
-
+from src.cache_warmer import CacheWarmer
+from src.core import config
+from src.core.exceptions import ServiceOverloadedError
+from src.forecast import InterpolationMethod
 from src.ocsm.base import JSONLDGraph
+from src import scheduler
+from src.schemas.admission import AdmissionMetricsOut
+from src.schemas.et0 import ET0BatchIn, ET0BatchOut, ET0Out
+from src.schemas.indicators import AccumulatedIndicatorsOut
 from src.schemas.prediction import PredictionOut
+from src.schemas.scheduler import SchedulerMetricsOut
 from src.schemas.spray import SprayForecastResponse
+from src.schemas.tiles import BoundingBoxIn, TilePrefillOut
 from src.schemas.uav import FlightStatusForecastResponse
 from src.schemas.weather_data import THIDataOut, WeatherDataOut
 
@@ -16,6 +26,9 @@ logger = logging.getLogger(__name__)
 
 api_router = APIRouter()
 
+# Optional temporal resampling of the 3-hour forecast slots, in minutes
+Resolution = Annotated[int | None, Query(ge=1, le=180)]
+
 
 # Fetches the 5-day weather forecast for a given latitude and longitude.
 # If an error occurs, a 500 HTTP exception is raised.
@@ -25,10 +38,15 @@ async def get_weather_forecast5days(
     request: Request,
     lat: float,
     lon: float,
+    resolution: Resolution = None,
+    interpolation: InterpolationMethod = InterpolationMethod.LINEAR,
+    nearby: bool = False,
     payload: dict = Depends(authenticate_request),
 ):
     try:
-        result = await request.app.weather_app.get_weather_forecast5days(lat, lon)
+        result = await request.app.weather_app.get_weather_forecast5days(lat, lon, resolution, interpolation, nearby)
+    except (ServiceOverloadedError, ExecutionTimeout):
+        raise
     except Exception as e:
         logger.exception(e)
         raise HTTPException(status_code=500)
@@ -36,6 +54,26 @@ async def get_weather_forecast5days(
         return result
 
 
+# Caches in the background the forecast of every tile covering a bounding box,
+# so that any parcel in it is served from the cache. Requires forecast tiling.
+# Returns 422 if the bounding box covers more than FORECAST_TILE_PREFILL_MAX_TILES tiles, and 503 if
+# FORECAST_TILE_PREFILL_MAX_RUNNING prefills are already running. Tiles already being prefilled are not queued again.
+@api_router.post("/api/data/forecast5/prefill", response_model=TilePrefillOut, status_code=202)
+async def prefill_forecast_tiles(
+    request: Request,
+    body: BoundingBoxIn,
+    payload: dict = Depends(authenticate_request),
+):
+    if not config.FORECAST_TILING_ENABLED:
+        raise HTTPException(status_code=409, detail="Forecast tiling is not enabled")
+    try:
+        centroids = CacheWarmer.tiles(body.min_lat, body.min_lon, body.max_lat, body.max_lon)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    queued = CacheWarmer(request.app.weather_app, request.app.dao).start_prefill(centroids)
+    return {"tiles": len(centroids), "queued": queued, "precision": config.FORECAST_TILE_PRECISION}
+
+
 # Fetches the 5-day weather forecast in JSON-LD format for a given latitude and longitude.
 # If an error occurs, a 500 HTTP exception is raised.
 # Returns the forecast data in json-ld format if successful.
@@ -44,10 +82,15 @@ async def get_weather_forecast5days_ld(
     request: Request,
     lat: float,
     lon: float,
+    resolution: Resolution = None,
+    interpolation: InterpolationMethod = InterpolationMethod.LINEAR,
+    nearby: bool = False,
     payload: dict = Depends(authenticate_request),
 ):
     try:
-        result = await request.app.weather_app.get_weather_forecast5days_ld(lat, lon)
+        result = await request.app.weather_app.get_weather_forecast5days_ld(lat, lon, resolution, interpolation, nearby)
+    except (ServiceOverloadedError, ExecutionTimeout):
+        raise
     except Exception as e:
         logger.exception(e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -75,6 +118,8 @@ async def get_weather(
 ):
     try:
         result = await request.app.weather_app.get_weather(lat, lon)
+    except (ServiceOverloadedError, ExecutionTimeout):
+        raise
     except Exception as e:
         logger.exception(e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -94,6 +139,8 @@ async def get_thi(
 ):
     try:
         result = await request.app.weather_app.get_thi(lat, lon)
+    except (ServiceOverloadedError, ExecutionTimeout):
+        raise
     except Exception as e:
         logger.exception(e)
         raise HTTPException(status_code=500)
@@ -113,6 +160,90 @@ async def get_thi_ld(
 ):
     try:
         result = await request.app.weather_app.get_thi(lat, lon, ocsm=True)
+    except (ServiceOverloadedError, ExecutionTimeout):
+        raise
+    except Exception as e:
+        logger.exception(e)
+        raise HTTPException(status_code=500)
+    else:
+        return result
+
+
+# Fetches the growing degree days, chill hours and THI heat stress hours accumulated
+# since the start of the season for a given latitude and longitude.
+# Returns 404 if nothing has been accumulated for the location yet.
+@api_router.get("/api/data/accumulated_indicators", response_model=AccumulatedIndicatorsOut)
+async def get_accumulated_indicators(
+    request: Request,
+    lat: float,
+    lon: float,
+    payload: dict = Depends(authenticate_request),
+):
+    try:
+        result = await request.app.weather_app.get_accumulated_indicators(lat, lon)
+    except (ServiceOverloadedError, ExecutionTimeout):
+        raise
+    except Exception as e:
+        logger.exception(e)
+        raise HTTPException(status_code=500)
+    if not result:
+        raise HTTPException(status_code=404, detail="No accumulated indicators for this location")
+    return result
+
+
+# Calculates the daily FAO-56 reference evapotranspiration (ET0) of the forecast days
+# fully covered by the 5-day forecast for a given latitude and longitude.
+# If an error occurs, a 500 HTTP exception is raised.
+@api_router.get("/api/data/et0", response_model=List[ET0Out])
+async def get_et0(
+    request: Request,
+    lat: float,
+    lon: float,
+    payload: dict = Depends(authenticate_request),
+):
+    try:
+        result = await request.app.weather_app.get_et0(lat, lon)
+    except (ServiceOverloadedError, ExecutionTimeout):
+        raise
+    except Exception as e:
+        logger.exception(e)
+        raise HTTPException(status_code=500)
+    else:
+        return result
+
+
+# Calculates the daily reference evapotranspiration (ET0) in Linked Data format
+# for a given latitude and longitude.
+@api_router.get("/api/linkeddata/et0", response_model=JSONLDGraph)
+async def get_et0_ld(
+    request: Request,
+    lat: float,
+    lon: float,
+    payload: dict = Depends(authenticate_request),
+):
+    try:
+        result = await request.app.weather_app.get_et0(lat, lon, ocsm=True)
+    except (ServiceOverloadedError, ExecutionTimeout):
+        raise
+    except Exception as e:
+        logger.exception(e)
+        raise HTTPException(status_code=500)
+    else:
+        return result
+
+
+# Calculates the daily reference evapotranspiration (ET0) of many parcels at once.
+# Returns the daily values (or the error) of each requested location, in the request order.
+@api_router.post("/api/data/et0/batch", response_model=List[ET0BatchOut])
+async def get_et0_batch(
+    request: Request,
+    body: ET0BatchIn,
+    payload: dict = Depends(authenticate_request),
+):
+    try:
+        result = await request.app.weather_app.get_et0_batch([(loc.lat, loc.lon) for loc in body.locations])
+    except (ServiceOverloadedError, ExecutionTimeout):
+        raise
     except Exception as e:
         logger.exception(e)
         raise HTTPException(status_code=500)
@@ -128,10 +259,14 @@ async def get_flight_forecast_for_all_uavs(
     lon: float,
     uavmodels: Annotated[list[str] | None, Query()] = None,
     status_filter: Annotated[list[str] | None, Query()] = None,
+    resolution: Resolution = None,
+    interpolation: InterpolationMethod = InterpolationMethod.LINEAR,
     payload: dict = Depends(authenticate_request),
 ):
     try:
-        result = await request.app.weather_app.get_flight_forecast_for_all_uavs(lat, lon, uavmodels, status_filter)
+        result = await request.app.weather_app.get_flight_forecast_for_all_uavs(
+            lat, lon, uavmodels, status_filter, resolution=resolution, interpolation=interpolation
+        )
     except Exception as e:
         logger.exception(e)
         raise e
@@ -147,10 +282,14 @@ async def get_flight_forecast_for_all_uavs_ld(
     lon: float,
     uavmodels: Annotated[list[str] | None, Query()] = None,
     status_filter: Annotated[list[str] | None, Query()] = None,
+    resolution: Resolution = None,
+    interpolation: InterpolationMethod = InterpolationMethod.LINEAR,
     payload: dict = Depends(authenticate_request),
 ):
     try:
-        result = await request.app.weather_app.get_flight_forecast_for_all_uavs(lat, lon, uavmodels, status_filter, ocsm=True)
+        result = await request.app.weather_app.get_flight_forecast_for_all_uavs(
+            lat, lon, uavmodels, status_filter, ocsm=True, resolution=resolution, interpolation=interpolation
+        )
     except Exception as e:
         logger.exception(e)
         raise e
@@ -160,10 +299,19 @@ async def get_flight_forecast_for_all_uavs_ld(
 
 # Get flight forecast for a specifiv UAV model
 @api_router.get("/api/data/flight_forecast5/{uavmodel}", response_model=List[FlightStatusForecastResponse])
-async def get_flight_forecast_for_uav(request: Request, lat: float, lon: float, uavmodel: str, payload: dict = Depends(authenticate_request),
+async def get_flight_forecast_for_uav(
+    request: Request,
+    lat: float,
+    lon: float,
+    uavmodel: str,
+    resolution: Resolution = None,
+    interpolation: InterpolationMethod = InterpolationMethod.LINEAR,
+    payload: dict = Depends(authenticate_request),
 ):
     try:
-        result = await request.app.weather_app.get_flight_forecast_for_uav(lat, lon, uavmodel)
+        result = await request.app.weather_app.get_flight_forecast_for_uav(
+            lat, lon, uavmodel, resolution=resolution, interpolation=interpolation
+        )
     except Exception as e:
         logger.exception(e)
         raise e
@@ -174,10 +322,19 @@ async def get_flight_forecast_for_uav(request: Request, lat: float, lon: float,
 # Get flight forecast for a specifiv UAV model
 # Get results in OCSM
 @api_router.get("/api/linkeddata/flight_forecast5/{uavmodel}")
-async def get_flight_forecast_for_uav_ld(request: Request, lat: float, lon: float, uavmodel: str, payload: dict = Depends(authenticate_request),
+async def get_flight_forecast_for_uav_ld(
+    request: Request,
+    lat: float,
+    lon: float,
+    uavmodel: str,
+    resolution: Resolution = None,
+    interpolation: InterpolationMethod = InterpolationMethod.LINEAR,
+    payload: dict = Depends(authenticate_request),
 ):
     try:
-        result = await request.app.weather_app.get_flight_forecast_for_uav(lat, lon, uavmodel, ocsm=True)
+        result = await request.app.weather_app.get_flight_forecast_for_uav(
+            lat, lon, uavmodel, ocsm=True, resolution=resolution, interpolation=interpolation
+        )
     except Exception as e:
         logger.exception(e)
         raise e
@@ -187,9 +344,19 @@ async def get_flight_forecast_for_uav_ld(request: Request, lat: float, lon: floa
 
 # Forecast suitability of spray conditions
 @api_router.get("/api/data/spray_forecast", response_model=List[SprayForecastResponse])
-async def get_spray_forecast(request: Request, lat: float, lon: float, payload: dict = Depends(authenticate_request)):
+async def get_spray_forecast(
+    request: Request,
+    lat: float,
+    lon: float,
+    resolution: Resolution = None,
+    interpolation: InterpolationMethod = InterpolationMethod.LINEAR,
+    profile: str | None = None,
+    payload: dict = Depends(authenticate_request),
+):
     try:
-        result = await request.app.weather_app.get_spray_forecast(lat, lon)
+        result = await request.app.weather_app.get_spray_forecast(
+            lat, lon, resolution=resolution, interpolation=interpolation, profile=profile
+        )
     except Exception as e:
         logger.exception(e)
         raise e
@@ -200,11 +367,38 @@ async def get_spray_forecast(request: Request, lat: float, lon: float, payload:
 # Forecast suitability of spray conditions
 # Response in OCSM JSON-LD
 @api_router.get("/api/linkeddata/spray_forecast")
-async def get_spray_forecast_ld(request: Request, lat: float, lon: float, payload: dict = Depends(authenticate_request)):
+async def get_spray_forecast_ld(
+    request: Request,
+    lat: float,
+    lon: float,
+    resolution: Resolution = None,
+    interpolation: InterpolationMethod = InterpolationMethod.LINEAR,
+    profile: str | None = None,
+    payload: dict = Depends(authenticate_request),
+):
     try:
-        result = await request.app.weather_app.get_spray_forecast(lat, lon, ocsm=True)
+        result = await request.app.weather_app.get_spray_forecast(
+            lat, lon, ocsm=True, resolution=resolution, interpolation=interpolation, profile=profile
+        )
     except Exception as e:
         logger.exception(e)
         raise e
     else:
-        return result
\ No newline at end of file
+        return result
+
+
+# Returns the queueing metrics of the scheduled Farm Calendar jobs
+@api_router.get("/api/scheduler/metrics", response_model=SchedulerMetricsOut)
+async def get_scheduler_metrics(
+    payload: dict = Depends(authenticate_request),
+):
+    return scheduler.metrics.snapshot()
+
+
+# Returns the admission control metrics of the cold-path (cache miss) executions
+@api_router.get("/api/admission/metrics", response_model=AdmissionMetricsOut)
+async def get_admission_metrics(
+    request: Request,
+    payload: dict = Depends(authenticate_request),
+):
+    return request.app.weather_app.admission.snapshot()
@@ -0,0 +1,131 @@
+import asyncio
+from datetime import datetime, timedelta
+import logging
+import math
+from typing import List, Optional, Set, Tuple
+
+from src.core import config
+from src.core.context import without_deadline
+from src.core.dao import Dao
+from src.core.exceptions import ServiceOverloadedError
+from src.core.upstream import Priority, with_priority
+from src import geohash
+
+
+logger = logging.getLogger(__name__)
+
+# Prefills running in the background, referenced until they finish
+_prefills: Set[asyncio.Task] = set()
+# Tiles being prefilled, by centroid
+_prefilling_tiles: Set[Tuple[float, float]] = set()
+
+
+# Keeps the forecast and current weather of known locations (the Farm Calendar parcels) cached,
+# so that user requests for them hit a warm cache.
+# Each round refreshes the entries that are missing or expire within CACHE_WARMER_LEAD_MINUTES,
+# soonest expiring first, within a budget of CACHE_WARMER_MAX_CALLS upstream calls.
+class CacheWarmer:
+
+    def __init__(self, weather_app, dao: Dao):
+        self.weather_app = weather_app
+        self.dao = dao
+
+    # Returns the (expires_at, kind, lat, lon) entries to refresh, soonest expiring first.
+    # Missing entries are due now. Forecasts are cached per tile when tiling is enabled,
+    # so the parcels of a tile share a single entry.
+    async def due_entries(
+            self, locations: List[tuple], now: datetime, kinds: Tuple[str, ...] = ("forecast", "weather")
+    ) -> List[Tuple[datetime, str, float, float]]:
+        entries = {}
+        for lat, lon in (tuple(location) for location in locations):
+            for kind in kinds:
+                entries[(kind, *(self.weather_app.forecast_location(lat, lon) if kind == "forecast" else (lat, lon)))] = None
+
+        forecast_times, weather_times = await self.dao.find_cache_times(
+            [(lat, lon) for kind, lat, lon in entries if kind == "forecast"],
+            [(lat, lon) for kind, lat, lon in entries if kind == "weather"]
+        )
+        caches = {
+            "forecast": (forecast_times, timedelta(hours=config.FORECAST_DATA_CACHE_TIME)),
+            "weather": (weather_times, timedelta(hours=config.CURRENT_WEATHER_DATA_CACHE_TIME)),
+        }
+
+        horizon = now + timedelta(minutes=config.CACHE_WARMER_LEAD_MINUTES)
+        due = []
+        for kind, lat, lon in entries:
+            times, ttl = caches[kind]
+            created_at = times.get((lat, lon))
+            expires_at = created_at + ttl if created_at else now
+            if expires_at <= horizon:
+                due.append((expires_at, kind, lat, lon))
+        due.sort(key=lambda entry: entry[0])
+        return due
+
+    async def _refresh(self, kind: str, lat: float, lon: float):
+        if kind == "forecast":
+            await self.weather_app.fetch_predictions(lat, lon)
+        else:
+            await self.weather_app.fetch_weather_data(lat, lon)
+
+    # Runs a warming round of at most `max_calls` (CACHE_WARMER_MAX_CALLS by default) upstream calls
+    # and returns the number of refreshed, failed and deferred entries
+    async def warm(
+            self, locations: List[tuple], kinds: Tuple[str, ...] = ("forecast", "weather"), max_calls: Optional[int] = None
+    ) -> dict:
+        due = await self.due_entries(locations, datetime.utcnow(), kinds)
+        selected = due[:max_calls or config.CACHE_WARMER_MAX_CALLS]
+        semaphore = asyncio.Semaphore(config.CACHE_WARMER_MAX_CONCURRENT_CALLS)
+
+        async def refresh(kind, lat, lon) -> bool:
+            async with semaphore:
+                try:
+                    await self._refresh(kind, lat, lon)
+                except Exception as e: # pylint: disable=W0718 broad-exception-caught
+                    logger.warning("Could not warm %s cache of (%s, %s): %s", kind, lat, lon, e)
+                    return False
+                return True
+
+        results = await asyncio.gather(*(refresh(kind, lat, lon) for _, kind, lat, lon in selected))
+        stats = {
+            "refreshed": sum(results),
+            "failed": len(results) - sum(results),
+            # Left for the next rounds, when they are closer to expiry than the others
+            "deferred": len(due) - len(selected),
+        }
+        logger.info("Warmed cache: %(refreshed)d refreshed, %(failed)d failed, %(deferred)d deferred", stats)
+        return stats
+
+    # Centroids of the forecast tiles covering a bounding box.
+    # Raises ValueError if there are more than FORECAST_TILE_PREFILL_MAX_TILES of them.
+    @staticmethod
+    def tiles(min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> List[Tuple[float, float]]:
+        precision = config.FORECAST_TILE_PRECISION
+        count = geohash.count_covering(min_lat, min_lon, max_lat, max_lon, precision)
+        if count > config.FORECAST_TILE_PREFILL_MAX_TILES:
+            raise ValueError(f"{count} tiles cover the bounding box, more than {config.FORECAST_TILE_PREFILL_MAX_TILES}")
+        return [geohash.centroid(tile) for tile in geohash.covering(min_lat, min_lon, max_lat, max_lon, precision)]
+
+    # Caches in the background the forecast of the given tiles that is missing or about to expire,
+    # so that any parcel in them is served from the cache. Tiles already being prefilled are skipped.
+    # Returns the number of tiles queued. Raises ServiceOverloadedError if FORECAST_TILE_PREFILL_MAX_RUNNING
+    # prefills are already running.
+    def start_prefill(self, centroids: List[Tuple[float, float]]) -> int:
+        centroids = [centroid for centroid in dict.fromkeys(centroids) if centroid not in _prefilling_tiles]
+        if not centroids:
+            return 0
+        if len(_prefills) >= config.FORECAST_TILE_PREFILL_MAX_RUNNING:
+            # About when the running prefills are done, at the upstream call rate
+            retry_after = math.ceil(60 * len(_prefilling_tiles) / config.OPENWEATHERMAP_CALLS_PER_MINUTE)
+            raise ServiceOverloadedError("Forecast tile prefill", retry_after=max(retry_after, 1))
+        task = asyncio.create_task(without_deadline(with_priority(
+            Priority.SCHEDULED, self.warm(centroids, kinds=("forecast",), max_calls=len(centroids))
+        )))
+        _prefills.add(task)
+        _prefilling_tiles.update(centroids)
+
+        def done(task: asyncio.Task):
+            _prefills.discard(task)
+            _prefilling_tiles.difference_update(centroids)
+
+        task.add_done_callback(done)
+        return len(centroids)
@@ -0,0 +1,90 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import logging
+import math
+import time
+
+from src.core.context import call_timeout
+from src.core.exceptions import DeadlineExceededError, ServiceOverloadedError
+
+
+logger = logging.getLogger(__name__)
+
+
+# Limits the concurrent executions of an expensive code path (eg. cache misses, which call the
+# upstream and store hundreds of documents) so that a burst of them does not slow down the cheap ones.
+# Executions past `max_concurrent` wait in a queue of at most `max_queue` callers for up to
+# `queue_timeout` seconds (or the deadline of their request); the others are shed at once with
+# ServiceOverloadedError, along with an estimate of when to retry.
+class AdmissionController:
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        # Durations of the latest executions, to estimate when the queue drains
+        self._durations = deque(maxlen=50)
+
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.total_wait = 0.0
+
+    # Seconds after which an execution shed now would likely be admitted
+    def retry_after(self) -> int:
+        average = sum(self._durations) / len(self._durations) if self._durations else 1.0
+        return max(math.ceil(average * (self.waiting + self.max_concurrent) / self.max_concurrent), 1)
+
+    def _shed(self, reason: str):
+        self.shed += 1
+        logger.warning("%s overloaded, execution shed: %s", self.name, reason)
+        raise ServiceOverloadedError(self.name, self.retry_after())
+
+    async def _acquire(self):
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return
+        if self.waiting >= self.max_queue:
+            self._shed("queue full")
+
+        queued_at = time.monotonic()
+        self.waiting += 1
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), call_timeout(self.queue_timeout))
+        except (asyncio.TimeoutError, DeadlineExceededError):
+            self._shed("queue timeout")
+        finally:
+            self.waiting -= 1
+        self.total_wait += time.monotonic() - queued_at
+
+    # Runs the body of the `async with` block once admitted
+    @asynccontextmanager
+    async def admit(self):
+        await self._acquire()
+        self.admitted += 1
+        self.running += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._durations.append(time.monotonic() - started)
+            self.running -= 1
+            self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+            "max_concurrency": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "avg_wait_seconds": round(self.total_wait / self.queued, 3) if self.queued else 0.0,
+        }
@@ -6,16 +6,24 @@ import os
 import fastapi
 from fastapi.openapi.utils import get_openapi
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from fastapi.responses import JSONResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie, Document
+from pymongo.errors import ExecutionTimeout
 
 from src.core import config
 from src.core.security import create_gk_jwt_tokens
 from src import utils
 from src.core.dao import Dao
+from src.core.exceptions import ServiceOverloadedError
+from src.core.leader import LeaderElection
+from src.core.middlewares import DeadlineMiddleware, StalenessMiddleware
+from src.core.rate_limit import RateLimits, parse_limit
+from src.core.tokens import TokenManager
 from src.api.api import api_router
 from src.api.auth import auth_router
 from src.external_services.openweathermap import OpenWeatherMap
+from src.external_services.providers import create_provider
 from src.services.gatekeeper_service import GatekeeperServiceClient
 from src.services.farmcalendar_service import FarmCalendarServiceClient
 import src.scheduler as scheduler
@@ -27,12 +35,15 @@ class Application(fastapi.FastAPI):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.token_manager = TokenManager(create_gk_jwt_tokens, config.SERVICE_TOKEN_REFRESH_MARGIN_SECONDS)
         self.dao = self.setup_dao()
         self.weather_app = self.setup_weather_app()
+        self.rate_limits = self.setup_rate_limits()
         self.setup_uavs()
         self.setup_routes()
         self.setup_openapi()
         self.setup_middlewares()
+        self.setup_exception_handlers()
         self.setup_fc_jobs()
 
 
@@ -68,7 +79,7 @@ class Application(fastapi.FastAPI):
 
             await app.setup_authentication_tokens()
             gk_client = GatekeeperServiceClient(app)
-            logging.debug("Obtained JWT token from gatekeeper: %s", app.state.access_token)
+            logging.debug("Obtained JWT token from gatekeeper: %s", app.token_manager.access_token)
 
             service_directory = await gk_client.gk_service_directory()
             logging.debug("Fetched service directory: %s", service_directory)
@@ -89,7 +100,7 @@ class Application(fastapi.FastAPI):
                     response = await gk_client.gk_service_register(service_data)
                     logging.info("Registered new service: %s", response)
 
-            await gk_client.gk_logout(app.state.refresh_token)
+            await gk_client.gk_logout(app.token_manager.refresh_token)
 
 
         self.add_event_handler(event_type="startup", func=partial(add_router, app=self))
@@ -104,8 +115,26 @@ class Application(fastapi.FastAPI):
         async def add_dao(app: Application):
             app.weather_app.setup_dao(app.dao)
 
+        async def load_spray_profiles(app: Application):
+            app.weather_app.spray_profiles.load_file(config.SPRAY_PROFILES_FILE)
+            await app.weather_app.spray_profiles.load_from_db()
+
         self.add_event_handler(event_type="startup", func=partial(add_dao, app=self))
-        return OpenWeatherMap()
+        self.add_event_handler(event_type="startup", func=partial(load_spray_profiles, app=self))
+        return OpenWeatherMap(create_provider())
+
+    def setup_rate_limits(self):
+
+        async def add_dao(app: Application):
+            app.rate_limits.setup_dao(app.dao)
+
+        self.add_event_handler(event_type="startup", func=partial(add_dao, app=self))
+        return RateLimits(
+            parse_limit(config.RATE_LIMIT_DEFAULT),
+            {prefix: parse_limit(limit) for prefix, limit in config.RATE_LIMIT_ROUTES.items()},
+            config.RATE_LIMIT_SHARED,
+            config.RATE_LIMIT_SYNC_SECONDS
+        )
 
     def setup_uavs(self):
         logger.debug("Setup connection with external weather service")
@@ -138,6 +167,25 @@ class Application(fastapi.FastAPI):
     def setup_middlewares(self):
 
         self.add_middleware(TrustedHostMiddleware, allowed_hosts=config.EXTRA_ALLOWED_HOSTS)
+        self.add_middleware(StalenessMiddleware)
+        self.add_middleware(DeadlineMiddleware, default_timeout=config.REQUEST_TIMEOUT_SECONDS, route_timeouts=config.REQUEST_TIMEOUT_ROUTES)
+        return
+
+    def setup_exception_handlers(self):
+
+        # Shed executions are answered with 503 and the time after which they can be retried
+        async def service_overloaded(request: fastapi.Request, exc: ServiceOverloadedError):
+            return JSONResponse(
+                {"detail": exc.message}, status_code=503, headers={"Retry-After": str(exc.retry_after)}
+            )
+
+        self.add_exception_handler(ServiceOverloadedError, service_overloaded)
+
+        # Queries cut short by the deadline of the request (`maxTimeMS`) are answered as the deadline itself
+        async def query_timeout(request: fastapi.Request, exc: ExecutionTimeout):
+            return JSONResponse({"detail": "Request deadline exceeded"}, status_code=504)
+
+        self.add_exception_handler(ExecutionTimeout, query_timeout)
         return
 
     def setup_fc_jobs(self):
@@ -152,8 +200,30 @@ class Application(fastapi.FastAPI):
 
             scheduler.start_scheduler(app)
 
-        self.add_event_handler(event_type="startup", func=partial(start_scheduler, app=self))
+        # Only the process holding the scheduler lease runs the jobs
+        async def elect_scheduler(app: Application):
+            if not config.SCHEDULER_LEADER_ELECTION:
+                await start_scheduler(app)
+                return
+            app.state.scheduler_election = LeaderElection(
+                app.dao,
+                "scheduler",
+                config.SCHEDULER_LEASE_TTL_SECONDS,
+                config.SCHEDULER_LEASE_RENEW_SECONDS,
+                on_elected=partial(start_scheduler, app=app),
+                on_demoted=scheduler.stop_scheduler
+            )
+            app.state.scheduler_election.start()
+
+        async def resign_scheduler(app: Application):
+            election = getattr(app.state, "scheduler_election", None)
+            if election:
+                await election.stop()
+
+        self.add_event_handler(event_type="startup", func=partial(elect_scheduler, app=self))
+        self.add_event_handler(event_type="shutdown", func=partial(resign_scheduler, app=self))
         return
 
+    # Logs in to the Gatekeeper, unless a concurrent caller already did
     async def setup_authentication_tokens(self):
-        self.state.access_token, self.state.refresh_token = await create_gk_jwt_tokens()
+        await self.token_manager.refresh(stale=self.token_manager.access_token)
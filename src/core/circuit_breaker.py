@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from src.core.exceptions import CircuitOpenError, UpstreamUnavailableError
+
+
+logger = logging.getLogger(__name__)
+
+
+# Circuit breaker around an upstream endpoint.
+# After `failure_threshold` consecutive failures, calls slower than `slow_call_seconds` included,
+# the circuit opens and calls fail at once with CircuitOpenError for `reset_seconds`.
+# A single trial call is then let through (half open): its success closes the circuit,
+# its failure opens it again.
+class CircuitBreaker:
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, slow_call_seconds: float, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def _allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+            return True
+        # Open, or half open with the trial call in flight
+        return False
+
+    def _record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Circuit %s closed", self.name)
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def _record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning("Circuit %s opened after %d failures", self.name, self.failures)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    # Fails at once while the circuit is open, eg. before waiting for a call budget. Unlike `call`,
+    # it never lets the trial call through.
+    def check(self):
+        if self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_seconds:
+            raise CircuitOpenError(self.name)
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        if not self._allow():
+            raise CircuitOpenError(self.name)
+        start = time.monotonic()
+        try:
+            result = await func(*args, **kwargs)
+        except (asyncio.CancelledError, UpstreamUnavailableError):
+            # A cancelled or not admitted trial call tells nothing about the upstream, another one is let through
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+            raise
+        except Exception:
+            self._record_failure()
+            raise
+        if time.monotonic() - start > self.slow_call_seconds:
+            self._record_failure()
+        else:
+            self._record_success()
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"state": self.state, "failures": self.failures}
@@ -23,18 +23,184 @@ EXTRA_ALLOWED_HOSTS = os.environ.get('EXTRA_ALLOWED_HOSTS', "*").replace(' ', ''
 GATEKEEPER_URL = os.environ.get('GATEKEEPER_URL', '')
 WEATHER_SRV_GATEKEEPER_USER = os.environ.get('WEATHER_SRV_GATEKEEPER_USER', '')
 WEATHER_SRV_GATEKEEPER_PASSWORD = os.environ.get('WEATHER_SRV_GATEKEEPER_PASSWORD', '')
+# Seconds before expiry at which the service token obtained from the Gatekeeper is refreshed
+SERVICE_TOKEN_REFRESH_MARGIN_SECONDS = float(os.environ.get('SERVICE_TOKEN_REFRESH_MARGIN_SECONDS', '60'))
 
 # APP
-CURRENT_WEATHER_DATA_CACHE_TIME = os.environ.get('CURRENT_WEATHER_DATA_CACHE_TIME', 1)
+CURRENT_WEATHER_DATA_CACHE_TIME = float(os.environ.get('CURRENT_WEATHER_DATA_CACHE_TIME', '1'))
+# Hours a cached 5-day forecast is served before it is fetched again
+FORECAST_DATA_CACHE_TIME = float(os.environ.get('FORECAST_DATA_CACHE_TIME', '3'))
+# Hours stale cached data is still served at once while it is refreshed in the background.
+# Past them requests wait for fresh data.
+FORECAST_DATA_MAX_STALE_TIME = float(os.environ.get('FORECAST_DATA_MAX_STALE_TIME', '6'))
+CURRENT_WEATHER_DATA_MAX_STALE_TIME = float(os.environ.get('CURRENT_WEATHER_DATA_MAX_STALE_TIME', '3'))
+
+# FORECAST TILING
+# Whether forecasts are cached per geohash tile instead of per exact location
+FORECAST_TILING_ENABLED = os.environ.get('FORECAST_TILING_ENABLED', 'false').lower() == 'true'
+# Geohash length of the tiles: 5 is about 4.9 x 4.9 km, 6 about 1.2 x 0.6 km
+FORECAST_TILE_PRECISION = int(os.environ.get('FORECAST_TILE_PRECISION', '5'))
+# Tiles a single bounding box pre-fill may cover
+FORECAST_TILE_PREFILL_MAX_TILES = int(os.environ.get('FORECAST_TILE_PREFILL_MAX_TILES', '500'))
+# Pre-fills that may run in the background at once
+FORECAST_TILE_PREFILL_MAX_RUNNING = int(os.environ.get('FORECAST_TILE_PREFILL_MAX_RUNNING', '2'))
+
+# REQUEST DEADLINES
+# Seconds a request may take before its remaining work is cancelled and 504 returned, 0 to disable
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get('REQUEST_TIMEOUT_SECONDS', '20'))
+# Timeouts of path prefixes overriding REQUEST_TIMEOUT_SECONDS, as `prefix=seconds` pairs separated by commas
+REQUEST_TIMEOUT_ROUTES = {
+    prefix: float(seconds) for prefix, seconds in (
+        route.split('=') for route in os.environ.get(
+            'REQUEST_TIMEOUT_ROUTES', '/api/data/weather=10,/api/data/thi=10,/api/linkeddata/thi=10'
+        ).replace(' ', '').split(',') if route
+    )
+}
+# Seconds of the deadline kept to serve cached data when an upstream call is cut short
+REQUEST_DEADLINE_RESERVE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_RESERVE_SECONDS', '1'))
+# Timeout of the upstream HTTP calls outside of a request, or when the request has more time left
+UPSTREAM_TIMEOUT_SECONDS = float(os.environ.get('UPSTREAM_TIMEOUT_SECONDS', '5'))
+
+# RATE LIMITS
+# Requests per client (JWT subject) as `limit/seconds`, 0 to disable: RATE_LIMIT_DEFAULT for every route
+# and RATE_LIMIT_ROUTES for the groups of routes under a path prefix, as `prefix=limit/seconds` pairs
+RATE_LIMIT_DEFAULT = os.environ.get('RATE_LIMIT_DEFAULT', '600/60')
+RATE_LIMIT_ROUTES = {
+    prefix: limit for prefix, limit in (
+        route.split('=') for route in os.environ.get(
+            'RATE_LIMIT_ROUTES', '/api/data/flight_forecast5=60/60,/api/linkeddata/flight_forecast5=60/60'
+        ).replace(' ', '').split(',') if route
+    )
+}
+# Whether the limits hold across all the processes, through the database
+RATE_LIMIT_SHARED = os.environ.get('RATE_LIMIT_SHARED', 'false').lower() == 'true'
+RATE_LIMIT_SYNC_SECONDS = float(os.environ.get('RATE_LIMIT_SYNC_SECONDS', '5'))
+# JWT claims identifying the client, the first one present is used
+RATE_LIMIT_CLIENT_CLAIMS = [
+    claim for claim in os.environ.get('RATE_LIMIT_CLIENT_CLAIMS', 'sub,user_id').replace(' ', '').split(',') if claim
+]
+
+# ADMISSION CONTROL
+# Cache misses of user requests (upstream call and storage of the results) run at once
+COLD_PATH_MAX_CONCURRENT = int(os.environ.get('COLD_PATH_MAX_CONCURRENT', '8'))
+# Cache misses waiting for their turn; past it they are answered with 503 at once
+COLD_PATH_MAX_QUEUE = int(os.environ.get('COLD_PATH_MAX_QUEUE', '32'))
+COLD_PATH_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('COLD_PATH_QUEUE_TIMEOUT_SECONDS', '5'))
+# Forecasts of an ET0 batch loaded at once, below COLD_PATH_MAX_CONCURRENT so that a batch leaves room for other requests
+ET0_BATCH_CONCURRENCY = int(os.environ.get('ET0_BATCH_CONCURRENCY', '4'))
+
+# WEATHER PROVIDER
+# `openweathermap`, or `replay` to serve recorded payloads offline (load tests, benchmarks)
+WEATHER_PROVIDER = os.environ.get('WEATHER_PROVIDER', 'openweathermap')
+# Directory where OpenWeatherMap payloads are recorded for the replay provider, empty to disable
+WEATHER_PROVIDER_RECORD_PATH = os.environ.get('WEATHER_PROVIDER_RECORD_PATH', '')
+REPLAY_PROVIDER_PATH = os.environ.get('REPLAY_PROVIDER_PATH', 'replay')
+REPLAY_PROVIDER_LATENCY_MS = float(os.environ.get('REPLAY_PROVIDER_LATENCY_MS', '0'))
+REPLAY_PROVIDER_JITTER_MS = float(os.environ.get('REPLAY_PROVIDER_JITTER_MS', '0'))
+# Probability of an injected upstream error
+REPLAY_PROVIDER_ERROR_RATE = float(os.environ.get('REPLAY_PROVIDER_ERROR_RATE', '0'))
+# Secondary provider queried when the primary is slow to answer a user request, empty to disable
+WEATHER_PROVIDER_HEDGE = os.environ.get('WEATHER_PROVIDER_HEDGE', '')
+# Percentile of the recent primary latencies after which the secondary is queried
+WEATHER_PROVIDER_HEDGE_PERCENTILE = float(os.environ.get('WEATHER_PROVIDER_HEDGE_PERCENTILE', '95'))
+WEATHER_PROVIDER_HEDGE_INITIAL_DELAY_MS = float(os.environ.get('WEATHER_PROVIDER_HEDGE_INITIAL_DELAY_MS', '1000'))
+WEATHER_PROVIDER_HEDGE_MIN_DELAY_MS = float(os.environ.get('WEATHER_PROVIDER_HEDGE_MIN_DELAY_MS', '50'))
+
+# OPENWEATHERMAP CIRCUIT BREAKER
+# Consecutive failed (or slower than OPENWEATHERMAP_BREAKER_SLOW_CALL_SECONDS) calls to an endpoint that open its circuit
+OPENWEATHERMAP_BREAKER_FAILURES = int(os.environ.get('OPENWEATHERMAP_BREAKER_FAILURES', '5'))
+OPENWEATHERMAP_BREAKER_SLOW_CALL_SECONDS = float(os.environ.get('OPENWEATHERMAP_BREAKER_SLOW_CALL_SECONDS', '4'))
+# Seconds calls fail at once before a trial call is let through
+OPENWEATHERMAP_BREAKER_RESET_SECONDS = float(os.environ.get('OPENWEATHERMAP_BREAKER_RESET_SECONDS', '30'))
+# Hours of the most recent cached data served while OpenWeatherMap cannot be reached
+OPENWEATHERMAP_FALLBACK_MAX_AGE = float(os.environ.get('OPENWEATHERMAP_FALLBACK_MAX_AGE', '48'))
+
+# OPENWEATHERMAP CALL BUDGET
+OPENWEATHERMAP_CALLS_PER_MINUTE = float(os.environ.get('OPENWEATHERMAP_CALLS_PER_MINUTE', '60'))
+# 0 for no daily limit
+OPENWEATHERMAP_CALLS_PER_DAY = int(os.environ.get('OPENWEATHERMAP_CALLS_PER_DAY', '0'))
+# Fraction of the daily quota only available to user requests
+OPENWEATHERMAP_INTERACTIVE_RESERVE = float(os.environ.get('OPENWEATHERMAP_INTERACTIVE_RESERVE', '0.1'))
+OPENWEATHERMAP_MAX_CONCURRENT_INTERACTIVE = int(os.environ.get('OPENWEATHERMAP_MAX_CONCURRENT_INTERACTIVE', '10'))
+OPENWEATHERMAP_MAX_CONCURRENT_SCHEDULED = int(os.environ.get('OPENWEATHERMAP_MAX_CONCURRENT_SCHEDULED', '4'))
+OPENWEATHERMAP_MAX_CONCURRENT_WARMING = int(os.environ.get('OPENWEATHERMAP_MAX_CONCURRENT_WARMING', '2'))
+# Seconds a call waits for the rate limit before giving up
+OPENWEATHERMAP_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('OPENWEATHERMAP_QUEUE_TIMEOUT_SECONDS', '10'))
+
+# CACHE WARMER
+# Refreshes the cached forecast and current weather of the known parcels before they expire
+CACHE_WARMER_ENABLED = os.environ.get('CACHE_WARMER_ENABLED', 'true').lower() == 'true'
+CACHE_WARMER_INTERVAL_MINUTES = float(os.environ.get('CACHE_WARMER_INTERVAL_MINUTES', '5'))
+# Entries expiring within this many minutes are refreshed
+CACHE_WARMER_LEAD_MINUTES = float(os.environ.get('CACHE_WARMER_LEAD_MINUTES', '15'))
+# Maximum upstream calls per warming round, soonest expiring entries first
+CACHE_WARMER_MAX_CALLS = int(os.environ.get('CACHE_WARMER_MAX_CALLS', '60'))
+CACHE_WARMER_MAX_CONCURRENT_CALLS = int(os.environ.get('CACHE_WARMER_MAX_CONCURRENT_CALLS', '4'))
+
+# ACCUMULATED INDICATORS
+# Day of year (MM-DD) on which accumulation restarts
+ACCUMULATION_SEASON_START = os.environ.get('ACCUMULATION_SEASON_START', '01-01')
+GDD_BASE_TEMPERATURE = float(os.environ.get('GDD_BASE_TEMPERATURE', '10'))
+CHILL_MIN_TEMPERATURE = float(os.environ.get('CHILL_MIN_TEMPERATURE', '0'))
+CHILL_MAX_TEMPERATURE = float(os.environ.get('CHILL_MAX_TEMPERATURE', '7.2'))
+THI_HEAT_STRESS_THRESHOLD = float(os.environ.get('THI_HEAT_STRESS_THRESHOLD', '72'))
+# Longest gap (hours) between two samples accounted for
+ACCUMULATION_MAX_GAP_HOURS = float(os.environ.get('ACCUMULATION_MAX_GAP_HOURS', '6'))
+
+# SPRAY PROFILES
+# JSON file with a list of spray profiles loaded on startup
+SPRAY_PROFILES_FILE = os.environ.get('SPRAY_PROFILES_FILE', '/data/spray_profiles.json')
+# Seconds a profile read from MongoDB is served before being read again
+SPRAY_PROFILES_CACHE_SECONDS = float(os.environ.get('SPRAY_PROFILES_CACHE_SECONDS', '300'))
+
+# SPATIAL INTERPOLATION
+# Maximum distance (meters) of cached locations used to estimate a forecast
+SPATIAL_INTERPOLATION_MAX_DISTANCE = float(os.environ.get('SPATIAL_INTERPOLATION_MAX_DISTANCE', '5000'))
+# Number of nearest cached locations used and minimum number required for an estimate
+SPATIAL_INTERPOLATION_NEIGHBOURS = int(os.environ.get('SPATIAL_INTERPOLATION_NEIGHBOURS', '4'))
+SPATIAL_INTERPOLATION_MIN_NEIGHBOURS = int(os.environ.get('SPATIAL_INTERPOLATION_MIN_NEIGHBOURS', '2'))
+SPATIAL_INTERPOLATION_POWER = float(os.environ.get('SPATIAL_INTERPOLATION_POWER', '2'))
 
 # FARM CALENDAR
 PUSH_THI_TO_FARMCALENDAR=os.environ.get('PUSH_THI_TO_FARMCALENDAR', '')
 PUSH_FLIGHT_FORECAST_TO_FARMCALENDAR=os.environ.get('PUSH_FLIGHT_FORECAST_TO_FARMCALENDAR', '')
 PUSH_SPRAY_F_TO_FARMCALENDAR=os.environ.get('PUSH_SPRAY_F_TO_FARMCALENDAR', '')
 FARM_CALENDAR_URL = os.environ.get('FARM_CALENDAR_URL', 'http://farmcalendar:8002')
+# Maximum number of observations posted at the same time
+FARM_CALENDAR_MAX_CONCURRENT_REQUESTS = int(os.environ.get('FARM_CALENDAR_MAX_CONCURRENT_REQUESTS', '8'))
+# Endpoint accepting a list of observations, used if the Farm Calendar supports it. Empty to disable.
+FARM_CALENDAR_BULK_ENDPOINT = os.environ.get('FARM_CALENDAR_BULK_ENDPOINT', '/api/v1/Observations/bulk/')
+# Maximum number of observations per bulk request
+FARM_CALENDAR_BULK_SIZE = int(os.environ.get('FARM_CALENDAR_BULK_SIZE', '100'))
+# Observations posted per batch by the outbox drainer, and period (seconds) of the drainer
+FARM_CALENDAR_OUTBOX_BATCH_SIZE = int(os.environ.get('FARM_CALENDAR_OUTBOX_BATCH_SIZE', '200'))
+FARM_CALENDAR_OUTBOX_DRAIN_SECONDS = int(os.environ.get('FARM_CALENDAR_OUTBOX_DRAIN_SECONDS', '30'))
+# Attempts after which an observation is given up, and exponential backoff between attempts (seconds)
+FARM_CALENDAR_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('FARM_CALENDAR_OUTBOX_MAX_ATTEMPTS', '10'))
+FARM_CALENDAR_OUTBOX_RETRY_BASE_SECONDS = float(os.environ.get('FARM_CALENDAR_OUTBOX_RETRY_BASE_SECONDS', '30'))
+FARM_CALENDAR_OUTBOX_RETRY_MAX_SECONDS = float(os.environ.get('FARM_CALENDAR_OUTBOX_RETRY_MAX_SECONDS', '3600'))
+# Whether changed forecast observations update the ones already posted (PATCH) instead of adding new ones
+FARM_CALENDAR_PATCH_CHANGED = os.environ.get('FARM_CALENDAR_PATCH_CHANGED', 'false').lower() == 'true'
 
 # TASKS
 INTERVAL_THI_TO_FARMCALENDAR = os.environ.get('INTERVAL_HOURS_THI_TO_FARMCALENDAR', 8)
+# Maximum number of location jobs running at the same time
+SCHEDULER_MAX_CONCURRENT_JOBS = int(os.environ.get('SCHEDULER_MAX_CONCURRENT_JOBS', '10'))
+# Whether only the process holding the scheduler lease in MongoDB runs the scheduled jobs,
+# required with several workers or replicas
+SCHEDULER_LEADER_ELECTION = os.environ.get('SCHEDULER_LEADER_ELECTION', 'true').lower() == 'true'
+# Duration of the lease and renewal period (seconds). A dead leader is replaced within their sum.
+SCHEDULER_LEASE_TTL_SECONDS = float(os.environ.get('SCHEDULER_LEASE_TTL_SECONDS', '30'))
+SCHEDULER_LEASE_RENEW_SECONDS = float(os.environ.get('SCHEDULER_LEASE_RENEW_SECONDS', '10'))
+# Engine of the location jobs: `apscheduler`, or `heap` for very large numbers of parcels (in memory)
+SCHEDULER_ENGINE = os.environ.get('SCHEDULER_ENGINE', 'apscheduler')
+# Job store of the scheduled jobs: `mongodb` (persisted across restarts) or `memory`
+SCHEDULER_JOBSTORE = os.environ.get('SCHEDULER_JOBSTORE', 'mongodb')
+SCHEDULER_JOBS_COLLECTION = os.environ.get('SCHEDULER_JOBS_COLLECTION', 'scheduler_jobs')
+# Seconds after its scheduled time a missed run is still executed, eg. after a restart
+SCHEDULER_MISFIRE_GRACE_SECONDS = int(os.environ.get('SCHEDULER_MISFIRE_GRACE_SECONDS', '3600'))
+# Whether several missed runs of a job are executed only once
+SCHEDULER_COALESCE = os.environ.get('SCHEDULER_COALESCE', 'true').lower() == 'true'
 
 # JWT
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', '240'))
@@ -0,0 +1,57 @@
+from contextvars import ContextVar
+from datetime import datetime
+import time
+from typing import Awaitable, Optional
+
+from src.core.exceptions import DeadlineExceededError
+
+
+# Staleness of the data served by the current request.
+# Set by the data layer when cached data past its cache time is served, and reported
+# in the response headers by the StalenessMiddleware.
+class ResponseStaleness:
+
+    def __init__(self):
+        # Creation time of the oldest stale data served
+        self.created_at: Optional[datetime] = None
+
+
+staleness: ContextVar[Optional[ResponseStaleness]] = ContextVar("staleness", default=None)
+
+
+# Flags the current response as serving stale data created at `created_at` (naive UTC).
+# Outside of a request it does nothing.
+def mark_stale(created_at: datetime):
+    current = staleness.get()
+    if current is not None and (current.created_at is None or created_at < current.created_at):
+        current.created_at = created_at
+
+
+# Deadline of the current request as a time.monotonic() value, set by the DeadlineMiddleware
+deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+# Seconds left before the deadline of the current request, None without a deadline
+def time_left() -> Optional[float]:
+    current = deadline.get()
+    return None if current is None else current - time.monotonic()
+
+
+# Timeout of a call made for the current request: `default`, shortened to the time left before
+# its deadline minus `reserve` seconds (kept eg. to fall back on cached data).
+# Raises DeadlineExceededError when no time is left for the call.
+def call_timeout(default: float, reserve: float = 0.0) -> float:
+    left = time_left()
+    if left is None:
+        return default
+    left -= reserve
+    if left <= 0:
+        raise DeadlineExceededError()
+    return min(default, left)
+
+
+# Runs a coroutine free of the deadline of the current request, for background work outliving it.
+# Meant for new tasks, which get their own copy of the context.
+async def without_deadline(coro: Awaitable):
+    deadline.set(None)
+    return await coro
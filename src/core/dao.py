@@ -1,13 +1,24 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import logging
-from typing import List, Optional
+import math
+from typing import Dict, List, Optional, Tuple
 from uuid import uuid4
 
 from beanie.odm.operators.find.logical import And
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 
 from src.core import config
+from src.core.context import call_timeout, time_left
+from src import utils
+from src.indicators import season_start
+from src.models.indicators import AccumulatedIndicators
+from src.models.lease import Lease
+from src.models.outbox import OutboxEntry, OutboxStatus
 from src.models.point import Point, GeoJSON, PointTypeEnum, GeoJSONTypeEnum
+from src.models.upstream_usage import UpstreamUsage
 from src.models.prediction import Prediction
+from src.models.rate_limit import RateLimitHits
 from src.models.weather_data import WeatherData
 
 
@@ -18,6 +29,14 @@ class Dao():
     def __init__(self, db_client):
         self.db = db_client
 
+    # `maxTimeMS` of the queries made for a request, so that MongoDB stops working on them
+    # once the deadline of the request is exceeded. No limit outside of a request.
+    @staticmethod
+    def _time_limit() -> dict:
+        if time_left() is None:
+            return {}
+        return {"max_time_ms": max(int(call_timeout(math.inf) * 1000), 1)}
+
     # Adds a dummy point with a predefined latitude and longitude to the database.
     async def add_dummy_point(self) -> Point:
         try:
@@ -34,7 +53,7 @@ class Dao():
     # Finds and returns a Point object based on latitude and longitude.
     # Returns None if the point is not found.
     async def find_point(self, lat: float, lon: float) -> Optional[Point]:
-        return await Point.find_one(And(Point.location.coordinates == [lat, lon], Point.location.type == GeoJSONTypeEnum.POINT))
+        return await Point.find_one(And(Point.location.coordinates == [lat, lon], Point.location.type == GeoJSONTypeEnum.POINT), **self._time_limit())
 
     # Creates a new Point object with the given latitude and longitude.
     # The point is saved to the database and returned.
@@ -45,35 +64,245 @@ class Dao():
         return await Point(**{'type': PointTypeEnum.POI, 'location': GeoJSON(**{'coordinates': [lat, lon], 'type': GeoJSONTypeEnum.POINT})}).create()
 
     # Finds and returns a list of Prediction objects for a specific location (lat, lon).
-    # Prediction objects must have been created no more that 3 hours ago.
+    # Prediction objects must have been created no more that `max_age` hours ago
+    # (FORECAST_DATA_CACHE_TIME by default).
     # If the point is not found, returns an empty list.
-    async def find_predictions_for_point(self, lat, lon) -> List[Prediction]:
-        point = await Point.find_one(And(Point.location.coordinates == [lat, lon], Point.location.type == GeoJSONTypeEnum.POINT))
+    async def find_predictions_for_point(self, lat, lon, max_age: Optional[float] = None) -> List[Prediction]:
+        point = await Point.find_one(And(Point.location.coordinates == [lat, lon], Point.location.type == GeoJSONTypeEnum.POINT), **self._time_limit())
         if not point:
             return []
 
         logger.debug("Location was cached")
-        three_hours_ago = datetime.utcnow() - timedelta(hours=3)
-        return await Prediction.find(Prediction.spatial_entity == point, Prediction.created_at >= three_hours_ago).to_list()
+        return await self._find_fresh_predictions(point, max_age)
+
+    # Fresh predictions of a point. When a forecast was refreshed before the previous one expired
+    # (eg. by the cache warmer) only the latest value of each period and measurement is kept.
+    async def _find_fresh_predictions(self, point: Point, max_age: Optional[float] = None) -> List[Prediction]:
+        fresh_since = datetime.utcnow() - timedelta(hours=max_age or config.FORECAST_DATA_CACHE_TIME)
+        predictions = await Prediction.find(
+            Prediction.spatial_entity == point, Prediction.created_at >= fresh_since, **self._time_limit()
+        ).sort(+Prediction.created_at).to_list()
+        latest = {}
+        for prediction in predictions:
+            latest[(prediction.timestamp, prediction.measurement_type)] = prediction
+        return list(latest.values())
+
+    # Finds the nearest points within `radius` meters that hold fresh predictions, using the
+    # 2dsphere index of the points collection. Returns up to `limit` (distance, predictions) tuples
+    # sorted by distance.
+    # Points store their coordinates as [lat, lon], so the index sees latitude as longitude.
+    # The index query is used as a prefilter with a radius widened accordingly and
+    # the exact distance is calculated afterwards.
+    async def find_predictions_for_radius(
+            self, lat: float, lon: float, radius: float, limit: int
+    ) -> List[Tuple[float, List[Prediction]]]:
+        widened_radius = radius / max(math.cos(math.radians(lat)), 0.1)
+        candidates = await Point.find({
+            "location": {
+                "$near": {
+                    "$geometry": {"type": GeoJSONTypeEnum.POINT.value, "coordinates": [lat, lon]},
+                    "$maxDistance": widened_radius,
+                }
+            }
+        }, **self._time_limit()).limit(limit * 4).to_list()
 
-    # Finds and returns a list of Prediction objects for a specific location within a radius.
-    async def find_prediction_for_radius(self, lat: float, lon: float) -> List[Prediction]:
-        ...
+        results = []
+        for point in candidates:
+            point_lat, point_lon = point.location.coordinates
+            distance = utils.haversine_distance(lat, lon, point_lat, point_lon)
+            if distance > radius:
+                continue
+            predictions = await self._find_fresh_predictions(point)
+            if predictions:
+                results.append((distance, predictions))
 
-    # Finds and returns WeatherData for a specific location (lat, lon).
+        results.sort(key=lambda result: result[0])
+        return results[:limit]
+
+    # Finds and returns the latest WeatherData for a specific location (lat, lon), created no more
+    # than `max_age` hours ago (CURRENT_WEATHER_DATA_CACHE_TIME by default).
     # If the point is not found, returns None.
-    async def find_weather_data_for_point(self, lat, lon) -> Optional[WeatherData]:
-        point = await Point.find_one(And(Point.location.coordinates == [lat, lon], Point.location.type == GeoJSONTypeEnum.POINT))
+    async def find_weather_data_for_point(self, lat, lon, max_age: Optional[float] = None) -> Optional[WeatherData]:
+        point = await Point.find_one(And(Point.location.coordinates == [lat, lon], Point.location.type == GeoJSONTypeEnum.POINT), **self._time_limit())
         if not point:
             return None
 
         logger.debug("Location was cached")
-        three_hours_ago = datetime.utcnow() - timedelta(hours=config.CURRENT_WEATHER_DATA_CACHE_TIME)
-        return await WeatherData.find_one(WeatherData.spatial_entity == point, WeatherData.created_at >= three_hours_ago)
+        fresh_since = datetime.utcnow() - timedelta(hours=max_age or config.CURRENT_WEATHER_DATA_CACHE_TIME)
+        return await WeatherData.find(
+            WeatherData.spatial_entity == point, WeatherData.created_at >= fresh_since, **self._time_limit()
+        ).sort(-WeatherData.created_at).first_or_none()
+
+    # Creation time of the latest fresh forecast of each of `forecast_locations` and current weather data
+    # of each of `weather_locations` that are cached, as {(lat, lon): created_at} dictionaries.
+    # Only the entries of the given locations are read, through the location and creation time index.
+    async def find_cache_times(
+            self, forecast_locations: List[tuple], weather_locations: List[tuple]
+    ) -> Tuple[Dict[tuple, datetime], Dict[tuple, datetime]]:
+        now = datetime.utcnow()
+        windows = (
+            (Prediction, forecast_locations, now - timedelta(hours=config.FORECAST_DATA_CACHE_TIME)),
+            (WeatherData, weather_locations, now - timedelta(hours=config.CURRENT_WEATHER_DATA_CACHE_TIME)),
+        )
+        results = []
+        for model, locations, fresh_since in windows:
+            times = {}
+            if locations:
+                async for group in model.get_motor_collection().aggregate([
+                    {"$match": {
+                        "$or": [{"spatial_entity.location.coordinates": list(location)} for location in locations],
+                        "created_at": {"$gte": fresh_since},
+                    }},
+                    {"$group": {"_id": "$spatial_entity.location.coordinates", "created_at": {"$max": "$created_at"}}},
+                ]):
+                    times[tuple(group["_id"])] = group["created_at"]
+            results.append(times)
+        return results[0], results[1]
 
     # Saves the given weather data for a specific point.
     # Creates and returns the WeatherData object.
     async def save_weather_data_for_point(self, point: Point, **kwargs) -> WeatherData:
         return await WeatherData(spatial_entity=point, **kwargs).create()
 
+    # Finds the indicators accumulated in the current season for a specific location (lat, lon).
+    # Returns None if the point or its accumulators are not found.
+    async def find_accumulated_indicators(self, lat: float, lon: float) -> Optional[AccumulatedIndicators]:
+        point = await self.find_point(lat, lon)
+        if not point:
+            return None
+        return await AccumulatedIndicators.find_one(
+            AccumulatedIndicators.point_id == point.id,
+            AccumulatedIndicators.season_start == season_start(datetime.utcnow()),
+            **self._time_limit()
+        )
+
+    # Acquires or renews the lease `name` for `owner` for `ttl` seconds.
+    # The lease is granted if it is free, expired or already held by `owner`, atomically,
+    # so at most one owner holds it at any time. Returns whether `owner` holds the lease.
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        now = datetime.utcnow()
+        try:
+            lease = await Lease.get_motor_collection().find_one_and_update(
+                {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl), "renewed_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Held by another owner
+            return False
+        return lease is not None and lease["owner"] == owner
+
+    # Releases the lease `name` if held by `owner`, so that another owner can take it over at once
+    async def release_lease(self, name: str, owner: str):
+        await Lease.get_motor_collection().update_one(
+            {"_id": name, "owner": owner},
+            {"$set": {"expires_at": datetime.utcnow()}}
+        )
+
+    # Adds `calls` to the calls made to `upstream` on `day` and returns the total of all processes
+    async def add_upstream_usage(self, upstream: str, day: str, calls: int) -> int:
+        usage = await UpstreamUsage.get_motor_collection().find_one_and_update(
+            {"_id": f"{upstream}:{day}"},
+            {"$inc": {"calls": calls}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return usage["calls"]
+
+    # Adds the hits of the clients of a rate limit, by (client, window index) of `window` seconds,
+    # and returns the totals of all processes
+    async def add_rate_limit_hits(self, name: str, hits: Dict[Tuple[str, int], int], window: float) -> Dict[Tuple[str, int], int]:
+        ids = {f"{name}:{client}:{index}": (client, index) for client, index in hits}
+        operations = [
+            UpdateOne(
+                {"_id": f"{name}:{client}:{index}"},
+                {
+                    "$inc": {"hits": count},
+                    "$setOnInsert": {"expires_at": datetime.fromtimestamp((index + 2) * window, timezone.utc)},
+                },
+                upsert=True
+            )
+            for (client, index), count in hits.items()
+        ]
+        collection = RateLimitHits.get_motor_collection()
+        await collection.bulk_write(operations, ordered=False)
+        return {
+            ids[document["_id"]]: document["hits"]
+            async for document in collection.find({"_id": {"$in": list(ids)}}, {"hits": 1})
+        }
+
+    # Enqueues observations in the Farm Calendar outbox, keyed by their idempotency key.
+    # Observations whose fingerprint did not change since they were enqueued are left untouched,
+    # changed ones are enqueued again keeping the id of the observation already in the Farm Calendar.
+    # Returns the number of new and changed observations.
+    async def enqueue_outbox(self, entries: List[OutboxEntry]) -> Tuple[int, int]:
+        if not entries:
+            return 0, 0
+        collection = OutboxEntry.get_motor_collection()
+        fingerprints = {
+            document["_id"]: document.get("fingerprint")
+            async for document in collection.find({"_id": {"$in": [e.id for e in entries]}}, {"fingerprint": 1})
+        }
+
+        now = datetime.utcnow()
+        operations = []
+        new = changed = 0
+        for entry in entries:
+            if entry.id not in fingerprints:
+                entry.next_attempt_at = entry.created_at = now
+                operations.append(UpdateOne(
+                    {"_id": entry.id}, {"$setOnInsert": entry.model_dump(by_alias=True)}, upsert=True
+                ))
+                new += 1
+            elif fingerprints[entry.id] != entry.fingerprint:
+                operations.append(UpdateOne({"_id": entry.id}, {"$set": {
+                    "payload": entry.payload,
+                    "fingerprint": entry.fingerprint,
+                    "updatable": entry.updatable,
+                    "status": OutboxStatus.PENDING.value,
+                    "attempts": 0,
+                    "next_attempt_at": now,
+                    "sent_at": None,
+                    "last_error": None,
+                }}))
+                changed += 1
+        if operations:
+            await collection.bulk_write(operations, ordered=False)
+        return new, changed
+
+    # Finds the pending outbox entries due for an attempt, oldest first
+    async def find_due_outbox(self, limit: int) -> List[OutboxEntry]:
+        return await OutboxEntry.find(
+            OutboxEntry.status == OutboxStatus.PENDING,
+            OutboxEntry.next_attempt_at <= datetime.utcnow()
+        ).sort(+OutboxEntry.next_attempt_at).limit(limit).to_list()
+
+    # Marks posted outbox entries as sent, with the id of the observation created in the Farm Calendar if known.
+    # An entry changed while it was being posted is left pending, so that its new payload is posted too.
+    async def mark_outbox_sent(self, sent: List[Tuple[OutboxEntry, Optional[str]]]):
+        if not sent:
+            return
+        now = datetime.utcnow()
+        operations = []
+        for entry, remote_id in sent:
+            operations.append(UpdateOne(
+                {"_id": entry.id, "fingerprint": entry.fingerprint},
+                {"$set": {"status": OutboxStatus.SENT.value, "sent_at": now}, "$inc": {"attempts": 1}}
+            ))
+            if remote_id:
+                # The posted observation exists in the Farm Calendar even if it changed since
+                operations.append(UpdateOne({"_id": entry.id}, {"$set": {"remote_id": remote_id}}))
+        await OutboxEntry.get_motor_collection().bulk_write(operations, ordered=False)
 
+    # Schedules the next attempt of a failed entry with exponential backoff, or gives up
+    # after `max_attempts`. An entry changed while it was being posted keeps its fresh schedule.
+    async def mark_outbox_failed(self, entry: OutboxEntry, error: str, max_attempts: int, base_delay: float, max_delay: float):
+        attempts = entry.attempts + 1
+        update = {"attempts": attempts, "last_error": error}
+        if attempts >= max_attempts:
+            update["status"] = OutboxStatus.FAILED.value
+        else:
+            delay = min(base_delay * 2 ** (attempts - 1), max_delay)
+            update["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=delay)
+        await OutboxEntry.get_motor_collection().update_one({"_id": entry.id, "fingerprint": entry.fingerprint}, {"$set": update})
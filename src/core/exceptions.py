@@ -10,7 +10,44 @@ class InvalidWeatherDataError(Exception):
         super().__init__(self.message)
 
 
+class SprayProfileNotFoundError(Exception):
+    def __init__(self, profile: str):
+        self.message = f"Spray profile '{profile}' not found"
+        super().__init__(self.message)
+
+
 class RefreshJWTTokenError(Exception):
     def __init__(self, service_name):
         self.message = f"Authentication failed for {service_name} service. JWT token may be expired."
         super().__init__(self.message)
+
+
+# An upstream service is not called, to protect it or our quota
+class UpstreamUnavailableError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    def __init__(self, name: str):
+        super().__init__(f"Circuit breaker for {name} is open")
+
+
+class UpstreamBudgetExceededError(UpstreamUnavailableError):
+    def __init__(self, name: str, reason: str):
+        super().__init__(f"Call budget of {name} exceeded: {reason}")
+
+
+# The deadline of the current request leaves no time for an upstream call
+class DeadlineExceededError(UpstreamUnavailableError):
+    def __init__(self):
+        super().__init__("Request deadline exceeded")
+
+
+# An expensive execution is shed to protect the service; it can be retried after `retry_after` seconds
+class ServiceOverloadedError(Exception):
+    def __init__(self, name: str, retry_after: int):
+        self.retry_after = retry_after
+        self.message = f"{name} overloaded, retry after {retry_after}s"
+        super().__init__(self.message)
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import os
+import socket
+from typing import Awaitable, Callable, Optional
+from uuid import uuid4
+
+from src.core.dao import Dao
+
+
+logger = logging.getLogger(__name__)
+
+
+# Elects a single leader among all the processes sharing the database through a lease.
+# The leader renews the lease every `renew_interval` seconds; if it dies, another process
+# takes over within `ttl` + `renew_interval` seconds. A leader that fails to renew its
+# lease (eg. database unreachable) steps down before the lease expires.
+# `on_elected` runs in its own task, so that slow startup work never delays the renewals.
+class LeaderElection:
+
+    def __init__(
+            self,
+            dao: Dao,
+            name: str,
+            ttl: float,
+            renew_interval: float,
+            on_elected: Callable[[], Awaitable[None]],
+            on_demoted: Callable[[], Awaitable[None]]
+    ):
+        self.dao = dao
+        self.name = name
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+        # Startup of the leader in progress, while the lease keeps being renewed
+        self._starting: Optional[asyncio.Task] = None
+
+    async def _campaign(self) -> bool:
+        try:
+            return await asyncio.wait_for(
+                self.dao.acquire_lease(self.name, self.owner, self.ttl), self.renew_interval
+            )
+        except Exception as e: # pylint: disable=W0718 broad-exception-caught
+            logger.error("Lease %s could not be acquired", self.name)
+            logger.exception(e)
+            return False
+
+    # Runs one election round and handles a change of leadership
+    async def step(self):
+        elected = await self._campaign()
+        if elected and not self.is_leader:
+            logger.info("%s elected leader for %s", self.owner, self.name)
+            self.is_leader = True
+            self._starting = asyncio.create_task(self._start())
+        elif not elected and self.is_leader:
+            logger.warning("%s lost leadership for %s", self.owner, self.name)
+            await self._demote()
+
+    async def _start(self):
+        try:
+            await self.on_elected()
+        except Exception as e: # pylint: disable=W0718 broad-exception-caught
+            # Retried on the next round, while still holding the lease
+            logger.error("%s failed to start as leader for %s", self.owner, self.name)
+            logger.exception(e)
+            self.is_leader = False
+
+    async def _demote(self):
+        self.is_leader = False
+        if self._starting is not None:
+            self._starting.cancel()
+            self._starting = None
+        await self.on_demoted()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.step()
+            except Exception as e: # pylint: disable=W0718 broad-exception-caught
+                logger.exception(e)
+            await asyncio.sleep(self.renew_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    # Stops campaigning and releases the lease so that another process takes over at once
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.is_leader:
+            await self._demote()
+            try:
+                await self.dao.release_lease(self.name, self.owner)
+            except Exception as e: # pylint: disable=W0718 broad-exception-caught
+                # The lease then expires after its ttl
+                logger.exception(e)
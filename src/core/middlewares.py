@@ -0,0 +1,104 @@
+import asyncio
+from datetime import datetime
+import logging
+import time
+from typing import Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.core.context import ResponseStaleness, deadline, staleness
+
+
+logger = logging.getLogger(__name__)
+
+
+# Adds `X-Data-Stale`, `X-Data-Age` (seconds) and `Warning: 110` headers to the responses
+# that serve stale cached data, eg. while OpenWeatherMap is unavailable
+class StalenessMiddleware:
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = ResponseStaleness()
+        token = staleness.set(state)
+
+        async def send_with_staleness(message: Message):
+            if message["type"] == "http.response.start" and state.created_at is not None:
+                age = max(int((datetime.utcnow() - state.created_at).total_seconds()), 0)
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Data-Stale", "true")
+                headers.append("X-Data-Age", str(age))
+                headers.append("Warning", '110 - "Response is Stale"')
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_staleness)
+        finally:
+            staleness.reset(token)
+
+
+# Gives each request a deadline: the timeout of the longest matching path prefix in `route_timeouts`,
+# `default_timeout` otherwise, shortened by the client with the `X-Request-Timeout` header (seconds).
+# The deadline is shared with the upstream and database calls made for the request through the
+# `deadline` context variable; the work left when it is exceeded is cancelled and 504 returned.
+# A timeout of 0 disables the deadline.
+class DeadlineMiddleware:
+
+    header = "X-Request-Timeout"
+
+    def __init__(self, app: ASGIApp, default_timeout: float, route_timeouts: Optional[Dict[str, float]] = None):
+        self.app = app
+        self.default_timeout = default_timeout
+        # Longest prefixes first
+        self.route_timeouts = sorted((route_timeouts or {}).items(), key=lambda route: len(route[0]), reverse=True)
+
+    def timeout_for(self, scope: Scope) -> float:
+        timeout = next(
+            (seconds for prefix, seconds in self.route_timeouts if scope["path"].startswith(prefix)),
+            self.default_timeout
+        )
+        requested = Headers(scope=scope).get(self.header)
+        if requested:
+            try:
+                requested = float(requested)
+            except ValueError:
+                return timeout
+            if requested > 0:
+                timeout = min(timeout, requested) if timeout else requested
+        return timeout
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        timeout = self.timeout_for(scope) if scope["type"] == "http" else 0
+        if not timeout:
+            await self.app(scope, receive, send)
+            return
+
+        started = False
+
+        async def send_tracking_start(message: Message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        token = deadline.set(time.monotonic() + timeout)
+        budget = asyncio.timeout(timeout)
+        try:
+            async with budget:
+                await self.app(scope, receive, send_tracking_start)
+        except TimeoutError:
+            if not budget.expired():
+                raise
+            logger.warning("%s %s cancelled after its %ss deadline", scope["method"], scope["path"], timeout)
+            if not started:
+                response = JSONResponse({"detail": "Request deadline exceeded"}, status_code=504)
+                await response(scope, receive, send)
+        finally:
+            deadline.reset(token)
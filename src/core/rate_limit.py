@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+# Hits of a client in the current and previous windows, by this process and by the others
+class _Counter:
+
+    __slots__ = ("index", "current", "previous", "others_current", "others_previous")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.current = 0
+        self.previous = 0
+        self.others_current = 0
+        self.others_previous = 0
+
+    def roll(self, index: int):
+        if index == self.index + 1:
+            self.previous, self.others_previous = self.current, self.others_current
+        else:
+            self.previous, self.others_previous = 0, 0
+        self.index, self.current, self.others_current = index, 0, 0
+
+
+# Sliding window rate limit of `limit` hits per `window` seconds per client.
+# The hits of the previous fixed window are weighted by the part of it still covered by the sliding
+# window, so each hit costs a dict lookup and a few operations, and memory is constant per client.
+# When `shared`, the hits are also counted in the database every `sync_seconds`, so that the limit
+# holds across all the processes (within one sync period).
+class SlidingWindowRateLimiter:
+
+    def __init__(self, name: str, limit: int, window: float, shared: bool = False, sync_seconds: float = 5):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.shared = shared
+        self.sync_seconds = sync_seconds
+        self.dao = None
+        self.counters: Dict[str, _Counter] = {}
+        self.limited = 0
+        self._pruned_index = 0
+        # Hits not yet counted in the database, by (client, window index)
+        self._unsynced: Dict[Tuple[str, int], int] = {}
+        self._synced_at = 0.0
+        self._sync_task: Optional[asyncio.Task] = None
+
+    # Forgets the clients without hits in the sliding window, once per window
+    def _prune(self, index: int):
+        self._pruned_index = index
+        self.counters = {client: c for client, c in self.counters.items() if c.index >= index - 1}
+
+    def _estimate(self, counter: _Counter, elapsed: float) -> float:
+        return (counter.previous + counter.others_previous) * (1 - elapsed) + counter.current + counter.others_current
+
+    # Seconds until the estimated hits of the client fall below the limit
+    def _retry_after(self, counter: _Counter, elapsed: float) -> float:
+        current = counter.current + counter.others_current
+        previous = counter.previous + counter.others_previous
+        if current < self.limit and previous:
+            # Within the current window, as the previous one slides out
+            return (1 - (self.limit - current) / previous - elapsed) * self.window
+        # Once the current window is the previous one
+        return (1 - elapsed + max(1 - self.limit / current, 0)) * self.window
+
+    # Counts a hit of `client`. Returns None if allowed, else the seconds after which to retry.
+    def hit(self, client: str) -> Optional[float]:
+        position = time.time() / self.window
+        index = int(position)
+        elapsed = position - index
+
+        counter = self.counters.get(client)
+        if counter is None:
+            if index != self._pruned_index:
+                self._prune(index)
+            counter = self.counters[client] = _Counter(index)
+        elif counter.index != index:
+            counter.roll(index)
+
+        if self._estimate(counter, elapsed) >= self.limit:
+            self.limited += 1
+            return max(self._retry_after(counter, elapsed), 0.0)
+
+        counter.current += 1
+        if self.shared:
+            key = (client, index)
+            self._unsynced[key] = self._unsynced.get(key, 0) + 1
+            self._maybe_sync()
+        return None
+
+    # Adds the hits of this process to the database and reads back those of the other processes
+    async def sync(self):
+        if self.dao is None or not self._unsynced:
+            return
+        hits, self._unsynced = self._unsynced, {}
+        self._synced_at = time.monotonic()
+        try:
+            totals = await self.dao.add_rate_limit_hits(self.name, hits, self.window)
+        except Exception as e: # pylint: disable=W0718 broad-exception-caught
+            for key, count in hits.items():
+                self._unsynced[key] = self._unsynced.get(key, 0) + count
+            logger.warning("Could not sync the %s rate limit: %s", self.name, e)
+            return
+        for (client, index), total in totals.items():
+            counter = self.counters.get(client)
+            if counter is not None and counter.index == index:
+                # Hits of this process, including the ones made during the sync
+                local = counter.current
+                counter.others_current = max(total - (local - self._unsynced.get((client, index), 0)), 0)
+
+    def _maybe_sync(self):
+        if self._sync_task is None and time.monotonic() - self._synced_at >= self.sync_seconds:
+            self._sync_task = asyncio.create_task(self.sync())
+            self._sync_task.add_done_callback(lambda _: setattr(self, "_sync_task", None))
+
+
+# Parses a `limit/seconds` rate limit, None for no limit
+def parse_limit(value: str) -> Optional[Tuple[int, float]]:
+    limit, _, window = value.partition('/')
+    if not int(limit):
+        return None
+    return int(limit), float(window or 1)
+
+
+# Rate limits of the API by route group. Each path prefix of `route_limits` is a group with its own
+# (limit, window) per client, or no limit if None; the other routes share the `default` one, if any.
+class RateLimits:
+
+    def __init__(
+            self,
+            default: Optional[Tuple[int, float]],
+            route_limits: Dict[str, Optional[Tuple[int, float]]],
+            shared: bool = False,
+            sync_seconds: float = 5
+    ):
+        self.limiters: Dict[str, Optional[SlidingWindowRateLimiter]] = {
+            prefix: SlidingWindowRateLimiter(prefix, *limit, shared, sync_seconds) if limit else None
+            for prefix, limit in route_limits.items()
+        }
+        self.default = SlidingWindowRateLimiter("default", *default, shared, sync_seconds) if default else None
+        # Longest prefixes first
+        self._prefixes = sorted(self.limiters, key=len, reverse=True)
+        # Limiter of each route path, resolved on its first request
+        self._routes: Dict[str, Optional[SlidingWindowRateLimiter]] = {}
+
+    def setup_dao(self, dao):
+        for limiter in self.all():
+            limiter.dao = dao
+
+    def all(self) -> List[SlidingWindowRateLimiter]:
+        return [limiter for limiter in (*self.limiters.values(), self.default) if limiter is not None]
+
+    def for_route(self, path: str) -> Optional[SlidingWindowRateLimiter]:
+        try:
+            return self._routes[path]
+        except KeyError:
+            prefix = next((prefix for prefix in self._prefixes if path.startswith(prefix)), None)
+            limiter = self._routes[path] = self.limiters[prefix] if prefix is not None else self.default
+            return limiter
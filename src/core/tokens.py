@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional, Tuple
+
+import jwt
+
+
+logger = logging.getLogger(__name__)
+
+
+# Expiry of a JWT as a UNIX timestamp, None if it has none or cannot be decoded.
+# The signature is not verified: the token is only forwarded, never trusted here.
+def token_expiry(token: str) -> Optional[float]:
+    try:
+        exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+    except jwt.PyJWTError:
+        return None
+    return float(exp) if exp is not None else None
+
+
+# Holds the service JWT tokens obtained from the Gatekeeper.
+# Tokens are refreshed `refresh_margin` seconds before they expire, and concurrent refreshes
+# (eg. a burst of 401 responses across jobs) are coalesced into a single login.
+class TokenManager:
+
+    def __init__(self, login: Callable[[], Awaitable[Tuple[str, str]]], refresh_margin: float = 60):
+        self.login = login
+        self.refresh_margin = refresh_margin
+        self.access_token: Optional[str] = None
+        self.refresh_token: Optional[str] = None
+        self.expires_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def set_tokens(self, access_token: str, refresh_token: Optional[str] = None):
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expires_at = token_expiry(access_token)
+
+    def _expiring(self) -> bool:
+        return self.expires_at is not None and self.expires_at - time.time() <= self.refresh_margin
+
+    # Returns a valid access token, refreshing it first if missing or about to expire
+    async def get_token(self) -> Optional[str]:
+        if self.access_token is None or self._expiring():
+            try:
+                await self.refresh(stale=self.access_token)
+            except Exception as e: # pylint: disable=W0718 broad-exception-caught
+                # The current token, if any, is still usable until it actually expires
+                if self.access_token is None or self.expires_at <= time.time():
+                    raise
+                logger.warning("Service token could not be refreshed ahead of expiry: %s", e)
+        return self.access_token
+
+    # Logs in again and returns the new access token.
+    # Callers pass the token they found stale (None if there was none): if another caller has
+    # replaced it in the meantime, the new token is returned without logging in again.
+    async def refresh(self, stale: Optional[str] = None) -> str:
+        async with self._lock:
+            if self.access_token != stale:
+                return self.access_token
+            access_token, refresh_token = await self.login()
+            self.set_tokens(access_token, refresh_token)
+            logger.debug("Service token refreshed")
+            return self.access_token
@@ -0,0 +1,179 @@
+import asyncio
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from enum import IntEnum
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from src.core.context import call_timeout
+from src.core.exceptions import UpstreamBudgetExceededError
+
+
+logger = logging.getLogger(__name__)
+
+
+# Priority of upstream calls, lower values are served first
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    SCHEDULED = 1
+    WARMING = 2
+
+
+# Priority of the upstream calls made by the current task: user requests unless set otherwise
+upstream_priority: ContextVar[Priority] = ContextVar("upstream_priority", default=Priority.INTERACTIVE)
+
+
+# Runs a coroutine with the given upstream call priority
+async def with_priority(priority: Priority, coro: Awaitable) -> Any:
+    token = upstream_priority.set(priority)
+    try:
+        return await coro
+    finally:
+        upstream_priority.reset(token)
+
+
+# Single entry point of the calls to an upstream service with a fixed plan.
+# Calls are admitted at `calls_per_minute` by a token bucket (allowing bursts of one minute of calls),
+# waiting callers are served by priority, and each priority has its own concurrency cap.
+# Calls are counted against `calls_per_day`; the last `reserve` fraction of the daily quota is kept for
+# interactive calls. The daily count is shared through the database every `sync_seconds`, so it
+# survives restarts and covers all the processes.
+# Calls that cannot be admitted, or wait longer than `queue_timeout` seconds, fail at once with
+# UpstreamBudgetExceededError so that callers can serve cached data instead.
+class UpstreamGateway:
+
+    def __init__(
+            self,
+            name: str,
+            calls_per_minute: float,
+            calls_per_day: int = 0,
+            reserve: float = 0.1,
+            concurrency: Optional[Dict[Priority, int]] = None,
+            queue_timeout: float = 10,
+            sync_seconds: float = 10
+    ):
+        self.name = name
+        self.rate = calls_per_minute / 60
+        self.capacity = max(calls_per_minute, 1)
+        self.calls_per_day = calls_per_day
+        self.reserve = reserve
+        self.queue_timeout = queue_timeout
+        self.sync_seconds = sync_seconds
+        self.dao = None
+
+        self.tokens = float(self.capacity)
+        self._refilled_at = time.monotonic()
+        self._waiters: List[tuple] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._semaphores = {
+            priority: asyncio.Semaphore((concurrency or {}).get(priority, 10)) for priority in Priority
+        }
+
+        self.day = self._today()
+        # Calls made today by all processes as of the last sync, plus the ones made since by this process
+        self.used = 0
+        self._unsynced = 0
+        self._synced_at = 0.0
+        self._sync_task: Optional[asyncio.Task] = None
+        self.rejected = {priority.name.lower(): 0 for priority in Priority}
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now(timezone.utc).date().isoformat()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    # Hands tokens to the waiting callers, highest priority first, and schedules the next hand-out
+    def _grant(self):
+        self._timer = None
+        self._refill()
+        while self._waiters and self.tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.tokens -= 1
+            future.set_result(None)
+        if self._waiters and self._timer is None:
+            delay = (1 - self.tokens) / self.rate if self.rate else self.queue_timeout
+            self._timer = asyncio.get_running_loop().call_later(delay, self._grant)
+
+    def _check_quota(self, priority: Priority):
+        if self._today() != self.day:
+            self.day, self.used, self._unsynced = self._today(), 0, 0
+        if not self.calls_per_day:
+            return
+        remaining = self.calls_per_day - self.used
+        if remaining <= 0:
+            raise UpstreamBudgetExceededError(self.name, "daily quota used up")
+        if priority != Priority.INTERACTIVE and remaining <= self.calls_per_day * self.reserve:
+            raise UpstreamBudgetExceededError(self.name, "daily quota reserved for interactive calls")
+
+    async def _acquire(self, priority: Priority):
+        self._check_quota(priority)
+        self._refill()
+        if not self._waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return
+
+        # Callers do not wait past the deadline of their request
+        timeout = call_timeout(self.queue_timeout)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._timer is None:
+            self._grant()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise UpstreamBudgetExceededError(self.name, "rate limit queue timeout") from None
+
+    # Adds the calls made by this process to the shared daily count and reads the total back
+    async def sync(self):
+        if self.dao is None:
+            return
+        calls, day = self._unsynced, self.day
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        try:
+            total = await self.dao.add_upstream_usage(self.name, day, calls)
+        except Exception as e: # pylint: disable=W0718 broad-exception-caught
+            self._unsynced += calls
+            logger.warning("Could not sync the %s call count: %s", self.name, e)
+            return
+        if day == self.day:
+            self.used = total + self._unsynced
+
+    def _maybe_sync(self):
+        if self._sync_task is None and time.monotonic() - self._synced_at >= self.sync_seconds:
+            self._sync_task = asyncio.create_task(self.sync())
+            self._sync_task.add_done_callback(lambda _: setattr(self, "_sync_task", None))
+
+    # Calls `func` once admitted for the priority of the current task
+    async def call(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        priority = upstream_priority.get()
+        self._maybe_sync()
+        async with self._semaphores[priority]:
+            try:
+                await self._acquire(priority)
+            except UpstreamBudgetExceededError:
+                self.rejected[priority.name.lower()] += 1
+                raise
+            self.used += 1
+            self._unsynced += 1
+            return await func(*args, **kwargs)
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "tokens": round(self.tokens, 2),
+            "waiting": sum(1 for _, _, future in self._waiters if not future.done()),
+            "calls_today": self.used,
+            "calls_per_day": self.calls_per_day,
+            "rejected": dict(self.rejected),
+        }
@@ -1,5 +1,6 @@
 import logging
 from collections import defaultdict
+from datetime import datetime, time, timezone
 from typing import List
 
 from src import utils
@@ -11,7 +12,7 @@ from src.models.weather_data import WeatherData
 from src.ocsm.base import FeatureOfInterest, JSONLDGraph
 from src.ocsm.spray import SprayForecastDetailedStatus, SprayForecastObservation, SprayForecastResult
 from src.ocsm.uav import FlightConditionObservation, FlightConditionResult
-from src.ocsm.weather_data import THIObservation, THIResult
+from src.ocsm.weather_data import ET0Observation, ET0Result, THIObservation, THIResult
 
 
 logger = logging.getLogger(__name__)
@@ -83,6 +84,18 @@ class InteroperabilitySchema:
           'measurement': 'Precipitation',
           'unit': 'Millimetre',
         },
+        'precipitation_probability': {
+          'measurement': 'PrecipitationProbability',
+          'unit': 'Unitless',
+        },
+        'atmospheric_pressure': {
+          'measurement': 'AtmosphericPressure',
+          'unit': 'HectoPascal',
+        },
+        'cloud_cover': {
+          'measurement': 'CloudCover',
+          'unit': 'Percent',
+        },
     }
 
     @classmethod
@@ -128,6 +141,53 @@ class InteroperabilitySchema:
                 )
         return jsonld
 
+    @classmethod
+    def serialize_et0(cls, et0: List[dict], spatial_entity: Point) -> JSONLDGraph:
+        location_urn = utils.generate_urn('Location', obj_id=spatial_entity.location.id)
+        graph = [
+            FeatureOfInterest(
+                **{
+                    "@id": location_urn,
+                    "lon": spatial_entity.location.coordinates[1],
+                    "lat": spatial_entity.location.coordinates[0]
+                }
+            ).model_dump()
+        ]
+        for entry in et0:
+            obj_id = f"{spatial_entity.location.id}:{entry['date'].isoformat()}"
+            day = datetime.combine(entry['date'], time(), tzinfo=timezone.utc)
+            graph.append(ET0Observation(
+                **{
+                    "@id": utils.generate_urn("weather:forecast:et0", obj_id=obj_id),
+                    "description": f"Reference evapotranspiration on {entry['date'].isoformat()}",
+                    "hasFeatureOfInterest": location_urn,
+                    "weatherSource": "openweathermaps",
+                    "resultTime": day,
+                    "phenomenonTime": day,
+                    "hasResult": ET0Result(
+                        **{
+                            "@id": utils.generate_urn("weather:forecast:et0", 'result', obj_id=obj_id),
+                            "@type": ["Result", "ET0"],
+                            "hasValue": entry["et0"],
+                            "unit": "qudt:MilliM-PER-DAY"
+                        }
+                    )
+                }
+            ).model_dump(exclude_none=True))
+
+        return JSONLDGraph(
+            **{
+                "@context": [
+                    "https://w3id.org/ocsm/main-context.jsonld",
+                    {
+                        "qudt": "http://qudt.org/vocab/unit/",
+                        "cf": "https://vocab.nerc.ac.uk/standard_name/"
+                    }
+                ],
+                "@graph": graph
+            }
+        )
+
     @classmethod
     def predictions_to_jsonld(cls, predictions: List[Prediction], spatial_entity: Point) -> dict:
         property_schema = cls.property_schema
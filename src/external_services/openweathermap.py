@@ -1,15 +1,28 @@
-from datetime import datetime, timezone
+import asyncio
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+from functools import partial
 import logging
-from typing import List, Optional, Union
+import statistics
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
 
 import httpx
 from fastapi import HTTPException
+from beanie import PydanticObjectId
 from beanie.operators import In, And
+from pymongo.errors import ExecutionTimeout
 
 from src.core import config
+from src.core.context import mark_stale, without_deadline
+from src.core.admission import AdmissionController
+from src.core.upstream import Priority, upstream_priority, with_priority
+from src import geohash
 from src import utils
 from src.core.dao import Dao
-from src.models.point import Point
+from src.forecast import ForecastSeries, InterpolationMethod
+from src import indicators
+from src.models.point import GeoJSON, GeoJSONTypeEnum, Point, PointTypeEnum
+from src.models.indicators import AccumulatedIndicators
 from src.models.prediction import Prediction
 from src.models.spray import SprayForecast
 from src.models.uav import FlightStatus, FlyStatus, UAVModel
@@ -18,7 +31,11 @@ from src.ocsm.base import FeatureOfInterest, JSONLDGraph
 from src.ocsm.spray import SprayForecastDetailedStatus, SprayForecastObservation, SprayForecastResult
 from src.ocsm.uav import FlightConditionObservation, FlightConditionResult
 from src.external_services.interoperability import InteroperabilitySchema
-from src.core.exceptions import InvalidWeatherDataError, UAVModelNotFoundError
+from src.external_services.providers import OpenWeatherMapProvider, WeatherProvider, create_provider
+from src.core.exceptions import (
+    InvalidWeatherDataError, ServiceOverloadedError, SprayProfileNotFoundError, UAVModelNotFoundError, UpstreamUnavailableError
+)
+from src.spray_profiles import SprayProfileRegistry
 
 logger = logging.getLogger(__name__)
 
@@ -41,57 +58,192 @@ class OpenWeatherMap():
                 'timestamp': ['dt'],
                 # 'datetime': ['dt_txt'],
             },
-            'measurements': {
-                'ambient_temperature': ['main', 'temp'],
-                'ambient_humidity': ['main', 'humidity'],
-                'wind_speed': ['wind', 'speed'],
-                'wind_direction': ['wind', 'deg'],
-                'precipitation': ['rain', '3h'],
-            }
+            'measurements': OpenWeatherMapProvider.measurements
         },
     }
 
-    def __init__(self):
+    def __init__(self, provider: Optional[WeatherProvider] = None):
        self.dao = None
+       self.spray_profiles = SprayProfileRegistry()
+       # Background refreshes of stale cache entries in progress, by (kind, lat, lon)
+       self._revalidating: Dict[tuple, asyncio.Task] = {}
+       # Forecasts of tiles being fetched for flight and spray forecasts, by tile centroid
+       self._tile_fetches: Dict[tuple, asyncio.Task] = {}
+       self.provider = provider or create_provider()
+       # Cold-path executions of user requests (cache misses) admitted at once
+       self.admission = AdmissionController(
+           "Cold path",
+           config.COLD_PATH_MAX_CONCURRENT,
+           config.COLD_PATH_MAX_QUEUE,
+           config.COLD_PATH_QUEUE_TIMEOUT_SECONDS
+       )
 
     def setup_dao(self, dao: Dao):
        self.dao = dao
-
-    # Helper function to get weather predictions from DB or OpenWeatherMap
-    async def get_predictions(self, lat: float, lon: float) -> List[Prediction]:
+       self.provider.setup_dao(dao)
+
+    # Whether a cache entry created at `created_at` is older than `hours`
+    @staticmethod
+    def _is_stale(created_at: datetime, hours: float) -> bool:
+        return created_at < datetime.utcnow() - timedelta(hours=hours)
+
+    # Refreshes a stale cache entry in the background, at most once at a time per entry
+    def _revalidate(self, kind: str, lat: float, lon: float, fetch: Callable[[float, float], Awaitable]):
+        key = (kind, lat, lon)
+        if key in self._revalidating:
+            return
+        logger.debug("Serving stale %s of (%s, %s) while refreshing it", kind, lat, lon)
+        task = asyncio.create_task(without_deadline(with_priority(Priority.SCHEDULED, fetch(lat, lon))))
+        self._revalidating[key] = task
+        task.add_done_callback(partial(self._revalidated, key))
+
+    # Admission to a cold-path execution. Only user requests are limited: background work
+    # runs at its own pace through the scheduler and the upstream call budget.
+    def _admit(self):
+        if upstream_priority.get() != Priority.INTERACTIVE:
+            return nullcontext()
+        return self.admission.admit()
+
+    def _revalidated(self, key: tuple, task: asyncio.Task):
+        self._revalidating.pop(key, None)
+        if not task.cancelled() and task.exception():
+            logger.warning("Background refresh of %s of (%s, %s) failed: %s", *key, task.exception())
+
+    # Location whose forecast is cached for (lat, lon): the centroid of its geohash tile when tiling
+    # is enabled, so that all the parcels of a tile share a single forecast and upstream calls
+    # scale with the area covered instead of the number of parcels
+    def forecast_location(self, lat: float, lon: float) -> Tuple[float, float]:
+        if not config.FORECAST_TILING_ENABLED:
+            return lat, lon
+        return geohash.centroid(geohash.encode(lat, lon, config.FORECAST_TILE_PRECISION))
+
+    # Helper function to get weather predictions from DB or OpenWeatherMap.
+    # Forecasts older than FORECAST_DATA_CACHE_TIME but within FORECAST_DATA_MAX_STALE_TIME are served
+    # at once while being refreshed in the background; only older ones are fetched synchronously.
+    # If `nearby` is set, a cache miss is first estimated from the fresh forecasts of nearby locations
+    async def get_predictions(self, lat: float, lon: float, nearby=False) -> List[Prediction]:
+        lat, lon = self.forecast_location(lat, lon)
         try:
-            predictions = await self.dao.find_predictions_for_point(lat, lon)
+            predictions = await self.dao.find_predictions_for_point(lat, lon, config.FORECAST_DATA_MAX_STALE_TIME)
             if predictions:
+                created_at = max((p.created_at for p in predictions), default=None)
+                if created_at and self._is_stale(created_at, config.FORECAST_DATA_CACHE_TIME):
+                    mark_stale(created_at)
+                    self._revalidate("forecast", lat, lon, self.fetch_predictions)
                 return predictions
 
-            point = await self.dao.find_or_create_point(lat, lon)
-            url = f'{self.properties["endpointURI"]}/forecast?units=metric&lat={lat}&lon={lon}&appid={config.OPENWEATHERMAP_API_KEY}'
-            openweathermap_json = await utils.http_get(url)
-            predictions = await self.parseForecast5dayResponse(point, openweathermap_json)
+            if nearby:
+                series = await self.estimate_forecast_from_nearby(lat, lon)
+                if series:
+                    return series.to_predictions()
+
+            try:
+                async with self._admit():
+                    predictions = await self.fetch_predictions(lat, lon)
+            except (httpx.HTTPError, UpstreamUnavailableError, ServiceOverloadedError):
+                predictions = await self._fallback_predictions(lat, lon)
+                if not predictions:
+                    raise
         except httpx.HTTPError as httpe:
             logger.exception(httpe)
             raise SourceError(f"Request to {httpe.request.url} was not successful") from httpe
+        except UpstreamUnavailableError as e:
+            raise SourceError(e.message) from e
+        except (ServiceOverloadedError, ExecutionTimeout):
+            raise
         except Exception as e:
             logger.exception(e)
             raise e
         else:
             return predictions
 
+    # Fetches the 5-day forecast of a location from OpenWeatherMap and caches it,
+    # whether or not a fresh forecast is already cached (eg. to warm the cache before it expires)
+    async def fetch_predictions(self, lat: float, lon: float) -> List[Prediction]:
+        lat, lon = self.forecast_location(lat, lon)
+        point = await self.dao.find_or_create_point(lat, lon)
+        series = await self.provider.fetch_forecast(lat, lon)
+        return await self.store_forecast(point, series)
+
+    # Most recent cached forecast of a location, up to OPENWEATHERMAP_FALLBACK_MAX_AGE hours old,
+    # served flagged as stale when OpenWeatherMap cannot be reached
+    async def _fallback_predictions(self, lat: float, lon: float) -> List[Prediction]:
+        predictions = await self.dao.find_predictions_for_point(lat, lon, config.OPENWEATHERMAP_FALLBACK_MAX_AGE)
+        if predictions:
+            logger.warning("OpenWeatherMap unavailable, serving the cached forecast of (%s, %s)", lat, lon)
+            mark_stale(max(p.created_at for p in predictions))
+        return predictions
+
+    # Estimates the forecast of a location by inverse distance weighting the fresh forecasts
+    # of the nearest cached locations. Returns None if not enough locations are close enough.
+    async def estimate_forecast_from_nearby(self, lat: float, lon: float) -> Optional[ForecastSeries]:
+        neighbours = await self.dao.find_predictions_for_radius(
+            lat, lon, config.SPATIAL_INTERPOLATION_MAX_DISTANCE, config.SPATIAL_INTERPOLATION_NEIGHBOURS
+        )
+        if len(neighbours) < config.SPATIAL_INTERPOLATION_MIN_NEIGHBOURS:
+            return None
+
+        logger.debug("Estimating forecast for (%s, %s) from %d nearby locations", lat, lon, len(neighbours))
+        # Distances are floored to one meter so that a coincident location dominates
+        weights = [1 / max(distance, 1.0) ** config.SPATIAL_INTERPOLATION_POWER for distance, _ in neighbours]
+        series = ForecastSeries.weighted_average(
+            [ForecastSeries.from_predictions(predictions) for _, predictions in neighbours],
+            weights
+        )
+        if not series:
+            return None
+        series.spatial_entity = Point(
+            type=PointTypeEnum.POI,
+            location=GeoJSON(type=GeoJSONTypeEnum.POINT, coordinates=[lat, lon])
+        )
+        return series
+
+    # Builds a columnar forecast out of the cached predictions for a location.
+    # When `resolution` (minutes) is given the 3-hour forecast slots are resampled to it
+    # in memory, so no upstream call is made besides the usual one on a cache miss.
+    async def get_forecast_series(
+            self, lat: float, lon: float,
+            resolution: Optional[int] = None,
+            interpolation: InterpolationMethod = InterpolationMethod.LINEAR,
+            nearby=False
+    ) -> ForecastSeries:
+        predictions = await self.get_predictions(lat, lon, nearby)
+        series = ForecastSeries.from_predictions(predictions)
+        if resolution:
+            series = series.interpolate(resolution * 60, interpolation)
+        return series
+
     # Fetches the 5-day weather forecast for a given latitude and longitude.
     # Checks if the forecast is cached, otherwise fetches it from OpenWeatherMap.
     # If an error occurs, it raises a SourceError for HTTP errors or the original exception.
-    # Returns the forecast Predictions.
-    async def get_weather_forecast5days(self, lat: float, lon: float) -> List[Prediction]:
-        predictions = await self.get_predictions(lat, lon)
+    # Returns the forecast Predictions, optionally interpolated to `resolution` minutes
+    # and optionally estimated from nearby cached locations.
+    async def get_weather_forecast5days(
+            self, lat: float, lon: float,
+            resolution: Optional[int] = None,
+            interpolation: InterpolationMethod = InterpolationMethod.LINEAR,
+            nearby=False
+    ) -> List[Prediction]:
+        if resolution:
+            series = await self.get_forecast_series(lat, lon, resolution, interpolation, nearby)
+            return series.to_predictions()
+        predictions = await self.get_predictions(lat, lon, nearby)
         return predictions
 
     # Fetches the 5-day weather forecast in Linked Data format for a given latitude and longitude.
     # Calls the get_weather_forecast5days method and transforms the data into JSON-LD format.
     # Raises an exception if anything goes wrong.
     # Returns the forecast data in linked-data (JSON-LD) format.
-    async def get_weather_forecast5days_ld(self, lat: float, lon: float) -> dict:
-        predictions = await self.get_predictions(lat, lon)
+    async def get_weather_forecast5days_ld(
+            self, lat: float, lon: float,
+            resolution: Optional[int] = None,
+            interpolation: InterpolationMethod = InterpolationMethod.LINEAR,
+            nearby=False
+    ) -> dict:
+        predictions = await self.get_weather_forecast5days(lat, lon, resolution, interpolation, nearby)
         point = await self.dao.find_point(lat, lon)
+        if not point and predictions:
+            point = predictions[0].spatial_entity
         jsonld_data = InteroperabilitySchema.predictions_to_jsonld(predictions, point)
         return jsonld_data
 
@@ -114,16 +266,97 @@ class OpenWeatherMap():
         weather_data = await self.save_weather_data_thi(lat, lon)
         return weather_data
 
+    # Loads the forecast series of many locations, at most ET0_BATCH_CONCURRENCY at a time so that the
+    # cache misses of a large batch neither take over the cold path nor get shed by its admission control.
+    # A failing location gives its exception in place of its series instead of failing the others.
+    async def get_forecast_series_batch(self, locations: List[tuple]) -> List[Union[ForecastSeries, Exception]]:
+        semaphore = asyncio.Semaphore(config.ET0_BATCH_CONCURRENCY)
+
+        async def load(lat: float, lon: float) -> ForecastSeries:
+            async with semaphore:
+                return await self.get_forecast_series(lat, lon)
+
+        return await asyncio.gather(*(load(lat, lon) for lat, lon in locations), return_exceptions=True)
+
+    # Calculates the daily reference evapotranspiration (ET0) of the forecast series of each location.
+    # All days of all locations are evaluated in a single batch; locations without a series are skipped.
+    # Returns a list of ET0 entries (date, value) per location, in the order of `locations`.
+    @staticmethod
+    def calculate_et0(locations: List[tuple], series_list: List[Optional[ForecastSeries]]) -> List[List[dict]]:
+        required = ('ambient_temperature', 'ambient_humidity', 'wind_speed', 'atmospheric_pressure')
+        parameters = ('day_of_year', 'latitude', 't_min', 't_max', 'rh_mean', 'wind_speed', 'pressure', 'cloud_cover')
+        keys, columns = [], {name: [] for name in parameters}
+        for index, ((lat, _), series) in enumerate(zip(locations, series_list)):
+            if series is None:
+                continue
+            for day, values in series.daily().items():
+                if not all(values.get(name) for name in required):
+                    continue
+                keys.append((index, day))
+                columns['day_of_year'].append(day.timetuple().tm_yday)
+                columns['latitude'].append(lat)
+                columns['t_min'].append(min(values['ambient_temperature']))
+                columns['t_max'].append(max(values['ambient_temperature']))
+                columns['rh_mean'].append(statistics.fmean(values['ambient_humidity']))
+                columns['wind_speed'].append(statistics.fmean(values['wind_speed']))
+                columns['pressure'].append(statistics.fmean(values['atmospheric_pressure']))
+                columns['cloud_cover'].append(statistics.fmean(values.get('cloud_cover') or [0.0]))
+
+        results = [[] for _ in locations]
+        for (index, day), et0 in zip(keys, utils.calculate_et0(**columns)):
+            results[index].append({
+                "date": day,
+                "et0": et0,
+                "location": series_list[index].spatial_entity.location,
+            })
+        return results
+
+    # Calculates the daily reference evapotranspiration (ET0) of the forecast of each location,
+    # without additional upstream calls for locations already cached.
+    # Returns an entry per location, in the order of `locations`, with its ET0 values or the error
+    # that prevented them. Raises the error of the first location if all of them failed.
+    async def get_et0_batch(self, locations: List[tuple]) -> List[dict]:
+        loaded = await self.get_forecast_series_batch(locations)
+        errors = [series if isinstance(series, Exception) else None for series in loaded]
+        if all(errors):
+            raise errors[0]
+
+        for (lat, lon), error in zip(locations, errors):
+            if error:
+                logger.error("ET0 not calculated for %s, %s: %r", lat, lon, error)
+        series_list = [None if error else series for series, error in zip(loaded, errors)]
+        return [
+            {"lat": lat, "lon": lon, "et0": et0, "error": str(error) if error else None}
+            for (lat, lon), et0, error in zip(locations, self.calculate_et0(locations, series_list), errors)
+        ]
+
+    # Calculates the daily reference evapotranspiration (ET0) for a given latitude and longitude
+    async def get_et0(self, lat: float, lon: float, ocsm=False) -> Union[List[dict], JSONLDGraph]:
+        series = await self.get_forecast_series(lat, lon)
+        et0 = self.calculate_et0([(lat, lon)], [series])[0]
+        if not ocsm:
+            return et0
+        point = await self.dao.find_point(lat, lon)
+        if not point:
+            # With tiling the forecast is cached for the centroid of the tile rather than the location
+            point = series.spatial_entity
+        return InteroperabilitySchema.serialize_et0(et0, point)
+
     # Fetch weather forecast and calculates fligh conditions for UAV
     async def get_flight_forecast_for_all_uavs(
             self, lat: float, lon: float,
             uavmodels: Optional[List[str]] = None,
             status_filter: Optional[List[str]] = None,
-            ocsm=False
+            ocsm=False,
+            resolution: Optional[int] = None,
+            interpolation: InterpolationMethod = InterpolationMethod.LINEAR
     ) -> Union[FlyStatus, JSONLDGraph]:
 
         try:
-            flystatuses = await self.ensure_forecast_for_uavs_and_location(lat, lon, uav_model_names=uavmodels)
+            if resolution:
+                flystatuses = await self.interpolated_flight_forecast(lat, lon, uavmodels, resolution, interpolation)
+            else:
+                flystatuses = await self.ensure_forecast_for_uavs_and_location(lat, lon, uav_model_names=uavmodels)
 
             if status_filter:
                 if not all(f in [v for v in FlightStatus] for f in status_filter):
@@ -136,6 +369,8 @@ class OpenWeatherMap():
             raise HTTPException(status_code=500, detail="Invalid weather data received from OpenWeatherMaps") from iwd
         except UAVModelNotFoundError as uavnf:
             raise HTTPException(status_code=404, detail=str(uavnf)) from uavnf
+        except (ServiceOverloadedError, ExecutionTimeout):
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e)) from e
 
@@ -150,11 +385,16 @@ class OpenWeatherMap():
             self,
             lat: float, lon: float,
             uavmodel: str,
-            ocsm=False
+            ocsm=False,
+            resolution: Optional[int] = None,
+            interpolation: InterpolationMethod = InterpolationMethod.LINEAR
     ) -> Union[FlyStatus, JSONLDGraph]:
 
         try:
-            flystatuses = await self.ensure_forecast_for_uavs_and_location(lat, lon, [uavmodel])
+            if resolution:
+                flystatuses = await self.interpolated_flight_forecast(lat, lon, [uavmodel], resolution, interpolation)
+            else:
+                flystatuses = await self.ensure_forecast_for_uavs_and_location(lat, lon, [uavmodel])
         except httpx.HTTPError as httpe:
             logger.exception("Request to %s was not successful", httpe.request.url)
             raise HTTPException(status_code=502, detail=f"Request to {httpe.request.url} was not successful") from httpe
@@ -162,6 +402,8 @@ class OpenWeatherMap():
             raise HTTPException(status_code=500, detail="Invalid weather data received from OpenWeatherMaps") from iwd
         except UAVModelNotFoundError as uavnf:
             raise HTTPException(status_code=404, detail=str(uavnf)) from uavnf
+        except (ServiceOverloadedError, ExecutionTimeout):
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e)) from e
 
@@ -172,16 +414,27 @@ class OpenWeatherMap():
             return jsonld
 
     # Fetch weather forecast and calculate suitability of spray conditions for a specific locations
-    async def get_spray_forecast(self, lat: float, lon: float, ocsm=False) -> Union[List[SprayForecast], JSONLDGraph]:
+    async def get_spray_forecast(
+            self, lat: float, lon: float,
+            ocsm=False,
+            resolution: Optional[int] = None,
+            interpolation: InterpolationMethod = InterpolationMethod.LINEAR,
+            profile: Optional[str] = None
+    ) -> Union[List[SprayForecast], JSONLDGraph]:
         try:
-            forecasts = await self.ensure_spray_forecast_for_location(lat, lon)
+            if resolution or profile:
+                forecasts = await self.spray_forecast_from_cache(lat, lon, profile, resolution, interpolation)
+            else:
+                forecasts = await self.ensure_spray_forecast_for_location(lat, lon)
         except httpx.HTTPError as httpe:
             logger.exception("Request to %s was not successful", httpe.request.url)
             raise HTTPException(status_code=502, detail=f"Request to {httpe.request.url} was not successful") from httpe
         except InvalidWeatherDataError as iwd:
             raise HTTPException(status_code=500, detail="Invalid weather data received from OpenWeatherMaps") from iwd
-        except UAVModelNotFoundError as uavnf:
-            raise HTTPException(status_code=404, detail=str(uavnf)) from uavnf
+        except (UAVModelNotFoundError, SprayProfileNotFoundError) as nf:
+            raise HTTPException(status_code=404, detail=str(nf)) from nf
+        except (ServiceOverloadedError, ExecutionTimeout):
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e)) from e
 
@@ -194,54 +447,156 @@ class OpenWeatherMap():
 
     # Asynchronously fetches weather data from the OpenWeatherMap API for a given latitude and longitude.
     # Calculates the Temperature-Humidity Index (THI), and stores the weather data along with the THI in the database.
+    # Weather data older than CURRENT_WEATHER_DATA_CACHE_TIME but within CURRENT_WEATHER_DATA_MAX_STALE_TIME
+    # is returned at once while being refreshed in the background.
     async def save_weather_data_thi(self, lat: float, lon: float) -> WeatherData:
+        weather_data = await self.dao.find_weather_data_for_point(lat, lon, config.CURRENT_WEATHER_DATA_MAX_STALE_TIME)
+        if weather_data:
+            if self._is_stale(weather_data.created_at, config.CURRENT_WEATHER_DATA_CACHE_TIME):
+                mark_stale(weather_data.created_at)
+                self._revalidate("weather", lat, lon, self.fetch_weather_data)
+            return weather_data
         try:
-            weather_data = await self.dao.find_weather_data_for_point(lat, lon)
-            if weather_data:
-                return weather_data
+            async with self._admit():
+                return await self.fetch_weather_data(lat, lon)
+        except (SourceError, ServiceOverloadedError):
+            # Most recent cached weather data, served flagged as stale when OpenWeatherMap cannot be reached
+            weather_data = await self.dao.find_weather_data_for_point(lat, lon, config.OPENWEATHERMAP_FALLBACK_MAX_AGE)
+            if not weather_data:
+                raise
+            logger.warning("OpenWeatherMap unavailable, serving the cached weather of (%s, %s)", lat, lon)
+            mark_stale(weather_data.created_at)
+            return weather_data
 
+    # Fetches the current weather of a location from OpenWeatherMap and caches it along with its THI,
+    # whether or not fresh weather data is already cached
+    async def fetch_weather_data(self, lat: float, lon: float) -> WeatherData:
+        try:
             point = await self.dao.find_or_create_point(lat, lon)
-            url = f'{self.properties["endpointURI"]}/weather?units=metric&lat={lat}&lon={lon}&appid={config.OPENWEATHERMAP_API_KEY}'
-            openweathermap_json = await utils.http_get(url)
+            openweathermap_json = await self.provider.fetch_current(lat, lon)
             temp = openweathermap_json["main"]["temp"]
             rh = openweathermap_json["main"]["humidity"]
             thi = utils.calculate_thi(temp, rh)
         except httpx.HTTPError as httpe:
             logger.exception(httpe)
             raise SourceError(f"Request to {httpe.request} was not successful") from httpe
+        except UpstreamUnavailableError as e:
+            raise SourceError(e.message) from e
         except Exception as e:
             logger.exception(e)
             raise e
 
-        return await self.dao.save_weather_data_for_point(point, data=openweathermap_json, thi=thi)
+        weather_data = await self.dao.save_weather_data_for_point(point, data=openweathermap_json, thi=thi)
+        sample = indicators.weather_data_sample(weather_data)
+        if sample:
+            await self.update_accumulated_indicators(point, [sample])
+        return weather_data
+
+    # Fetches the 5-day forecast of a location to generate its flight and spray forecasts.
+    # With tiling, the forecast cached for the tile is used, so that upstream calls scale with the tiles
+    # rather than the parcels; otherwise it is fetched from the provider without caching it.
+    # If the provider cannot be reached the last cached forecast is served instead, as by `get_predictions`.
+    async def fetch_forecast(self, lat: float, lon: float) -> ForecastSeries:
+        try:
+            if config.FORECAST_TILING_ENABLED:
+                return await self._tile_forecast(lat, lon)
+            return await self.provider.fetch_forecast(lat, lon)
+        except (httpx.HTTPError, UpstreamUnavailableError, ServiceOverloadedError):
+            predictions = await self._fallback_predictions(*self.forecast_location(lat, lon))
+            if not predictions:
+                raise
+            return ForecastSeries.from_predictions(predictions)
+
+    # Fresh forecast cached for the tile of a location. On a cache miss it is fetched and cached once
+    # for the tile, even when several of its parcels miss it at the same time.
+    async def _tile_forecast(self, lat: float, lon: float) -> ForecastSeries:
+        lat, lon = self.forecast_location(lat, lon)
+        predictions = await self.dao.find_predictions_for_point(lat, lon)
+        if not predictions:
+            key = (lat, lon)
+            task = self._tile_fetches.get(key)
+            if task is None:
+                # Shared by every waiter, so it runs neither under the deadline nor the priority of the
+                # first one: a request running out of time would otherwise fail the scheduled jobs waiting on it
+                task = self._tile_fetches[key] = asyncio.create_task(
+                    without_deadline(with_priority(Priority.SCHEDULED, self.fetch_predictions(lat, lon)))
+                )
+                task.add_done_callback(lambda _: self._tile_fetches.pop(key, None))
+            # A cancelled caller does not cancel the fetch shared with the others
+            predictions = await asyncio.shield(task)
+        return ForecastSeries.from_predictions(predictions)
+
+    # Derives the THI, flight and spray observations of a location in a single pass for the scheduled jobs.
+    # The 5-day forecast is fetched at most once, and only if flight or spray forecasts are missing; with tiling it is
+    # the forecast cached for the tile of the location.
+    # As with `return_existing=False`, only newly generated forecasts are returned.
+    # A failing part is logged and skipped so that it does not prevent the others.
+    async def location_observations(
+            self, lat: float, lon: float,
+            uavmodels: Optional[List[str]] = None,
+            thi=True,
+            flight=True,
+            spray=True
+    ) -> Tuple[Optional[WeatherData], List[FlyStatus], List[SprayForecast]]:
+        forecast5 = None
+
+        async def load_forecast() -> ForecastSeries:
+            nonlocal forecast5
+            if forecast5 is None:
+                forecast5 = await self.fetch_forecast(lat, lon)
+            return forecast5
+
+        weather_data, fly_statuses, spray_forecasts = None, [], []
+        if thi:
+            try:
+                weather_data = await self.save_weather_data_thi(lat, lon)
+            except Exception as e: # pylint: disable=W0718 broad-exception-caught
+                logger.error("THI not calculated for %s, %s", lat, lon)
+                logger.exception(e)
+        if flight:
+            try:
+                fly_statuses = await self.ensure_forecast_for_uavs_and_location(
+                    lat, lon, uavmodels, return_existing=False, load_forecast=load_forecast
+                )
+            except Exception as e: # pylint: disable=W0718 broad-exception-caught
+                logger.error("Flight forecast not calculated for %s, %s", lat, lon)
+                logger.exception(e)
+        if spray:
+            try:
+                spray_forecasts = await self.ensure_spray_forecast_for_location(
+                    lat, lon, return_existing=False, load_forecast=load_forecast
+                )
+            except Exception as e: # pylint: disable=W0718 broad-exception-caught
+                logger.error("Spray forecast not calculated for %s, %s", lat, lon)
+                logger.exception(e)
+
+        return weather_data, fly_statuses, spray_forecasts
+
+    # Updates the accumulated indicators of a location with newly stored samples.
+    # Failures are logged but never fail the request that stored the data.
+    async def update_accumulated_indicators(self, point: Point, samples: List[indicators.Sample]):
+        try:
+            await indicators.update_accumulated_indicators(point, samples)
+        except Exception as e: # pylint: disable=W0718 broad-exception-caught
+            logger.error("Accumulated indicators not updated")
+            logger.exception(e)
+
+    # Fetches the indicators accumulated since the start of the season for a location
+    async def get_accumulated_indicators(self, lat: float, lon: float) -> Optional[AccumulatedIndicators]:
+        return await self.dao.find_accumulated_indicators(lat, lon)
 
     async def ensure_forecast_for_uavs_and_location(
             self,
             lat: float,
             lon: float,
             uav_model_names: Optional[List[str]] = None,
-            return_existing=True
+            return_existing=True,
+            load_forecast: Optional[Callable[[], Awaitable[ForecastSeries]]] = None
     ) -> List[FlyStatus]:
 
         point = await self.dao.find_or_create_point(lat, lon)
-
-        if uav_model_names:
-            # Fetch all matching UAV models
-            uavs = await UAVModel.find(In(UAVModel.model, uav_model_names)).to_list()
-
-            # Map found UAVs for quick lookup
-            uav_lookup = {uav.model: uav for uav in uavs}
-            missing_uavs = [model for model in uav_model_names if model not in uav_lookup]
-
-            if missing_uavs:
-                raise UAVModelNotFoundError(f"UAV models not found: {', '.join(missing_uavs)}")
-        else:
-            uavs = await UAVModel.find_all().to_list()
-            if not uavs:
-                raise UAVModelNotFoundError("No UAV models found")
-            uav_model_names = [uav.model for uav in uavs]
-            uav_lookup = {uav.model: uav for uav in uavs}
-
+        uav_lookup = await self._find_uav_models(uav_model_names)
+        uav_model_names = list(uav_lookup)
 
         now = datetime.now(timezone.utc)
         results = []
@@ -263,43 +618,143 @@ class OpenWeatherMap():
         if not models_to_fetch:
             return results if return_existing else []
 
-        # Fetch forecast from OpenWeatherMap only once
-        url = f'{self.properties["endpointURI"]}/forecast?units=metric&lat={lat}&lon={lon}&appid={config.OPENWEATHERMAP_API_KEY}'
-        openweathermap_json = await utils.http_get(url)
-        forecast5 = openweathermap_json
+        # Generating forecasts is subject to admission control, unlike reading them
+        async with self._admit():
+            # Fetch forecast from OpenWeatherMap only once
+            forecast5 = await (load_forecast or partial(self.fetch_forecast, lat, lon))()
+
+            for forecast in forecast5.rows():
+                forecast_time = forecast["timestamp"]
+
+                weather_data = {
+                    "temp": forecast["ambient_temperature"],
+                    "wind": forecast["wind_speed"],
+                    "precipitation": forecast.get("precipitation_probability") or 0,
+                    "rain": (forecast.get("precipitation") or 0.0) / 3
+                }
+
+                # Evaluate for each UAV model
+                for model in models_to_fetch:
+                    uav = uav_lookup[model]
+                    status = await utils.evaluate_flight_conditions(uav, weather_data)
+
+                    flight_data = FlyStatus(
+                        timestamp=forecast_time,
+                        uav_model=model,
+                        status=status.value,
+                        weather_params=weather_data,
+                        weather_source="OpenWeatherMap",
+                        location=point.location.model_dump()
+                    )
+                    await flight_data.insert()
+                    results.append(flight_data)
 
-        if "list" not in forecast5:
-            raise InvalidWeatherDataError()
+        return results
+
+    # Fetches the requested UAV models (or all of them) mapped by model name.
+    # Raises UAVModelNotFoundError if any of the requested models does not exist.
+    async def _find_uav_models(self, uav_model_names: Optional[List[str]] = None) -> dict:
+        if uav_model_names:
+            # Fetch all matching UAV models
+            uavs = await UAVModel.find(In(UAVModel.model, uav_model_names)).to_list()
 
-        for forecast in forecast5["list"]:
-            forecast_time = datetime.strptime(forecast["dt_txt"], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+            # Map found UAVs for quick lookup
+            uav_lookup = {uav.model: uav for uav in uavs}
+            missing_uavs = [model for model in uav_model_names if model not in uav_lookup]
+
+            if missing_uavs:
+                raise UAVModelNotFoundError(f"UAV models not found: {', '.join(missing_uavs)}")
+            return {model: uav_lookup[model] for model in uav_model_names}
+
+        uavs = await UAVModel.find_all().to_list()
+        if not uavs:
+            raise UAVModelNotFoundError("No UAV models found")
+        return {uav.model: uav for uav in uavs}
+
+    # Calculates flight conditions on the cached forecast interpolated to `resolution` minutes.
+    # Results are not stored since they derive from cached data at any resolution.
+    async def interpolated_flight_forecast(
+            self, lat: float, lon: float,
+            uav_model_names: Optional[List[str]],
+            resolution: int,
+            interpolation: InterpolationMethod = InterpolationMethod.LINEAR
+    ) -> List[FlyStatus]:
+        uav_lookup = await self._find_uav_models(uav_model_names)
+        series = await self.get_forecast_series(lat, lon, resolution, interpolation)
+        if not series:
+            raise InvalidWeatherDataError()
 
+        location = series.spatial_entity.location.model_dump()
+        hours = series.step / 3600
+        results = []
+        for row in series.rows():
+            if row.get("ambient_temperature") is None or row.get("wind_speed") is None:
+                continue
             weather_data = {
-                "temp": forecast["main"]["temp"],
-                "wind": forecast["wind"]["speed"],
-                "precipitation": forecast.get("pop", 0),
-                "rain": forecast.get("rain", {}).get("3h", 0.0) / 3
+                "temp": row["ambient_temperature"],
+                "wind": row["wind_speed"],
+                "precipitation": row.get("precipitation_probability", 0.0),
+                "rain": row.get("precipitation", 0.0) / hours
             }
-
-            # Evaluate for each UAV model
-            for model in models_to_fetch:
-                uav = uav_lookup[model]
+            for model, uav in uav_lookup.items():
                 status = await utils.evaluate_flight_conditions(uav, weather_data)
-
-                flight_data = FlyStatus(
-                    timestamp=forecast_time,
+                results.append(FlyStatus(
+                    id=PydanticObjectId(),
+                    timestamp=row["timestamp"],
                     uav_model=model,
                     status=status.value,
                     weather_params=weather_data,
                     weather_source="OpenWeatherMap",
-                    location=point.location.model_dump()
-                )
-                await flight_data.insert()
-                results.append(flight_data)
-
+                    location=location
+                ))
         return results
 
-    async def ensure_spray_forecast_for_location(self, lat, lon, return_existing=True) -> Optional[List[SprayForecast]]:
+    # Calculates spray conditions on the cached forecast with the thresholds of a spray profile,
+    # optionally interpolated to `resolution` minutes. With interpolation, precipitation is the
+    # amount expected within each interpolated period.
+    # Results are not stored since they depend on the selected profile and resolution.
+    async def spray_forecast_from_cache(
+            self, lat: float, lon: float,
+            profile: Optional[str] = None,
+            resolution: Optional[int] = None,
+            interpolation: InterpolationMethod = InterpolationMethod.LINEAR
+    ) -> List[SprayForecast]:
+        compiled_profile = await self.spray_profiles.get(profile)
+        series = await self.get_forecast_series(lat, lon, resolution, interpolation)
+        if not series:
+            raise InvalidWeatherDataError()
+
+        rows = [
+            row for row in series.rows()
+            if row.get("ambient_temperature") is not None
+            and row.get("ambient_humidity") is not None
+            and row.get("wind_speed") is not None
+        ]
+        temp = [row["ambient_temperature"] for row in rows]
+        humidity = [row["ambient_humidity"] for row in rows]
+        wind = [row["wind_speed"] * 3.6 for row in rows]  # Convert m/s to km/h
+        precipitation = [row.get("precipitation", 0.0) for row in rows]
+        delta_t = [t - utils.calculate_wet_bulb(t, rh) for t, rh in zip(temp, humidity)]
+        evaluations = compiled_profile.evaluate_many(temp, wind, precipitation, humidity, delta_t)
+
+        location = series.spatial_entity.location.model_dump()
+        return [
+            SprayForecast(
+                id=PydanticObjectId(),
+                timestamp=row["timestamp"],
+                source="OpenWeatherMap",
+                location=location,
+                spray_conditions=spray_condition,
+                detailed_status=status_details
+            )
+            for row, (spray_condition, status_details) in zip(rows, evaluations)
+        ]
+
+    async def ensure_spray_forecast_for_location(
+            self, lat, lon,
+            return_existing=True,
+            load_forecast: Optional[Callable[[], Awaitable[ForecastSeries]]] = None
+    ) -> Optional[List[SprayForecast]]:
 
         point = await self.dao.find_or_create_point(lat, lon)
         now = datetime.now()
@@ -313,26 +768,27 @@ class OpenWeatherMap():
             return results if return_existing else []
 
         # No results found, generate and return
-        results = await self._generate_spray_forecasts(lat, lon)
+        async with self._admit():
+            results = await self._generate_spray_forecasts(lat, lon, load_forecast=load_forecast)
         return results
 
-    async def _generate_spray_forecasts(self, lat: float, lon: float, save_to_db=True) -> List[SprayForecast]:
-        url = f'{self.properties["endpointURI"]}/forecast?units=metric&lat={lat}&lon={lon}&appid={config.OPENWEATHERMAP_API_KEY}'
-        openweathermap_json = await utils.http_get(url)
-
-        if "list" not in openweathermap_json:
-            raise InvalidWeatherDataError()
+    async def _generate_spray_forecasts(
+            self, lat: float, lon: float,
+            save_to_db=True,
+            load_forecast: Optional[Callable[[], Awaitable[ForecastSeries]]] = None
+    ) -> List[SprayForecast]:
+        forecast5 = await (load_forecast or partial(self.fetch_forecast, lat, lon))()
 
         point = await self.dao.find_or_create_point(lat, lon)
         results = []
 
-        for entry in openweathermap_json["list"]:
-            timestamp = datetime.strptime(entry["dt_txt"], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+        for entry in forecast5.rows():
+            timestamp = entry["timestamp"]
 
-            temp = entry["main"]["temp"]
-            humidity = entry["main"]["humidity"]
-            wind = entry["wind"]["speed"] * 3.6  # Convert m/s to km/h
-            precipitation = entry.get("rain", {}).get("3h", 0.0)
+            temp = entry["ambient_temperature"]
+            humidity = entry["ambient_humidity"]
+            wind = entry["wind_speed"] * 3.6  # Convert m/s to km/h
+            precipitation = entry.get("precipitation") or 0.0
 
             temp_wet_bulb = utils.calculate_wet_bulb(temp, humidity)
             delta_t = temp - temp_wet_bulb
@@ -357,35 +813,23 @@ class OpenWeatherMap():
 
 
 
-    # Parses the 5-day forecast data and extracts useful predictions based on the provided schema.
-    # For each forecast period, it creates and saves Prediction objects in the database.
-    # Logs any errors that occur during the transformation process.
-    # Returns a list of predictions.
-    async def parseForecast5dayResponse(self, point: Point, data: dict) -> List[Prediction]:
-        # Extract data to a list of Predictions
-        extracted_data = []
-        predictions = []
-        try:
-            for e in data['list']:
-                extracted_element = utils.deepcopy_dict(self.properties['extracted_schema'])
-                for key, path in self.properties['extracted_schema']['period'].items():
-                    extracted_element['period'][key] = utils.extract_value_from_dict_path(e, path)
-                for key, path in self.properties['extracted_schema']['measurements'].items():
-                    extracted_element['measurements'][key] = utils.extract_value_from_dict_path(e, path)
-                    if not extracted_element['measurements'][key]:
-                        continue
-                    prediction = await Prediction(
-                        value=extracted_element['measurements'][key],
-                        measurement_type=key,
-                        timestamp=extracted_element['period']['timestamp'],
-                        data_type='weather',
-                        source='openweathermaps',
-                        spatial_entity=point
-                        ).create()
-                    predictions.append(prediction)
-                    extracted_data.append(extracted_element)
-        except Exception as e: # pylint: disable=W0718 broad-exception-caught
-            logger.debug("Cannot transform to Linked Data")
-            logger.error(e)
-        else:
-            return predictions
+    # Stores a forecast as Prediction objects of the given point and returns them.
+    # Forecast periods already in the past are accumulated in the indicators of the point as well.
+    async def store_forecast(self, point: Point, series: ForecastSeries) -> List[Prediction]:
+        series.spatial_entity = point
+        series.source = series.source or self.provider.source
+        predictions = series.to_predictions()
+        if predictions:
+            await Prediction.insert_many(predictions)
+
+        now = datetime.now(timezone.utc)
+        samples = [
+            (row['timestamp'], row['ambient_temperature'], utils.calculate_thi(row['ambient_temperature'], row['ambient_humidity']))
+            for row in series.rows()
+            if row['timestamp'] <= now
+            and row.get('ambient_temperature') is not None
+            and row.get('ambient_humidity') is not None
+        ]
+        if samples:
+            await self.update_accumulated_indicators(point, samples)
+        return predictions
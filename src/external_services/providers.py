@@ -0,0 +1,315 @@
+from abc import ABC, abstractmethod
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
+import json
+import logging
+import math
+import os
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from src.core import config
+from src.core.circuit_breaker import CircuitBreaker
+from src.core.exceptions import InvalidWeatherDataError
+from src.core.upstream import Priority, UpstreamGateway, upstream_priority
+from src.forecast import ForecastSeries
+from src import utils
+
+
+logger = logging.getLogger(__name__)
+
+
+# Source of weather data.
+# Current weather is returned in the OpenWeatherMap current weather schema (`main.temp`, `main.humidity`, `dt`, ...),
+# which is the format stored in WeatherData, and forecasts as a normalized columnar ForecastSeries.
+class WeatherProvider(ABC):
+
+    name = "provider"
+    # Value of the `source` field of the data derived from the provider
+    source = "provider"
+
+    @abstractmethod
+    async def fetch_current(self, lat: float, lon: float) -> dict:
+        pass
+
+    @abstractmethod
+    async def fetch_forecast(self, lat: float, lon: float) -> ForecastSeries:
+        pass
+
+    # Gives the provider access to the database, for state shared between processes
+    def setup_dao(self, dao):
+        pass
+
+
+# OpenWeatherMap 2.5 API, called through a circuit breaker per endpoint and the plan's call budget
+class OpenWeatherMapProvider(WeatherProvider):
+
+    name = "openweathermap"
+    source = "openweathermaps"
+    endpoint_uri = "http://api.openweathermap.org/data/2.5"
+    # Paths of the measurements in each entry of the forecast `list`
+    measurements = {
+        'ambient_temperature': ['main', 'temp'],
+        'ambient_humidity': ['main', 'humidity'],
+        'wind_speed': ['wind', 'speed'],
+        'wind_direction': ['wind', 'deg'],
+        'precipitation': ['rain', '3h'],
+        'precipitation_probability': ['pop'],
+        'atmospheric_pressure': ['main', 'pressure'],
+        'cloud_cover': ['clouds', 'all'],
+    }
+
+    def __init__(self, record_path: str = ""):
+        # Payloads are saved there for the replay provider when set
+        self.record_path = record_path
+        # Circuit breaker of each upstream endpoint
+        self.breakers = {
+            endpoint: CircuitBreaker(
+                f"OpenWeatherMap {endpoint}",
+                config.OPENWEATHERMAP_BREAKER_FAILURES,
+                config.OPENWEATHERMAP_BREAKER_SLOW_CALL_SECONDS,
+                config.OPENWEATHERMAP_BREAKER_RESET_SECONDS
+            )
+            for endpoint in ('forecast', 'weather')
+        }
+        # Call budget of the OpenWeatherMap plan, shared by all endpoints
+        self.gateway = UpstreamGateway(
+            "openweathermap",
+            config.OPENWEATHERMAP_CALLS_PER_MINUTE,
+            config.OPENWEATHERMAP_CALLS_PER_DAY,
+            config.OPENWEATHERMAP_INTERACTIVE_RESERVE,
+            {
+                Priority.INTERACTIVE: config.OPENWEATHERMAP_MAX_CONCURRENT_INTERACTIVE,
+                Priority.SCHEDULED: config.OPENWEATHERMAP_MAX_CONCURRENT_SCHEDULED,
+                Priority.WARMING: config.OPENWEATHERMAP_MAX_CONCURRENT_WARMING,
+            },
+            config.OPENWEATHERMAP_QUEUE_TIMEOUT_SECONDS
+        )
+
+    def setup_dao(self, dao):
+        self.gateway.dao = dao
+
+    # Requests an OpenWeatherMap endpoint through its circuit breaker, within the call budget.
+    # The breaker only times the request itself: waiting for the budget is not upstream slowness.
+    async def _http_get(self, endpoint: str, lat: float, lon: float) -> dict:
+        url = f'{self.endpoint_uri}/{endpoint}?units=metric&lat={lat}&lon={lon}&appid={config.OPENWEATHERMAP_API_KEY}'
+        breaker = self.breakers[endpoint]
+        # No budget is spent while the circuit is open
+        breaker.check()
+        payload = await self.gateway.call(breaker.call, utils.http_get, url)
+        if self.record_path:
+            record(self.record_path, endpoint, lat, lon, payload)
+        return payload
+
+    async def fetch_current(self, lat: float, lon: float) -> dict:
+        return await self._http_get('weather', lat, lon)
+
+    async def fetch_forecast(self, lat: float, lon: float) -> ForecastSeries:
+        return self.parse_forecast(await self._http_get('forecast', lat, lon))
+
+    # Converts a forecast response to a columnar series
+    @classmethod
+    def parse_forecast(cls, payload: dict) -> ForecastSeries:
+        if "list" not in payload:
+            raise InvalidWeatherDataError()
+        entries = sorted(payload["list"], key=lambda entry: entry["dt"])
+        columns = {
+            name: [utils.extract_value_from_dict_path(entry, path) for entry in entries]
+            for name, path in cls.measurements.items()
+        }
+        # Measurements the provider never returned are left out, as when read back from the cache
+        columns = {name: values for name, values in columns.items() if any(v is not None for v in values)}
+        return ForecastSeries([float(entry["dt"]) for entry in entries], columns, source=cls.source)
+
+
+# Saves a provider payload as `{endpoint}_{lat}_{lon}.json` for the replay provider
+def record(path: str, endpoint: str, lat: float, lon: float, payload: dict):
+    try:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, f"{endpoint}_{lat}_{lon}.json"), "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+    except OSError as e:
+        logger.warning("Could not record %s payload: %s", endpoint, e)
+
+
+# Serves OpenWeatherMap payloads recorded in a directory, for load tests and benchmarks without network.
+# `{endpoint}_{lat}_{lon}.json` is served for its location and `{endpoint}.json`, if any, for all others.
+# Forecast timestamps are shifted so that the recorded forecast starts at the next 3-hour slot, as a live one.
+# Every call waits `latency` seconds (plus up to `jitter`) and fails with `error_rate` probability.
+# Replayed forecasts have their own source, so that canned data is never taken for upstream data.
+class ReplayProvider(WeatherProvider):
+
+    name = "replay"
+    source = "replay"
+
+    def __init__(self, path: str, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.path = path
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._payloads: Dict[str, Optional[dict]] = {}
+
+    def _load(self, name: str) -> Optional[dict]:
+        if name not in self._payloads:
+            file = os.path.join(self.path, f"{name}.json")
+            if os.path.exists(file):
+                with open(file, encoding="utf-8") as f:
+                    self._payloads[name] = json.load(f)
+            else:
+                self._payloads[name] = None
+        return self._payloads[name]
+
+    async def _replay(self, endpoint: str, lat: float, lon: float) -> dict:
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        url = f"replay://{endpoint}?lat={lat}&lon={lon}"
+        if self._random.random() < self.error_rate:
+            raise httpx.ConnectError("Injected replay error", request=httpx.Request("GET", url))
+
+        payload = self._load(f"{endpoint}_{lat}_{lon}") or self._load(endpoint)
+        if payload is None:
+            request = httpx.Request("GET", url)
+            raise httpx.HTTPStatusError("No recorded payload", request=request, response=httpx.Response(404, request=request))
+        return payload
+
+    async def fetch_current(self, lat: float, lon: float) -> dict:
+        payload = dict(await self._replay('weather', lat, lon))
+        payload["dt"] = int(datetime.now(timezone.utc).timestamp())
+        return payload
+
+    async def fetch_forecast(self, lat: float, lon: float) -> ForecastSeries:
+        series = OpenWeatherMapProvider.parse_forecast(await self._replay('forecast', lat, lon))
+        series.source = self.source
+        if series.timestamps:
+            slot = 3 * 3600
+            now = datetime.now(timezone.utc).timestamp()
+            shift = (now // slot + 1) * slot - series.timestamps[0]
+            series.timestamps = [ts + shift for ts in series.timestamps]
+        return series
+
+
+# Queries a primary provider and, if it has not answered within the hedge delay, a secondary one as well,
+# returning whichever answers first and cancelling the other. A provider failing makes the other one
+# answer instead; the error of the primary is raised if both fail.
+# The hedge delay is the `percentile` of the latest `window` primary latencies, `initial_delay` until
+# `min_samples` are known and never less than `min_delay`, so that only the slowest calls are hedged.
+# Only user requests are hedged: background calls wait for the primary, sparing the secondary's budget.
+class HedgedProvider(WeatherProvider):
+
+    name = "hedged"
+
+    def __init__(
+            self,
+            primary: WeatherProvider,
+            secondary: WeatherProvider,
+            percentile: float = 95,
+            initial_delay: float = 1.0,
+            min_delay: float = 0.05,
+            window: int = 100,
+            min_samples: int = 10
+    ):
+        self.primary = primary
+        self.secondary = secondary
+        self.source = primary.source
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.stats = {"calls": 0, "hedged": 0, "secondary_won": 0}
+
+    def setup_dao(self, dao):
+        self.primary.setup_dao(dao)
+        self.secondary.setup_dao(dao)
+
+    # Seconds to wait for the primary before hedging
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < self.min_samples:
+            return max(self.initial_delay, self.min_delay)
+        latencies = sorted(self.latencies)
+        rank = max(math.ceil(self.percentile / 100 * len(latencies)) - 1, 0)
+        return max(latencies[rank], self.min_delay)
+
+    # Records the latency of the primary. A primary cancelled because the secondary answered first took
+    # at least the time it ran: leaving it out would drift the percentile down and hedge ever more calls.
+    async def _timed(self, call: Awaitable):
+        started = time.monotonic()
+        try:
+            result = await call
+        except asyncio.CancelledError:
+            self.latencies.append(time.monotonic() - started)
+            raise
+        self.latencies.append(time.monotonic() - started)
+        return result
+
+    async def _hedged(self, fetch: Callable[[WeatherProvider], Awaitable], lat: float, lon: float):
+        self.stats["calls"] += 1
+        primary = asyncio.create_task(self._timed(fetch(self.primary)))
+        if upstream_priority.get() != Priority.INTERACTIVE:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay())
+        if done and primary.exception() is None:
+            return primary.result()
+
+        self.stats["hedged"] += 1
+        logger.debug("Hedging %s request of (%s, %s) to %s", self.primary.name, lat, lon, self.secondary.name)
+        secondary = asyncio.create_task(fetch(self.secondary))
+        pending = {primary, secondary}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            self.stats["secondary_won"] += 1
+                        return task.result()
+            # Both failed
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def fetch_current(self, lat: float, lon: float) -> dict:
+        return await self._hedged(lambda provider: provider.fetch_current(lat, lon), lat, lon)
+
+    async def fetch_forecast(self, lat: float, lon: float) -> ForecastSeries:
+        return await self._hedged(lambda provider: provider.fetch_forecast(lat, lon), lat, lon)
+
+
+# Builds the provider `name`, `openweathermap` or `replay`
+def _build_provider(name: str) -> WeatherProvider:
+    if name == "openweathermap":
+        return OpenWeatherMapProvider(config.WEATHER_PROVIDER_RECORD_PATH)
+    if name == "replay":
+        return ReplayProvider(
+            config.REPLAY_PROVIDER_PATH,
+            config.REPLAY_PROVIDER_LATENCY_MS / 1000,
+            config.REPLAY_PROVIDER_JITTER_MS / 1000,
+            config.REPLAY_PROVIDER_ERROR_RATE
+        )
+    raise ValueError(f"Unknown weather provider '{name}'")
+
+
+# Builds the configured provider, hedged to WEATHER_PROVIDER_HEDGE if set.
+# Hedging to the same provider is refused: a second client of the same upstream would have its own
+# call budget and double the rate of calls allowed by the plan.
+def create_provider() -> WeatherProvider:
+    provider = _build_provider(config.WEATHER_PROVIDER)
+    if config.WEATHER_PROVIDER_HEDGE:
+        if config.WEATHER_PROVIDER_HEDGE == config.WEATHER_PROVIDER:
+            raise ValueError(f"Weather provider '{config.WEATHER_PROVIDER}' cannot be hedged to itself")
+        provider = HedgedProvider(
+            provider,
+            _build_provider(config.WEATHER_PROVIDER_HEDGE),
+            config.WEATHER_PROVIDER_HEDGE_PERCENTILE,
+            config.WEATHER_PROVIDER_HEDGE_INITIAL_DELAY_MS / 1000,
+            config.WEATHER_PROVIDER_HEDGE_MIN_DELAY_MS / 1000
+        )
+    return provider
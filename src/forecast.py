@@ -0,0 +1,293 @@
+from bisect import bisect_right
+from datetime import date, datetime, timezone
+from enum import Enum
+import math
+from typing import Dict, List, Optional
+
+from src.models.point import Point
+from src.models.prediction import Prediction
+
+
+class InterpolationMethod(str, Enum):
+    LINEAR = "linear"
+    CUBIC = "cubic"
+
+
+# Converts a datetime coming either from the provider (aware) or from MongoDB (naive UTC)
+# to a UNIX timestamp
+def to_epoch(dt: datetime) -> float:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+# Computes the slopes of a monotone piecewise cubic Hermite interpolant (Fritsch-Carlson).
+# Unlike a natural spline it never overshoots the data, so humidities stay within 0-100%
+# and a dry slot between two wet ones is never interpolated to a negative value.
+def _monotone_slopes(xs: List[float], ys: List[float]) -> List[float]:
+    n = len(xs)
+    h = [xs[i + 1] - xs[i] for i in range(n - 1)]
+    delta = [(ys[i + 1] - ys[i]) / h[i] for i in range(n - 1)]
+
+    slopes = [0.0] * n
+    slopes[0] = delta[0]
+    slopes[-1] = delta[-1]
+    for i in range(1, n - 1):
+        if delta[i - 1] * delta[i] <= 0:
+            continue
+        w1 = 2 * h[i] + h[i - 1]
+        w2 = h[i] + 2 * h[i - 1]
+        slopes[i] = (w1 + w2) / (w1 / delta[i - 1] + w2 / delta[i])
+    return slopes
+
+
+# Evaluates the interpolant of the (xs, ys) samples on the sorted `targets` grid.
+# Both sequences are sorted so a single sweep locates every interval.
+def interpolate(xs: List[float], ys: List[float], targets: List[float], method=InterpolationMethod.LINEAR) -> List[float]:
+    if len(xs) == 1:
+        return [ys[0] for _ in targets]
+
+    slopes = _monotone_slopes(xs, ys) if method == InterpolationMethod.CUBIC else None
+    last = len(xs) - 2
+    k = 0
+    values = []
+    for t in targets:
+        while k < last and t > xs[k + 1]:
+            k += 1
+        x0, x1, y0, y1 = xs[k], xs[k + 1], ys[k], ys[k + 1]
+        h = x1 - x0
+        # Values outside of the sampled range are held, not extrapolated
+        u = min(max((t - x0) / h, 0.0), 1.0)
+        if slopes is None:
+            values.append(y0 + (y1 - y0) * u)
+            continue
+        h00 = (1 + 2 * u) * (1 - u) ** 2
+        h10 = u * (1 - u) ** 2
+        h01 = u * u * (3 - 2 * u)
+        h11 = u * u * (u - 1)
+        values.append(h00 * y0 + h10 * h * slopes[k] + h01 * y1 + h11 * h * slopes[k + 1])
+    return values
+
+
+# Redistributes amounts accumulated over the period preceding each sample (eg. `rain.3h`)
+# to the periods preceding each target, proportionally to the overlap of the periods.
+# The total amount over the covered period is preserved.
+def split_accumulation(xs: List[float], amounts: List[float], targets: List[float], step: float) -> List[float]:
+    periods = [xs[1] - xs[0] if len(xs) > 1 else step] + [xs[i] - xs[i - 1] for i in range(1, len(xs))]
+    values = []
+    for t in targets:
+        start = t - step
+        total = 0.0
+        i = bisect_right(xs, start)
+        while i < len(xs):
+            slot_start = xs[i] - periods[i]
+            if slot_start >= t:
+                break
+            overlap = min(t, xs[i]) - max(start, slot_start)
+            if overlap > 0 and amounts[i]:
+                total += amounts[i] * overlap / periods[i]
+            i += 1
+        values.append(total)
+    return values
+
+
+# Columnar representation of a forecast run: one list of values per measurement type,
+# aligned with a sorted list of UNIX timestamps. Missing measurements are kept as None.
+class ForecastSeries:
+
+    # Measurements accumulated over the period preceding each timestamp
+    accumulated = {'precipitation'}
+    # Angular measurements in degrees
+    circular = {'wind_direction'}
+    # Physical bounds applied after interpolation
+    bounds = {
+        'ambient_humidity': (0, 100),
+        'precipitation_probability': (0, 1),
+        'wind_speed': (0, None),
+    }
+    # Measurements that are omitted by the provider when zero
+    zero_when_missing = {'precipitation', 'precipitation_probability'}
+
+    def __init__(
+            self,
+            timestamps: List[float],
+            columns: Dict[str, List[Optional[float]]],
+            step: Optional[float] = None,
+            spatial_entity: Optional[Point] = None,
+            source: Optional[str] = None,
+            interpolated: bool = False
+    ):
+        self.timestamps = timestamps
+        self.columns = columns
+        self.spatial_entity = spatial_entity
+        self.source = source
+        # Whether values were estimated from nearby locations
+        self.interpolated = interpolated
+        if step is None and len(timestamps) > 1:
+            step = timestamps[1] - timestamps[0]
+        self.step = step
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    # Groups the cached Prediction documents of a forecast run by timestamp
+    @classmethod
+    def from_predictions(cls, predictions: List[Prediction]) -> "ForecastSeries":
+        if not predictions:
+            return cls([], {})
+
+        buckets: Dict[float, Dict[str, float]] = {}
+        for p in predictions:
+            buckets.setdefault(to_epoch(p.timestamp), {})[p.measurement_type] = p.value
+
+        timestamps = sorted(buckets)
+        names = {name for values in buckets.values() for name in values}
+        columns = {
+            name: [buckets[ts].get(name) for ts in timestamps]
+            for name in names
+        }
+        first = predictions[0]
+        return cls(timestamps, columns, spatial_entity=first.spatial_entity, source=first.source)
+
+    # Combines the series of several locations with the given weights (eg. inverse distance).
+    # Only timestamps present in every series are kept; angular measurements are averaged
+    # as vectors and missing values are excluded from the weighting.
+    @classmethod
+    def weighted_average(cls, series: List["ForecastSeries"], weights: List[float]) -> "ForecastSeries":
+        common = set(series[0].timestamps).intersection(*(s.timestamps for s in series[1:]))
+        timestamps = sorted(common)
+        indexes = [{ts: i for i, ts in enumerate(s.timestamps)} for s in series]
+        names = set().union(*(s.columns for s in series))
+
+        columns = {}
+        for name in names:
+            circular = name in cls.circular
+            sources = [(s.column(name), idx, w) for s, idx, w in zip(series, indexes, weights)]
+            values = []
+            for ts in timestamps:
+                total = x = y = weight_sum = 0.0
+                for column, idx, weight in sources:
+                    value = column[idx[ts]]
+                    if value is None:
+                        continue
+                    weight_sum += weight
+                    if circular:
+                        x += weight * math.cos(math.radians(value))
+                        y += weight * math.sin(math.radians(value))
+                    else:
+                        total += weight * value
+                if not weight_sum:
+                    values.append(None)
+                elif circular:
+                    values.append(math.degrees(math.atan2(y, x)) % 360)
+                else:
+                    values.append(total / weight_sum)
+            columns[name] = values
+
+        return cls(timestamps, columns, source=series[0].source, interpolated=True)
+
+    # Returns a measurement column, replacing missing values with `default`
+    def column(self, name: str, default=None) -> List[Optional[float]]:
+        if default is None and name in self.zero_when_missing:
+            default = 0.0
+        if name not in self.columns:
+            return [default] * len(self.timestamps)
+        return [default if v is None else v for v in self.columns[name]]
+
+    # Upsamples (or downsamples) the series to a regular grid of `step` seconds.
+    # Instantaneous measurements are interpolated, accumulated ones are split proportionally.
+    # Operates only on data already held in memory.
+    def interpolate(self, step: float, method=InterpolationMethod.LINEAR) -> "ForecastSeries":
+        if len(self.timestamps) < 2:
+            return ForecastSeries(self.timestamps, self.columns, step, self.spatial_entity, self.source, self.interpolated)
+
+        first, last = self.timestamps[0], self.timestamps[-1]
+        count = int((last - first) // step) + 1
+        targets = [first + i * step for i in range(count)]
+
+        columns = {}
+        for name, values in self.columns.items():
+            if name in self.accumulated:
+                columns[name] = split_accumulation(self.timestamps, self.column(name), targets, step)
+                continue
+
+            known = [(ts, v) for ts, v in zip(self.timestamps, values) if v is not None]
+            if not known:
+                columns[name] = [None] * count
+                continue
+            xs = [ts for ts, _ in known]
+            ys = [v for _, v in known]
+
+            if name in self.circular:
+                ys = self._unwrap(ys)
+                columns[name] = [v % 360 for v in interpolate(xs, ys, targets, method)]
+                continue
+
+            interpolated = interpolate(xs, ys, targets, method)
+            lower, upper = self.bounds.get(name, (None, None))
+            if lower is not None:
+                interpolated = [max(v, lower) for v in interpolated]
+            if upper is not None:
+                interpolated = [min(v, upper) for v in interpolated]
+            columns[name] = interpolated
+
+        return ForecastSeries(targets, columns, step, self.spatial_entity, self.source, self.interpolated)
+
+    # Removes 360 degree jumps so that eg. 350 -> 10 is interpolated through north
+    @staticmethod
+    def _unwrap(angles: List[float]) -> List[float]:
+        unwrapped = [angles[0]]
+        for angle in angles[1:]:
+            diff = (angle - unwrapped[-1] + 180) % 360 - 180
+            unwrapped.append(unwrapped[-1] + diff)
+        return unwrapped
+
+    # Groups the values of each measurement by UTC day.
+    # Days not fully covered by the series (usually the first and last of a forecast) are left out.
+    def daily(self) -> Dict[date, Dict[str, List[float]]]:
+        if not self.step:
+            return {}
+        per_day = round(86400 / self.step)
+        days: Dict[date, List[int]] = {}
+        for i, ts in enumerate(self.timestamps):
+            days.setdefault(datetime.fromtimestamp(ts, tz=timezone.utc).date(), []).append(i)
+
+        columns = {name: self.column(name) for name in self.columns}
+        return {
+            day: {
+                name: [column[i] for i in indexes if column[i] is not None]
+                for name, column in columns.items()
+            }
+            for day, indexes in days.items()
+            if len(indexes) >= per_day
+        }
+
+    # Returns the series as a list of per-timestamp dictionaries
+    def rows(self) -> List[dict]:
+        names = list(self.columns)
+        columns = [self.column(name) for name in names]
+        return [
+            {
+                'timestamp': datetime.fromtimestamp(ts, tz=timezone.utc),
+                **{name: column[i] for name, column in zip(names, columns)}
+            }
+            for i, ts in enumerate(self.timestamps)
+        ]
+
+    # Converts the series back to (unsaved) Prediction documents
+    def to_predictions(self) -> List[Prediction]:
+        predictions = []
+        for row in self.rows():
+            for name in self.columns:
+                if row[name] is None:
+                    continue
+                predictions.append(Prediction(
+                    value=row[name],
+                    measurement_type=name,
+                    timestamp=row['timestamp'],
+                    data_type='weather',
+                    source=self.source or 'openweathermaps',
+                    spatial_entity=self.spatial_entity,
+                    interpolated=self.interpolated
+                ))
+        return predictions
@@ -0,0 +1,86 @@
+from typing import List, Tuple
+
+
+# Geohash alphabet: base32 without a, i, l and o
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+DECODE = {char: index for index, char in enumerate(BASE32)}
+
+
+# Geohash of a location at `precision` characters (5 is about 4.9 x 4.9 km at the equator).
+# Bits alternate between longitude and latitude, each halving the remaining interval.
+def encode(lat: float, lon: float, precision: int) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, value, even = 0, 0, True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+# Bounding box (min_lat, min_lon, max_lat, max_lon) of a geohash tile
+def bounds(geohash: str) -> Tuple[float, float, float, float]:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = DECODE[char]
+        for shift in range(4, -1, -1):
+            interval = lon_range if even else lat_range
+            middle = (interval[0] + interval[1]) / 2
+            if value >> shift & 1:
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+# Centroid (lat, lon) of a geohash tile, rounded to 6 decimals (about 0.1 m) so that it is stable as a cache key
+def centroid(geohash: str) -> Tuple[float, float]:
+    min_lat, min_lon, max_lat, max_lon = bounds(geohash)
+    return round((min_lat + max_lat) / 2, 6), round((min_lon + max_lon) / 2, 6)
+
+
+# Size (lat, lon) in degrees of the tiles at `precision`
+def tile_size(precision: int) -> Tuple[float, float]:
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+# Grid of the tiles at `precision` covering a bounding box: south-west corner of its first tile,
+# number of rows and columns and size of the tiles
+def _grid(min_lat: float, min_lon: float, max_lat: float, max_lon: float, precision: int):
+    lat_size, lon_size = tile_size(precision)
+    first_lat, first_lon, _, _ = bounds(encode(min_lat, min_lon, precision))
+    rows = int((max_lat - first_lat) // lat_size) + 1
+    columns = int((max_lon - first_lon) // lon_size) + 1
+    return first_lat, first_lon, rows, columns, lat_size, lon_size
+
+
+# Number of tiles at `precision` covering a bounding box, without listing them
+def count_covering(min_lat: float, min_lon: float, max_lat: float, max_lon: float, precision: int) -> int:
+    _, _, rows, columns, _, _ = _grid(min_lat, min_lon, max_lat, max_lon, precision)
+    return rows * columns
+
+
+# Geohashes of the tiles at `precision` covering a bounding box, row by row from the south-west corner
+def covering(min_lat: float, min_lon: float, max_lat: float, max_lon: float, precision: int) -> List[str]:
+    first_lat, first_lon, rows, columns, lat_size, lon_size = _grid(min_lat, min_lon, max_lat, max_lon, precision)
+    # Tiles are encoded from their centers; the ones past the poles or the antimeridian are clamped
+    return list(dict.fromkeys(
+        encode(min(first_lat + (row + 0.5) * lat_size, 90.0), min(first_lon + (column + 0.5) * lon_size, 180.0), precision)
+        for row in range(rows)
+        for column in range(columns)
+    ))
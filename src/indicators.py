@@ -0,0 +1,215 @@
+import asyncio
+from datetime import datetime, timezone
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from beanie import Document, init_beanie
+from beanie.operators import In
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+
+from src.core import config, log
+from src import utils
+from src.models.indicators import AccumulatedIndicators
+from src.models.point import Point
+from src.models.prediction import Prediction
+from src.models.weather_data import WeatherData
+
+
+logger = logging.getLogger(__name__)
+
+# (timestamp, temperature, THI)
+Sample = Tuple[datetime, float, Optional[float]]
+
+
+# Converts to the naive UTC datetimes returned by MongoDB
+def to_naive_utc(timestamp: datetime) -> datetime:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+# Start of the accumulation season containing `timestamp`
+def season_start(timestamp: datetime) -> datetime:
+    month, day = (int(part) for part in config.ACCUMULATION_SEASON_START.split('-'))
+    start = datetime(timestamp.year, month, day)
+    if start > timestamp:
+        start = start.replace(year=timestamp.year - 1)
+    return start
+
+
+# Integrates a sample into the accumulators using the mean of the interval since the last sample.
+# Growing degree days use the degree-hour method, so sub-daily samples are accounted exactly.
+# Samples older than the last integrated one are ignored. Returns whether the sample was used.
+def accumulate(acc: AccumulatedIndicators, timestamp: datetime, temperature: float, thi: Optional[float]) -> bool:
+    if acc.last_timestamp is not None:
+        if timestamp <= acc.last_timestamp:
+            return False
+
+        hours = min((timestamp - acc.last_timestamp).total_seconds() / 3600, config.ACCUMULATION_MAX_GAP_HOURS)
+        mean_temperature = (acc.last_temperature + temperature) / 2
+        acc.growing_degree_days += max(mean_temperature - config.GDD_BASE_TEMPERATURE, 0) * hours / 24
+        if config.CHILL_MIN_TEMPERATURE <= mean_temperature <= config.CHILL_MAX_TEMPERATURE:
+            acc.chill_hours += hours
+        if thi is not None and acc.last_thi is not None and (acc.last_thi + thi) / 2 >= config.THI_HEAT_STRESS_THRESHOLD:
+            acc.heat_stress_hours += hours
+        acc.hours += hours
+
+    acc.last_timestamp = timestamp
+    acc.last_temperature = temperature
+    acc.last_thi = thi
+    return True
+
+
+# Fields of the accumulators incremented by each sample
+ACCUMULATED_FIELDS = ("growing_degree_days", "chill_hours", "heat_stress_hours", "hours")
+# Attempts to update an accumulator modified concurrently by another store
+UPDATE_ATTEMPTS = 5
+
+
+# Applies new samples of a point to its stored accumulators, starting new ones on season change.
+# Only the accumulator documents of the point are read, never the weather history.
+async def update_accumulated_indicators(point: Point, samples: List[Sample]):
+    seasons: Dict[datetime, List[Sample]] = {}
+    for timestamp, temperature, thi in samples:
+        timestamp = to_naive_utc(timestamp)
+        seasons.setdefault(season_start(timestamp), []).append((timestamp, temperature, thi))
+    for season, season_samples in sorted(seasons.items()):
+        await update_season_indicators(point, season, sorted(season_samples, key=lambda sample: sample[0]))
+
+
+# Integrates samples of a season into the accumulator of a point with a single atomic $inc upsert.
+# The update is conditioned on the last sample integrated when the accumulator was read: if another
+# store (eg. a request and the scheduler) integrated samples meanwhile, it matches nothing and its
+# insert is rejected by the unique index, so it is retried from the new state instead of losing
+# increments or creating a duplicate accumulator.
+async def update_season_indicators(point: Point, season: datetime, samples: List[Sample]):
+    for _ in range(UPDATE_ATTEMPTS):
+        acc = await AccumulatedIndicators.find_one(
+            AccumulatedIndicators.point_id == point.id,
+            AccumulatedIndicators.season_start == season
+        ) or AccumulatedIndicators(point_id=point.id, location=point.location, season_start=season)
+        last_timestamp = acc.last_timestamp
+        totals = {field: getattr(acc, field) for field in ACCUMULATED_FIELDS}
+
+        changed = False
+        for timestamp, temperature, thi in samples:
+            changed = accumulate(acc, timestamp, temperature, thi) or changed
+        if not changed:
+            return
+
+        try:
+            await AccumulatedIndicators.find_one(
+                AccumulatedIndicators.point_id == point.id,
+                AccumulatedIndicators.season_start == season,
+                AccumulatedIndicators.last_timestamp == last_timestamp
+            ).update({
+                "$inc": {field: getattr(acc, field) - totals[field] for field in ACCUMULATED_FIELDS},
+                "$set": {
+                    "last_timestamp": acc.last_timestamp,
+                    "last_temperature": acc.last_temperature,
+                    "last_thi": acc.last_thi,
+                    "updated_at": datetime.now(),
+                },
+                "$setOnInsert": {"point_id": point.id, "location": point.location, "season_start": season},
+            }, upsert=True)
+            return
+        except DuplicateKeyError:
+            logger.debug("Accumulator of %s for %s updated concurrently, retrying", point.id, season)
+    logger.warning("Accumulator of %s for %s not updated after %d attempts", point.id, season, UPDATE_ATTEMPTS)
+
+
+# Extracts the accumulation sample of a current weather response
+def weather_data_sample(weather_data: WeatherData) -> Optional[Sample]:
+    data = weather_data.data
+    temperature = utils.extract_value_from_dict_path(data, ['main', 'temp'])
+    if temperature is None or 'dt' not in data:
+        return None
+    return datetime.fromtimestamp(data['dt'], tz=timezone.utc), temperature, weather_data.thi
+
+
+# Accumulation samples stored for a point, with the time each one was stored, in storage order.
+# As in the live path, these are the current weather responses and the forecast periods that were
+# already past when the forecast was stored.
+async def stored_samples(point: Point) -> List[Tuple[datetime, Sample]]:
+    samples = []
+    async for weather_data in WeatherData.find(WeatherData.spatial_entity == point):
+        sample = weather_data_sample(weather_data)
+        if sample:
+            samples.append((weather_data.created_at, sample))
+
+    # First stored value of each past forecast period, by timestamp and measurement
+    periods: Dict[datetime, Dict[str, Tuple[datetime, float]]] = {}
+    async for prediction in Prediction.find(
+        Prediction.spatial_entity == point,
+        In(Prediction.measurement_type, ["ambient_temperature", "ambient_humidity"])
+    ).sort(+Prediction.created_at):
+        timestamp = to_naive_utc(prediction.timestamp)
+        if timestamp <= prediction.created_at:
+            periods.setdefault(timestamp, {}).setdefault(prediction.measurement_type, (prediction.created_at, prediction.value))
+    for timestamp, values in periods.items():
+        if len(values) < 2:
+            continue
+        (temperature_at, temperature), (humidity_at, humidity) = values["ambient_temperature"], values["ambient_humidity"]
+        samples.append((max(temperature_at, humidity_at), (timestamp, temperature, utils.calculate_thi(temperature, humidity))))
+
+    return sorted(samples, key=lambda entry: (entry[0], to_naive_utc(entry[1][0])))
+
+
+# Stores a rebuilt accumulator in place of the current one of its point and season, if any
+async def replace_accumulated_indicators(acc: AccumulatedIndicators):
+    fields = {
+        field: getattr(acc, field)
+        for field in ("location", "last_timestamp", "last_temperature", "last_thi", "updated_at", *ACCUMULATED_FIELDS)
+    }
+    for _ in range(UPDATE_ATTEMPTS):
+        try:
+            await AccumulatedIndicators.find_one(
+                AccumulatedIndicators.point_id == acc.point_id,
+                AccumulatedIndicators.season_start == acc.season_start
+            ).update({
+                "$set": fields,
+                "$setOnInsert": {"point_id": acc.point_id, "season_start": acc.season_start},
+            }, upsert=True)
+            return
+        except DuplicateKeyError:
+            logger.debug("Accumulator of %s for %s created concurrently, retrying", acc.point_id, acc.season_start)
+    logger.warning("Accumulator of %s for %s not rebuilt after %d attempts", acc.point_id, acc.season_start, UPDATE_ATTEMPTS)
+
+
+# Rebuilds the accumulators of all points from the stored weather data and forecasts.
+# Points are processed one at a time, in the order their samples were stored as the live updates do,
+# and each accumulator is replaced in place, so the others stay available meanwhile.
+# Accumulators stored before they were keyed by point are removed.
+async def backfill_accumulated_indicators():
+    rebuilt = processed = 0
+    async for point in Point.find_all():
+        accumulators: Dict[datetime, AccumulatedIndicators] = {}
+        for _, (timestamp, temperature, thi) in await stored_samples(point):
+            timestamp = to_naive_utc(timestamp)
+            season = season_start(timestamp)
+            if season not in accumulators:
+                accumulators[season] = AccumulatedIndicators(point_id=point.id, location=point.location, season_start=season)
+            accumulate(accumulators[season], timestamp, temperature, thi)
+            processed += 1
+        for acc in accumulators.values():
+            await replace_accumulated_indicators(acc)
+        rebuilt += len(accumulators)
+
+    await AccumulatedIndicators.get_motor_collection().delete_many({"point_id": {"$exists": False}})
+    logger.info("Backfilled %d accumulators from %d samples", rebuilt, processed)
+
+
+async def main():
+    client = AsyncIOMotorClient(config.DATABASE_URI)
+    await init_beanie(
+        database=client.get_database(config.DATABASE_NAME),
+        document_models=utils.load_classes('**/models/**.py', (Document,))
+    )
+    await backfill_accumulated_indicators()
+    client.close()
+
+
+if __name__ == "__main__":
+    log.setup_logging(config.LOGGING_LEVEL)
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
+from beanie import Document
+from pydantic import Field
+from pymongo import ASCENDING, IndexModel
+
+from src.models.point import GeoJSON
+
+
+# Indicators accumulated for a location since the start of the season.
+# Updated incrementally whenever new weather data is stored for the location.
+class AccumulatedIndicators(Document):
+    # Id of the point of the location, unique per season with `season_start`
+    point_id: UUID
+    location: GeoJSON
+    season_start: datetime
+    # Last sample integrated, later samples are accumulated from here
+    last_timestamp: Optional[datetime] = None
+    last_temperature: Optional[float] = None
+    last_thi: Optional[float] = None
+    growing_degree_days: float = 0.0
+    chill_hours: float = 0.0
+    heat_stress_hours: float = 0.0
+    hours: float = 0.0
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "point_id": "bad6cd67-638f-42d8-82b8-d4d191174dd6",
+                "location": {
+                    "type": "Point",
+                    "coordinates": [39.1436, 26.40518]
+                },
+                "season_start": "2025-01-01T00:00:00",
+                "last_timestamp": "2025-06-21T15:00:00",
+                "growing_degree_days": 1234.5,
+                "chill_hours": 420.0,
+                "heat_stress_hours": 36.0,
+                "hours": 4215.0
+            }
+        }
+
+    class Settings:
+        name = "accumulated_indicators"
+        # Accumulators stored without a point id are left out, until they are rebuilt by the backfill
+        indexes = [IndexModel(
+            [("point_id", ASCENDING), ("season_start", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"point_id": {"$exists": True}}
+        )]
@@ -0,0 +1,15 @@
+from datetime import datetime
+
+from beanie import Document
+
+
+# Lease held by the process running a singleton task, such as the scheduler.
+# The holder renews it before `expires_at`, any other process may take it over afterwards.
+class Lease(Document):
+    id: str
+    owner: str
+    expires_at: datetime
+    renewed_at: datetime
+
+    class Settings:
+        name = "leases"
@@ -0,0 +1,45 @@
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+from beanie import Document
+from pydantic import Field
+from pymongo import ASCENDING, IndexModel
+
+
+class OutboxStatus(str, Enum):
+    PENDING = "pending"
+    SENT = "sent"
+    # Given up after too many attempts
+    FAILED = "failed"
+
+
+# Observation waiting to be posted to the Farm Calendar, or last posted for its key.
+# The id is a deterministic idempotency key, so the same observation is never enqueued twice,
+# and the fingerprint of its values tells whether it changed since it was enqueued.
+class OutboxEntry(Document):
+    id: str
+    payload: dict
+    fingerprint: Optional[str] = None
+    # Whether a changed observation updates the one already posted instead of adding a new one
+    updatable: bool = False
+    # Id of the observation created in the Farm Calendar
+    remote_id: Optional[str] = None
+    status: OutboxStatus = OutboxStatus.PENDING
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+
+    class Config:
+        use_enum_values = True
+
+    class Settings:
+        name = "farmcalendar_outbox"
+        indexes = [
+            # Due entries of the drain
+            IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)]),
+            # Sent observations are kept for a week to deduplicate retries
+            IndexModel([("sent_at", ASCENDING)], expireAfterSeconds=604800),
+        ]
@@ -3,6 +3,7 @@ from datetime import datetime
 
 from beanie import Document
 from pydantic import Field
+from pymongo import ASCENDING, DESCENDING, IndexModel
 
 from src.models.point import Point
 
@@ -16,7 +17,8 @@ class Prediction(Document):
     spatial_entity: Point
     data_type: str
     measurement_type: str
-
+    # True for forecasts estimated from nearby locations, which are never stored
+    interpolated: bool = False
 
     class Config:
         use_enum_values = True
@@ -42,4 +44,6 @@ class Prediction(Document):
         }
 
     class Settings:
-        name = "predictions"
\ No newline at end of file
+        name = "predictions"
+        # Latest entries of given locations, read by the cache warmer
+        indexes = [IndexModel([("spatial_entity.location.coordinates", ASCENDING), ("created_at", DESCENDING)])]
\ No newline at end of file
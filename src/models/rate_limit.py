@@ -0,0 +1,17 @@
+from datetime import datetime
+
+from beanie import Document
+from pymongo import ASCENDING, IndexModel
+
+
+# Hits of a client in a fixed window of a rate limit, shared by all the processes
+class RateLimitHits(Document):
+    # "{rate limit}:{client}:{window index}"
+    id: str
+    hits: int = 0
+    # Kept while the window is the current or the previous one
+    expires_at: datetime
+
+    class Settings:
+        name = "rate_limit_hits"
+        indexes = [IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)]
@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum
-from typing import Dict
+from typing import Any, Dict, List, Optional
 
 from beanie import Document
 
@@ -21,4 +21,19 @@ class SprayForecast(Document):
     detailed_status: Dict[str, str]  # Explanation for spray conditions
 
     class Settings:
-        collection = "spray_forecasts"
\ No newline at end of file
+        collection = "spray_forecasts"
+
+
+# Declarative spray thresholds for a crop and/or chemical product.
+# `parameters` maps a weather parameter (temperature, wind, precipitation, humidity, delta_t)
+# to an ordered list of bands, eg. {"status": "marginal", "gte": 18, "lte": 25}.
+# Parameters not defined fall back to the default profile.
+class SprayProfile(Document):
+    name: str
+    crop: Optional[str] = None
+    chemical: Optional[str] = None
+    description: Optional[str] = None
+    parameters: Dict[str, List[Dict[str, Any]]]
+
+    class Settings:
+        name = "spray_profiles"
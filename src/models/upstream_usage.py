@@ -0,0 +1,14 @@
+from datetime import datetime
+
+from beanie import Document
+
+
+# Number of calls made to an upstream service on a UTC day, shared by all the processes
+class UpstreamUsage(Document):
+    # "{upstream}:{YYYY-MM-DD}"
+    id: str
+    calls: int = 0
+    updated_at: datetime
+
+    class Settings:
+        name = "upstream_usage"
@@ -4,6 +4,7 @@ from uuid import UUID, uuid4
 
 from beanie import Document
 from pydantic import Field
+from pymongo import ASCENDING, DESCENDING, IndexModel
 
 from src.models.point import Point
 
@@ -33,4 +34,6 @@ class WeatherData(Document):
         }
 
     class Settings:
-        name = "weather_data"
\ No newline at end of file
+        name = "weather_data"
+        # Latest entries of given locations, read by the cache warmer
+        indexes = [IndexModel([("spatial_entity.location.coordinates", ASCENDING), ("created_at", DESCENDING)])]
\ No newline at end of file
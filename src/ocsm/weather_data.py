@@ -13,3 +13,12 @@ class THIObservation(Observation):
     type: List[str] = Field(["Observation", "THI"], alias="@type")
     hasResult: THIResult
 
+
+class ET0Result(Result):
+    hasValue: float
+    unit: Optional[str] = None
+
+
+class ET0Observation(Observation):
+    type: List[str] = Field(["Observation", "ET0"], alias="@type")
+    hasResult: ET0Result
@@ -1,97 +1,284 @@
-from datetime import datetime
+import asyncio
+from datetime import datetime, timedelta
 import logging
+import time
+from typing import Optional
+import zlib
 
 from fastapi import FastAPI
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.mongodb import MongoDBJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from pymongo import MongoClient
 
+from src.cache_warmer import CacheWarmer
 from src.core import config
+from src.core.upstream import Priority, with_priority
+from src.scheduler_engine import HeapScheduler
 
 scheduler = AsyncIOScheduler()
+# Engine of the location jobs when SCHEDULER_ENGINE is `heap`, otherwise they run on APScheduler
+engine: Optional[HeapScheduler] = None
+# Application used by the jobs. Jobs do not take it as an argument so that they can be persisted.
+scheduler_app: Optional[FastAPI] = None
 
 
-# Schedule THI tasks for each location
-def schedule_tasks(app: FastAPI):
-    scheduler.remove_all_jobs()  # Clear old jobs
+# Queueing metrics of the location jobs
+class JobMetrics:
 
-    if not hasattr(app.state, "locations") or not app.state.locations:
-        logging.debug("No locations available for scheduling.")
+    def __init__(self):
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def snapshot(self) -> dict:
+        finished = self.completed + self.failed
+        return {
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "max_concurrency": config.SCHEDULER_MAX_CONCURRENT_JOBS,
+            "avg_wait_seconds": round(self.total_wait / finished, 3) if finished else 0.0,
+            "max_wait_seconds": round(self.max_wait, 3),
+        }
+
+
+metrics = JobMetrics()
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+# Deterministic fraction in [0, 1) derived from the job id,
+# so a location keeps the same phase across restarts and refreshes
+def job_phase(job_id: str) -> float:
+    return zlib.crc32(job_id.encode()) / 2 ** 32
+
+
+# Runs a location job once a slot of the global concurrency limit is available
+async def run_limited(func, *args):
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(config.SCHEDULER_MAX_CONCURRENT_JOBS)
+
+    queued_at = time.monotonic()
+    metrics.queued += 1
+    async with _semaphore:
+        wait = time.monotonic() - queued_at
+        metrics.queued -= 1
+        metrics.running += 1
+        metrics.total_wait += wait
+        metrics.max_wait = max(metrics.max_wait, wait)
+        try:
+            await with_priority(Priority.SCHEDULED, func(*args))
+        except Exception:
+            metrics.failed += 1
+            raise
+        else:
+            metrics.completed += 1
+        finally:
+            metrics.running -= 1
+
+
+LOCATION_JOB_PREFIX = "location_task_"
+
+
+# Next run of a location job on a fixed slot of its interval, derived from its phase.
+# Jobs are spread over their whole interval rather than firing at once, with either engine.
+# Slots do not depend on the start time, so in-memory jobs keep them across restarts.
+def slot_run_time(job_id: str, interval: timedelta, now: datetime) -> datetime:
+    seconds = interval.total_seconds()
+    offset = (job_phase(job_id) * seconds - now.timestamp()) % seconds
+    return now + timedelta(seconds=offset)
+
+
+# Adds an interval job for a location, wrapped by the concurrency limit
+def add_location_job(func, job_id: str, interval: timedelta, now: datetime, args: list):
+    if engine is not None:
+        next_run_time = slot_run_time(job_id, interval, now)
+        engine.add_job(job_id, run_limited, [func, *args], interval.total_seconds(), next_run_time.timestamp())
         return
 
-    for lat, lon in app.state.locations:
-        if config.PUSH_THI_TO_FARMCALENDAR:
-            scheduler.add_job(
-                post_thi_task,
-                "interval",
-                hours=config.INTERVAL_THI_TO_FARMCALENDAR,
-                next_run_time=datetime.now(),
-                id=f"thi_task_{lat}_{lon}",
-                replace_existing=True,
-                args=[app, lat, lon]
-            )
-            logging.debug("Scheduled THI task for %s, %s", lat, lon)
-        if config.PUSH_FLIGHT_FORECAST_TO_FARMCALENDAR:
-            scheduler.add_job(
-                post_flight_forecast,
-                "interval",
-                days=5,
-                next_run_time=datetime.now(),
-                id=f"flight_forecast_task_{lat}_{lon}",
-                replace_existing=True,
-                args=[app, lat, lon, app.state.uavmodels]
-            )
-            logging.debug("Scheduled UAV forecast task for %s, %s", lat, lon)
-        if config.PUSH_SPRAY_F_TO_FARMCALENDAR:
-            scheduler.add_job(
-                post_spray_forecast,
-                "interval",
-                days=5,
-                next_run_time=datetime.now(),
-                id=f"spray_forecast_task_{lat}_{lon}",
-                replace_existing=True,
-                args=[app, lat, lon]
-            )
-            logging.debug("Scheduled spray conditions forecast task for %s, %s", lat, lon)
-
-
-# Post THI for a single location
-async def post_thi_task(app, lat, lon):
-    fc_client = app.state.fc_client
-    logging.debug(f"Posting THI for {lat}, {lon}")
-    await fc_client.send_thi(lat, lon)
-
-# Post flight forecast for a single location
-async def post_flight_forecast(app, lat, lon, uavmodels):
-    fc_client = app.state.fc_client
-    logging.debug(f"Posting Flight forecast for models: {uavmodels} at location: ({lat}, {lon})")
-    await fc_client.send_flight_forecast(lat, lon, uavmodels)
-
-# Post spray conditions forecast for a single location
-async def post_spray_forecast(app, lat, lon):
-    fc_client = app.state.fc_client
-    logging.debug(f"Posting spray conditions forecast at location: ({lat}, {lon})")
-    await fc_client.send_spray_forecast(lat, lon)
+    scheduler.add_job(
+        run_limited,
+        "interval",
+        seconds=interval.total_seconds(),
+        next_run_time=slot_run_time(job_id, interval, now),
+        id=job_id,
+        replace_existing=True,
+        args=[func, *args]
+    )
+
+
+# Arguments of the current location jobs by job id
+def location_jobs() -> dict:
+    if engine is not None:
+        return {job.id: job.args for job in engine.jobs.values()}
+    return {job.id: list(job.args) for job in scheduler.get_jobs() if job.id.startswith(LOCATION_JOB_PREFIX)}
+
+
+def remove_location_job(job_id: str):
+    if engine is not None:
+        engine.remove_job(job_id)
+    else:
+        scheduler.remove_job(job_id)
+
+
+def modify_location_job(job_id: str, args: list):
+    if engine is not None:
+        engine.modify_job(job_id, args)
+    else:
+        scheduler.modify_job(job_id, args=args)
+
+
+# Reconciles the location jobs with the cached parcels and UAV models.
+# Only jobs of added or removed parcels are added or removed, and jobs whose arguments changed
+# (eg. new UAV models) are updated in place, so unchanged jobs keep their phase.
+# Returns the number of added, updated and removed jobs.
+def schedule_tasks(app: FastAPI) -> dict:
+    thi = bool(config.PUSH_THI_TO_FARMCALENDAR)
+    flight = bool(config.PUSH_FLIGHT_FORECAST_TO_FARMCALENDAR)
+    spray = bool(config.PUSH_SPRAY_F_TO_FARMCALENDAR)
+
+    locations = getattr(app.state, "locations", None) or []
+    if not locations:
+        logging.debug("No locations available for scheduling.")
+
+    desired = {}
+    if thi or flight or spray:
+        uavmodels = getattr(app.state, "uavmodels", None)
+        for lat, lon in locations:
+            desired[f"{LOCATION_JOB_PREFIX}{lat}_{lon}"] = [
+                post_location_observations, lat, lon, uavmodels, thi, flight, spray
+            ]
+    existing = location_jobs()
+
+    # Forecasts are only posted when new ones are generated, so the pipeline follows the THI interval if enabled
+    interval = timedelta(hours=float(config.INTERVAL_THI_TO_FARMCALENDAR)) if thi else timedelta(days=5)
+    now = datetime.now()
+    changes = {"added": 0, "updated": 0, "removed": 0}
+    for job_id, args in existing.items():
+        if job_id not in desired:
+            remove_location_job(job_id)
+            changes["removed"] += 1
+        elif args != desired[job_id]:
+            modify_location_job(job_id, desired[job_id])
+            changes["updated"] += 1
+    for job_id, args in desired.items():
+        if job_id not in existing:
+            add_location_job(args[0], job_id, interval, now, args[1:])
+            changes["added"] += 1
+
+    logging.info(
+        "Reconciled location jobs: %(added)d added, %(updated)d updated, %(removed)d removed", changes
+    )
+    return changes
+
+
+# Post THI, flight and spray conditions forecasts for a single location
+async def post_location_observations(lat, lon, uavmodels, thi, flight, spray):
+    fc_client = scheduler_app.state.fc_client
+    logging.debug(f"Posting observations at location: ({lat}, {lon})")
+    await fc_client.send_location_observations(lat, lon, uavmodels, thi=thi, flight=flight, spray=spray)
 
 
 # Fetch locations & update scheduler every 24 hours
-async def refresh_locations_and_schedule(app):
-    await app.state.fc_client.fetch_and_cache_locations()
-    schedule_tasks(app)
+async def refresh_locations_and_schedule():
+    await scheduler_app.state.fc_client.fetch_and_cache_locations()
+    schedule_tasks(scheduler_app)
 
 # Fetch machines & update scheduler every 24 hours
-async def refresh_machines_and_schedule(app):
-    await app.state.fc_client.fetch_and_cache_uavs()
-    schedule_tasks(app)
+async def refresh_machines_and_schedule():
+    await scheduler_app.state.fc_client.fetch_and_cache_uavs()
+    schedule_tasks(scheduler_app)
+
+
+# Posts the observations waiting in the Farm Calendar outbox
+async def drain_outbox():
+    await scheduler_app.state.fc_client.drain_outbox()
+
+
+# Refreshes the cached weather of the cached parcels before it expires
+async def warm_cache():
+    warmer = CacheWarmer(scheduler_app.weather_app, scheduler_app.dao)
+    await with_priority(Priority.WARMING, warmer.warm(getattr(scheduler_app.state, "locations", None) or []))
 
 
+# Configures the job store and the misfire policy.
+# With the MongoDB job store, jobs keep their next run time across restarts and jobs that were
+# due while the service was down run once (if coalescing) within the misfire grace time.
+# The job store has its own client, which it closes when the scheduler is shut down: the app's
+# Motor client must stay usable. Its calls are synchronous and run on the event loop thread, which
+# is acceptable for the few small documents read and written when jobs are added, updated or run.
+def configure_scheduler(app: FastAPI):
+    if config.SCHEDULER_JOBSTORE == "mongodb":
+        jobstore = MongoDBJobStore(
+            database=config.DATABASE_NAME,
+            collection=config.SCHEDULER_JOBS_COLLECTION,
+            client=MongoClient(config.DATABASE_URI)
+        )
+    else:
+        jobstore = MemoryJobStore()
+
+    scheduler.configure(
+        jobstores={"default": jobstore},
+        job_defaults={
+            "coalesce": config.SCHEDULER_COALESCE,
+            "misfire_grace_time": config.SCHEDULER_MISFIRE_GRACE_SECONDS,
+        }
+    )
+
 
 def start_scheduler(app: FastAPI):
+    global scheduler_app, engine
+    scheduler_app = app
+    if config.SCHEDULER_ENGINE == "heap":
+        engine = HeapScheduler(config.SCHEDULER_MAX_CONCURRENT_JOBS)
 
+    configure_scheduler(app)
+    scheduler.start(paused=True)
     schedule_tasks(app)
 
     # Refresh locations and reschedule every 24 hours
-    scheduler.add_job(refresh_locations_and_schedule, "interval", hours=24, args=[app])
+    scheduler.add_job(
+        refresh_locations_and_schedule, "interval", hours=24,
+        id="refresh_locations", replace_existing=True
+    )
     # Refresh machines and reschedule every 24 hours
-    scheduler.add_job(refresh_machines_and_schedule, "interval", hours=24, args=[app])
+    scheduler.add_job(
+        refresh_machines_and_schedule, "interval", hours=24,
+        id="refresh_machines", replace_existing=True
+    )
+
+    # Retry observations that could not be posted
+    scheduler.add_job(
+        drain_outbox, "interval", seconds=config.FARM_CALENDAR_OUTBOX_DRAIN_SECONDS,
+        id="drain_outbox", replace_existing=True
+    )
+
+    if config.CACHE_WARMER_ENABLED:
+        scheduler.add_job(
+            warm_cache, "interval", minutes=config.CACHE_WARMER_INTERVAL_MINUTES,
+            next_run_time=datetime.now(), id="warm_cache", replace_existing=True
+        )
+
+    scheduler.resume()
+    if engine is not None:
+        engine.start()
 
 
-    scheduler.start()
+# Stops the scheduled jobs, eg. when this process is no longer the leader.
+# Persisted jobs are kept for the next leader; the shut down job store only closes its own client,
+# so the database stays usable and this process can be elected again.
+async def stop_scheduler():
+    global engine
+    if engine is not None:
+        engine.shutdown()
+        engine = None
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+        # AsyncIOScheduler shuts down on the next iteration of the event loop: wait for it, so that
+        # the pending shutdown does not stop a scheduler started again by a new election
+        await asyncio.sleep(0)
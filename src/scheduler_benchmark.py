@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+import logging
+import time
+import tracemalloc
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from src.scheduler_engine import HeapScheduler
+
+
+INTERVAL = timedelta(hours=8)
+
+
+async def job(*args):
+    pass
+
+
+# Measures the time and memory to schedule `count` location jobs, update 1% of them and
+# pop the ones due within a window, for APScheduler (memory job store) and the heap engine
+async def benchmark(count: int):
+    now = datetime.now()
+    ids = [f"location_task_{i / 1000}_{i / 1000}" for i in range(count)]
+    results = {}
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    aps = AsyncIOScheduler()
+    aps.start(paused=True)
+    for i, job_id in enumerate(ids):
+        aps.add_job(job, "interval", seconds=INTERVAL.total_seconds(), id=job_id,
+                    next_run_time=now + INTERVAL * (i / count), args=[i, i])
+    added = time.perf_counter()
+    for job_id in ids[::100]:
+        aps.modify_job(job_id, args=[0, 0])
+    updated = time.perf_counter()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    aps.shutdown(wait=False)
+    results["apscheduler"] = (added - started, updated - added, None, peak)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    heap = HeapScheduler()
+    for i, job_id in enumerate(ids):
+        heap.add_job(job_id, job, [i, i], INTERVAL.total_seconds(), (now + INTERVAL * (i / count)).timestamp())
+    added = time.perf_counter()
+    for job_id in ids[::100]:
+        heap.modify_job(job_id, [0, 0])
+    updated = time.perf_counter()
+    due = heap._pop_due((now + INTERVAL / 8).timestamp())
+    popped = time.perf_counter()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results["heap"] = (added - started, updated - added, (popped - updated, len(due)), peak)
+
+    print(f"{count} jobs")
+    for name, (add, update, pop, peak) in results.items():
+        line = f"{name:>12}: add {add:.2f}s, update 1% {update:.3f}s, peak memory {peak / 2 ** 20:.0f} MiB"
+        if pop:
+            line += f", pop {pop[1]} due {pop[0]:.3f}s"
+        print(line)
+
+
+if __name__ == "__main__":
+    logging.getLogger("apscheduler").setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(description="Benchmark the location job scheduling engines")
+    parser.add_argument("--jobs", type=int, default=100_000)
+    asyncio.run(benchmark(parser.parse_args().jobs))
@@ -0,0 +1,122 @@
+import asyncio
+from dataclasses import dataclass
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EngineJob:
+    id: str
+    func: Callable
+    args: List[Any]
+    interval: float
+    # UNIX timestamp of the next run
+    next_run_time: float
+    # Sequence number of the current heap entry, older entries are stale
+    seq: int = -1
+
+
+# Scheduling engine for large numbers of interval jobs.
+# Jobs are kept in a dict and their due times in a single heap, so adding, updating and
+# removing a job is O(log n) with no per-job trigger, lock or timer. Removed and rescheduled
+# jobs leave stale heap entries behind that are skipped when popped.
+# A single dispatcher task sleeps until the earliest due time and hands due jobs to a fixed
+# number of worker tasks through a queue, which bounds the number of jobs running at once.
+class HeapScheduler:
+
+    def __init__(self, workers: int = 10):
+        self.workers = workers
+        self.jobs: Dict[str, EngineJob] = {}
+        self._heap: List[tuple] = []
+        self._counter = itertools.count()
+        self._queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def add_job(self, job_id: str, func: Callable, args: List[Any], interval: float, next_run_time: float):
+        job = EngineJob(job_id, func, list(args), interval, next_run_time)
+        self.jobs[job_id] = job
+        self._push(job)
+
+    def get_job(self, job_id: str) -> Optional[EngineJob]:
+        return self.jobs.get(job_id)
+
+    def remove_job(self, job_id: str):
+        # The heap entry is discarded when it becomes due
+        self.jobs.pop(job_id, None)
+
+    def modify_job(self, job_id: str, args: List[Any]):
+        self.jobs[job_id].args = list(args)
+
+    def remove_all_jobs(self):
+        self.jobs.clear()
+        self._heap.clear()
+
+    def _push(self, job: EngineJob):
+        job.seq = next(self._counter)
+        heapq.heappush(self._heap, (job.next_run_time, job.seq, job.id))
+        if self._wakeup is not None and self._heap[0][2] == job.id:
+            self._wakeup.set()
+
+    # Pops the jobs due at `now` and schedules their next run.
+    # Runs missed by more than one interval are coalesced into one.
+    def _pop_due(self, now: float) -> List[EngineJob]:
+        due = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            run_time, seq, job_id = heapq.heappop(heap)
+            job = self.jobs.get(job_id)
+            if job is None or job.seq != seq:
+                continue
+            due.append(job)
+            missed = int((now - run_time) // job.interval)
+            job.next_run_time = run_time + (missed + 1) * job.interval
+            job.seq = next(self._counter)
+            heapq.heappush(heap, (job.next_run_time, job.seq, job.id))
+        return due
+
+    async def _dispatch(self):
+        while True:
+            for job in self._pop_due(time.time()):
+                await self._queue.put((job.func, job.args))
+
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self):
+        while True:
+            func, args = await self._queue.get()
+            try:
+                await func(*args)
+            except Exception as e: # pylint: disable=W0718 broad-exception-caught
+                logger.exception(e)
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        if self.running:
+            return
+        # Due jobs wait in the queue, never more than one per worker
+        self._queue = asyncio.Queue(maxsize=self.workers)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._dispatch())]
+        self._tasks.extend(asyncio.create_task(self._work()) for _ in range(self.workers))
+
+    def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+
+
+class AdmissionMetricsOut(BaseModel):
+    running: int
+    waiting: int
+    admitted: int
+    queued: int
+    shed: int
+    max_concurrency: int
+    max_queue: int
+    avg_wait_seconds: float
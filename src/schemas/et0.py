@@ -0,0 +1,30 @@
+from datetime import date
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+from src.schemas.point import GeoJSONOut
+
+
+class LocationIn(BaseModel):
+    lat: float = Field(..., ge=-90, le=90)
+    lon: float = Field(..., ge=-180, le=180)
+
+
+class ET0BatchIn(BaseModel):
+    locations: List[LocationIn] = Field(..., min_length=1, max_length=500)
+
+
+class ET0Out(BaseModel):
+    date: date
+    et0: float
+    unit: str = "mm/day"
+    location: GeoJSONOut
+
+
+# ET0 of a location of a batch, or the error that prevented it
+class ET0BatchOut(BaseModel):
+    lat: float
+    lon: float
+    et0: List[ET0Out] = []
+    error: Optional[str] = None
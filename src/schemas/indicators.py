@@ -0,0 +1,16 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+from src.schemas.point import GeoJSONOut
+
+
+class AccumulatedIndicatorsOut(BaseModel):
+    location: GeoJSONOut
+    season_start: datetime
+    last_timestamp: Optional[datetime]
+    growing_degree_days: float
+    chill_hours: float
+    heat_stress_hours: float
+    hours: float
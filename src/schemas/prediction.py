@@ -9,4 +9,5 @@ class PredictionOut(BaseModel):
     source: str
     spatial_entity: PointOut
     data_type: str
-    measurement_type: str
\ No newline at end of file
+    measurement_type: str
+    interpolated: bool = False
\ No newline at end of file
@@ -0,0 +1,11 @@
+from pydantic import BaseModel
+
+
+class SchedulerMetricsOut(BaseModel):
+    queued: int
+    running: int
+    completed: int
+    failed: int
+    max_concurrency: int
+    avg_wait_seconds: float
+    max_wait_seconds: float
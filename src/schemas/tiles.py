@@ -0,0 +1,20 @@
+from pydantic import BaseModel, Field, model_validator
+
+
+class BoundingBoxIn(BaseModel):
+    min_lat: float = Field(..., ge=-90, le=90)
+    min_lon: float = Field(..., ge=-180, le=180)
+    max_lat: float = Field(..., ge=-90, le=90)
+    max_lon: float = Field(..., ge=-180, le=180)
+
+    @model_validator(mode="after")
+    def check_corners(self):
+        if self.min_lat > self.max_lat or self.min_lon > self.max_lon:
+            raise ValueError("The minimum coordinates must not exceed the maximum ones")
+        return self
+
+
+class TilePrefillOut(BaseModel):
+    tiles: int
+    queued: int
+    precision: int
@@ -3,7 +3,8 @@ from typing import Dict, Any, Optional
 
 from fastapi import FastAPI, HTTPException
 
-from src.core.exceptions import RefreshJWTTokenError
+from src.core.context import call_timeout
+from src.core.exceptions import DeadlineExceededError, RefreshJWTTokenError
 
 
 class MicroserviceClient:
@@ -16,9 +17,9 @@ class MicroserviceClient:
         self.timeout = timeout
         self.client = httpx.AsyncClient(timeout=timeout)
 
-    def _get_auth_header(self) -> Dict[str, str]:
-        # Get token from app.state
-        token = self.app.state.access_token
+    async def _get_auth_header(self) -> Dict[str, str]:
+        # Get a valid token from the token manager of the app
+        token = await self.app.token_manager.get_token()
 
         if not token:
             raise HTTPException(
@@ -39,7 +40,7 @@ class MicroserviceClient:
         # Add auth headers if required
         headers = kwargs.get("headers", {})
         if auth_required:
-            headers.update(self._get_auth_header())
+            headers.update(await self._get_auth_header())
 
         # Add common headers
         headers.update(
@@ -52,12 +53,19 @@ class MicroserviceClient:
         kwargs["headers"] = headers
 
         try:
+            # Within a request, the call does not outlast its deadline
+            kwargs.setdefault("timeout", call_timeout(self.timeout))
             response = await self.client.request(method, url, **kwargs)
 
-            # Handle authentication errors
+            # Handle authentication errors: the token is refreshed once, shared with any
+            # concurrent request that got a 401 for the same token, and the request retried
+            if response.status_code == 401 and auth_required:
+                stale = headers["Authorization"].removeprefix("Bearer ")
+                await self.app.token_manager.refresh(stale=stale)
+                headers.update(await self._get_auth_header())
+                response = await self.client.request(method, url, **kwargs)
+
             if response.status_code == 401:
-                # TODO: Remove unused code
-                # await self.app.setup_authentication_tokens()
                 raise RefreshJWTTokenError(self.service_name)
 
             # Raise exception for other error responses
@@ -88,6 +96,13 @@ class MicroserviceClient:
                 detail=f"Service unavailable ({self.service_name}): {str(e)}",
             )
 
+        except DeadlineExceededError as e:
+            # No time left in the deadline of the request for the call
+            raise HTTPException(
+                status_code=504,
+                detail=f"{e.message} ({self.service_name})",
+            )
+
     async def get(
         self, endpoint: str, params: Optional[Dict[str, Any]] = None, **kwargs
     ):
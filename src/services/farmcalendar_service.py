@@ -1,9 +1,11 @@
 import asyncio
+from functools import partial
+import hashlib
 import json
 import re
 import time
-from typing import Optional, Tuple
-from uuid import uuid4
+from typing import Awaitable, Callable, List, Optional, Tuple, Union
+from uuid import NAMESPACE_URL, uuid5
 from fastapi import FastAPI, HTTPException
 import logging
 
@@ -12,23 +14,27 @@ import backoff
 from src.core import config
 from src import utils
 from src.core.exceptions import RefreshJWTTokenError
+from src.models.outbox import OutboxEntry
 from src.services.base import MicroserviceClient
 from src.services.interoperability import MadeBySensorSchema, ObservationSchema, QuantityValueSchema
 
 
 logger = logging.getLogger(__name__)
 
+# Responses of a Farm Calendar without the bulk observations endpoint
+BULK_UNSUPPORTED_STATUSES = {404, 405, 501}
+
 class FarmCalendarServiceClient(MicroserviceClient):
 
     def __init__(self, app: FastAPI):
         super().__init__(base_url=config.FARM_CALENDAR_URL, service_name="Farm Calendar", app=app)
+        # Whether the bulk observations endpoint is available, None until negotiated
+        self.bulk_supported: Optional[bool] = None
+        self._drain_lock = asyncio.Lock()
 
     @backoff.on_exception(
         backoff.expo,
         (HTTPException, RefreshJWTTokenError),
-        # The following lambda uses `self.app` instance from `details` argument to run
-        # the `setup_authentication_tokens` method in an async contenxt using the running event loop
-        on_backoff=lambda details: asyncio.create_task(details['args'][0].app.setup_authentication_tokens()),
         max_tries=3
     )
     async def fetch_or_create_activity_type(self, activity_type: str, description: str) -> str:
@@ -74,7 +80,6 @@ class FarmCalendarServiceClient(MicroserviceClient):
     @backoff.on_exception(
         backoff.expo,
         (HTTPException,RefreshJWTTokenError),
-        on_backoff=lambda details: asyncio.create_task(details['args'][0].app.setup_authentication_tokens()),
         max_tries=3
     )
     async def fetch_locations(self):
@@ -112,7 +117,6 @@ class FarmCalendarServiceClient(MicroserviceClient):
     @backoff.on_exception(
         backoff.expo,
         (HTTPException, RefreshJWTTokenError),
-        on_backoff=lambda details: asyncio.create_task(details['args'][0].app.setup_authentication_tokens()),
         max_tries=3
     )
     async def fetch_uavs(self):
@@ -125,50 +129,54 @@ class FarmCalendarServiceClient(MicroserviceClient):
         self.app.state.uavmodels = await self.fetch_uavs()
         logging.info(f"Cached {len(self.app.state.uavmodels)} UAV machines.")
 
-    # Async function to post THI data with JWT authentication
-    @backoff.on_exception(
-        backoff.expo,
-        (HTTPException, RefreshJWTTokenError),
-        on_backoff=lambda details: asyncio.create_task(details['args'][0].app.setup_authentication_tokens()),
-        max_tries=3
-    )
-    async def send_thi(self, lat, lon):
+    # Deterministic id of the result of an observation, so that retries post the same observation
+    def _result_id(self, key: str) -> str:
+        return f"urn:farmcalendar:QuantityValue:{uuid5(NAMESPACE_URL, key)}"
 
-        weather_data = await self.app.weather_app.save_weather_data_thi(lat, lon)
-        # Get current unix timestamp
-        current_timestamp = int(time.time())
+    # Idempotency key of a post of an outbox entry: a changed observation is a different post,
+    # which a Farm Calendar honouring idempotency keys must not drop as a replay of the first one
+    def _idempotency_key(self, entry: OutboxEntry) -> str:
+        return f"{entry.id}:{entry.fingerprint}" if entry.fingerprint else entry.id
+
+    # Outbox entry of an observation, fingerprinted by its title and value
+    def _outbox_entry(self, key: str, payload: dict, updatable: bool) -> OutboxEntry:
+        values = json.dumps([payload.get("title"), payload.get("hasResult", {}).get("hasValue")])
+        fingerprint = hashlib.blake2b(values.encode(), digest_size=8).hexdigest()
+        return OutboxEntry(id=key, payload=payload, fingerprint=fingerprint, updatable=updatable)
+
+    # Builds the THI observation of a location from a stored weather data entry.
+    # Keyed by location and time of the reading: a reading is posted once, and a new reading is posted
+    # even if its THI equals the previous one.
+    def thi_observation(self, lat, lon, weather_data) -> OutboxEntry:
+        # Time of the reading, or the current time if the payload has none
+        reading_timestamp = weather_data.data.get('dt') or int(time.time())
         timezone = weather_data.data['timezone']
+        phenomenon_time = utils.convert_timestamp_to_string(reading_timestamp, timezone, iso=True)
+        key = f"thi:{lat}:{lon}:{phenomenon_time}"
         observation = ObservationSchema(
             activityType=self.thi_activity_type,
             title=f"THI: {str(round(weather_data.thi, 2))}",
             details=(
-                f"Temperature Humidiy Index on {utils.convert_timestamp_to_string(current_timestamp, timezone)}"
+                f"Temperature Humidiy Index on {utils.convert_timestamp_to_string(reading_timestamp, timezone)}"
             ),
-            phenomenonTime=utils.convert_timestamp_to_string(current_timestamp, timezone, iso=True),
+            phenomenonTime=phenomenon_time,
             hasResult=QuantityValueSchema(
                 **{
-                    "@id": f"urn:farmcalendar:QuantityValue:{uuid4()}",
+                    "@id": self._result_id(key),
                     "hasValue": str(round(weather_data.thi, 2))
                 }
             ),
             observedProperty="temperature_humidity_index"
         )
-        json_payload = observation.model_dump(by_alias=True, exclude_none=True)
-        logger.debug(json_payload)
-        await self.post('/api/v1/Observations/', json=json_payload)
+        # A changed THI is a new observation
+        return self._outbox_entry(key, observation.model_dump(by_alias=True, exclude_none=True), updatable=False)
 
-    # Async function to post Flight Forecast data with JWT authentication
-    @backoff.on_exception(
-        backoff.expo,
-        (HTTPException, RefreshJWTTokenError),
-        on_backoff=lambda details: asyncio.create_task(details['args'][0].app.setup_authentication_tokens()),
-        max_tries=3
-    )
-    async def send_flight_forecast(self, lat, lon, uavmodels):
-
-        fly_statuses = await self.app.weather_app.ensure_forecast_for_uavs_and_location(lat, lon, uavmodels, return_existing=False)
+    # Builds the flight forecast observations of a location, keyed by UAV model and time
+    def flight_forecast_observations(self, lat, lon, fly_statuses) -> List[OutboxEntry]:
+        observations = []
         for fly_status in fly_statuses:
             phenomenon_time = fly_status.timestamp.isoformat()
+            key = f"flight:{lat}:{lon}:{fly_status.uav_model}:{phenomenon_time}"
             weather_str = f"Weather params: {json.dumps(fly_status.weather_params)}"
             observation = ObservationSchema(
                 activityType=self.ff_activity_type,
@@ -181,28 +189,21 @@ class FarmCalendarServiceClient(MicroserviceClient):
                 madeBySensor=MadeBySensorSchema(name=fly_status.uav_model),
                 hasResult=QuantityValueSchema(
                     **{
-                        "@id": f"urn:farmcalendar:QuantityValue:{uuid4()}",
+                        "@id": self._result_id(key),
                         "hasValue": fly_status.status
                     }
                 ),
                 observedProperty="flight_forecast_observation"
             )
-            json_payload = observation.model_dump(by_alias=True, exclude_none=True)
-            logger.debug(json_payload)
-            await self.post('/api/v1/Observations/', json=json_payload)
-
-    # Async function to post spray conditions Forecast data with JWT authentication
-    @backoff.on_exception(
-        backoff.expo,
-        (HTTPException, RefreshJWTTokenError),
-        on_backoff=lambda details: asyncio.create_task(details['args'][0].app.setup_authentication_tokens()),
-        max_tries=3
-    )
-    async def send_spray_forecast(self, lat, lon):
-        spray_forecasts = await self.app.weather_app.ensure_spray_forecast_for_location(lat, lon, return_existing=False)
+            observations.append(self._outbox_entry(key, observation.model_dump(by_alias=True, exclude_none=True), updatable=True))
+        return observations
 
+    # Builds the spray conditions forecast observations of a location, keyed by time
+    def spray_forecast_observations(self, lat, lon, spray_forecasts) -> List[OutboxEntry]:
+        observations = []
         for sf in spray_forecasts:
             phenomenon_time = sf.timestamp.isoformat()
+            key = f"spray:{lat}:{lon}:{phenomenon_time}"
 
             observation = ObservationSchema(
                 activityType=self.sp_activity_type,
@@ -215,13 +216,173 @@ class FarmCalendarServiceClient(MicroserviceClient):
                 phenomenonTime=phenomenon_time,
                 hasResult=QuantityValueSchema(
                     **{
-                        "@id": f"urn:farmcalendar:QuantityValue:{uuid4()}",
+                        "@id": self._result_id(key),
                         "hasValue": sf.spray_conditions
                     }
                 ),
                 observedProperty="spray_forecast_observation"
             )
+            observations.append(self._outbox_entry(key, observation.model_dump(by_alias=True, exclude_none=True), updatable=True))
+        return observations
 
-            json_payload = observation.model_dump(by_alias=True, exclude_none=True)
+    # Posts observations to the Farm Calendar and returns the result of each one:
+    # the response of the Farm Calendar, or the error if it was not posted.
+    # Uses the bulk endpoint, unless `bulk` is unset, when the Farm Calendar supports it, which is negotiated
+    # on first use: a 404, 405 or 501 response disables bulk posting for the lifetime of the client.
+    # Otherwise observations are posted one by one, at most FARM_CALENDAR_MAX_CONCURRENT_REQUESTS
+    # at a time, with their idempotency key in the `Idempotency-Key` header.
+    async def post_observations(
+            self, observations: List[dict], keys: Optional[List[str]] = None, bulk: bool = True
+    ) -> List[Union[dict, Exception]]:
+        if not observations:
+            return []
+        for json_payload in observations:
             logger.debug(json_payload)
-            await self.post('/api/v1/Observations/', json=json_payload)
+
+        if bulk and config.FARM_CALENDAR_BULK_ENDPOINT and self.bulk_supported is not False:
+            results = await self._post_observations_bulk(observations, keys)
+            if results is not None:
+                return results
+
+        requests = [
+            partial(self.post, '/api/v1/Observations/', json=json_payload, headers={"Idempotency-Key": key} if key else {})
+            for json_payload, key in zip(observations, keys or [None] * len(observations))
+        ]
+        return await self._limited(requests)
+
+    # Updates observations already in the Farm Calendar, given as (observation id, payload) pairs.
+    # Returns the result of each one as `post_observations`.
+    async def patch_observations(self, observations: List[Tuple[str, dict]]) -> List[Union[dict, Exception]]:
+        requests = [
+            partial(self.patch, f"/api/v1/Observations/{remote_id.rsplit(':', 1)[-1]}/", json=json_payload)
+            for remote_id, json_payload in observations
+        ]
+        return await self._limited(requests)
+
+    # Runs requests at most FARM_CALENDAR_MAX_CONCURRENT_REQUESTS at a time, returning their results
+    async def _limited(self, requests: List[Callable[[], Awaitable[dict]]]) -> List[Union[dict, Exception]]:
+        semaphore = asyncio.Semaphore(config.FARM_CALENDAR_MAX_CONCURRENT_REQUESTS)
+
+        async def run(request) -> Union[dict, Exception]:
+            async with semaphore:
+                try:
+                    return await request()
+                except Exception as e: # pylint: disable=W0718 broad-exception-caught
+                    return e
+
+        return await asyncio.gather(*(run(request) for request in requests))
+
+    # Posts observations in chunks to the bulk endpoint and returns the result of each one.
+    # Each chunk carries an idempotency key derived from the keys of its observations, so that a retried
+    # chunk is not posted twice. The observations created are matched to the posted ones by position when
+    # the Farm Calendar returns them as a list, and are empty otherwise.
+    # Returns None if the Farm Calendar turns out not to support bulk posting.
+    async def _post_observations_bulk(
+            self, observations: List[dict], keys: Optional[List[str]] = None
+    ) -> Optional[List[Union[dict, Exception]]]:
+        size = config.FARM_CALENDAR_BULK_SIZE
+        results = []
+        for i in range(0, len(observations), size):
+            chunk = observations[i:i + size]
+            headers = {}
+            if keys:
+                chunk_keys = "\n".join(keys[i:i + size]).encode()
+                headers["Idempotency-Key"] = hashlib.blake2b(chunk_keys, digest_size=16).hexdigest()
+            try:
+                response = await self.post(config.FARM_CALENDAR_BULK_ENDPOINT, json=chunk, headers=headers)
+            except HTTPException as e:
+                if not self.bulk_supported and e.status_code in BULK_UNSUPPORTED_STATUSES:
+                    logger.info("Farm Calendar does not support bulk observations, posting them one by one")
+                    self.bulk_supported = False
+                    if i == 0:
+                        return None
+                results.extend([e] * len(chunk))
+            except Exception as e: # pylint: disable=W0718 broad-exception-caught
+                results.extend([e] * len(chunk))
+            else:
+                self.bulk_supported = True
+                if isinstance(response, list) and len(response) == len(chunk):
+                    results.extend(result if isinstance(result, dict) else {} for result in response)
+                else:
+                    results.extend([{}] * len(chunk))
+        return results
+
+    # Enqueues observations in the outbox. Observations unchanged since they were enqueued are skipped.
+    async def enqueue_observations(self, observations: List[OutboxEntry]):
+        new, changed = await self.app.dao.enqueue_outbox(observations)
+        logger.debug(
+            "Enqueued %d new and %d changed observations, %d unchanged",
+            new, changed, len(observations) - new - changed
+        )
+
+    # Posts the due outbox entries in batches. Changed observations already in the Farm Calendar are
+    # updated in place if FARM_CALENDAR_PATCH_CHANGED is set; updatable observations are then posted one
+    # by one, since the id of the created observation, needed to update it, is only known from a single post.
+    # Posted entries are marked as sent and only failed ones are retried later, with exponential backoff.
+    # Skipped if a drain is already running.
+    async def drain_outbox(self):
+        if self._drain_lock.locked():
+            return
+        async with self._drain_lock:
+            while True:
+                entries = await self.app.dao.find_due_outbox(config.FARM_CALENDAR_OUTBOX_BATCH_SIZE)
+                if not entries:
+                    return
+                patched = [e for e in entries if config.FARM_CALENDAR_PATCH_CHANGED and e.updatable and e.remote_id]
+                posted = [e for e in entries if e.id not in {p.id for p in patched}]
+                single = [e for e in posted if config.FARM_CALENDAR_PATCH_CHANGED and e.updatable]
+                bulk = [e for e in posted if not (config.FARM_CALENDAR_PATCH_CHANGED and e.updatable)]
+                results = await self.patch_observations([(e.remote_id, e.payload) for e in patched])
+                results += await self.post_observations(
+                    [e.payload for e in single], [self._idempotency_key(e) for e in single], bulk=False
+                )
+                results += await self.post_observations([e.payload for e in bulk], [self._idempotency_key(e) for e in bulk])
+                entries = patched + single + bulk
+
+                sent = [
+                    (entry, result.get("@id") or result.get("id") or entry.remote_id)
+                    for entry, result in zip(entries, results) if not isinstance(result, Exception)
+                ]
+                await self.app.dao.mark_outbox_sent(sent)
+                errors = [(entry, result) for entry, result in zip(entries, results) if isinstance(result, Exception)]
+                for entry, error in errors:
+                    await self.app.dao.mark_outbox_failed(
+                        entry, str(error),
+                        config.FARM_CALENDAR_OUTBOX_MAX_ATTEMPTS,
+                        config.FARM_CALENDAR_OUTBOX_RETRY_BASE_SECONDS,
+                        config.FARM_CALENDAR_OUTBOX_RETRY_MAX_SECONDS
+                    )
+                if errors:
+                    logger.warning("%d of %d observations not posted to Farm Calendar", len(errors), len(entries))
+
+    # Enqueues the current THI of a location and posts it
+    async def send_thi(self, lat, lon):
+        weather_data = await self.app.weather_app.save_weather_data_thi(lat, lon)
+        await self.enqueue_observations([self.thi_observation(lat, lon, weather_data)])
+        await self.drain_outbox()
+
+    # Enqueues the new flight forecasts of a location and posts them
+    async def send_flight_forecast(self, lat, lon, uavmodels):
+        fly_statuses = await self.app.weather_app.ensure_forecast_for_uavs_and_location(lat, lon, uavmodels, return_existing=False)
+        await self.enqueue_observations(self.flight_forecast_observations(lat, lon, fly_statuses))
+        await self.drain_outbox()
+
+    # Enqueues the new spray conditions forecasts of a location and posts them
+    async def send_spray_forecast(self, lat, lon):
+        spray_forecasts = await self.app.weather_app.ensure_spray_forecast_for_location(lat, lon, return_existing=False)
+        await self.enqueue_observations(self.spray_forecast_observations(lat, lon, spray_forecasts))
+        await self.drain_outbox()
+
+    # Enqueues the THI, flight and spray conditions forecasts of a location together and posts them.
+    # Current weather and forecast are fetched once for all of them.
+    async def send_location_observations(self, lat, lon, uavmodels, thi=True, flight=True, spray=True):
+        weather_data, fly_statuses, spray_forecasts = await self.app.weather_app.location_observations(
+            lat, lon, uavmodels, thi=thi, flight=flight, spray=spray
+        )
+        observations = []
+        if weather_data:
+            observations.append(self.thi_observation(lat, lon, weather_data))
+        observations.extend(self.flight_forecast_observations(lat, lon, fly_statuses))
+        observations.extend(self.spray_forecast_observations(lat, lon, spray_forecasts))
+        await self.enqueue_observations(observations)
+        await self.drain_outbox()
@@ -0,0 +1,248 @@
+from bisect import bisect_left
+import json
+import logging
+import os
+import time
+from numbers import Real
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from src.core import config
+from src.core.exceptions import SprayProfileNotFoundError
+from src.models.spray import SprayProfile, SprayStatus
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE_NAME = "default"
+
+# Thresholds applied to every crop and product unless a profile is selected
+DEFAULT_PROFILE = {
+    "name": DEFAULT_PROFILE_NAME,
+    "description": "Generic spray conditions",
+    "parameters": {
+        "temperature": [
+            {"status": "optimal", "lt": 18},
+            {"status": "marginal", "gte": 18, "lte": 25},
+        ],
+        "wind": [
+            {"status": "optimal", "lt": 15},
+            {"status": "marginal", "gte": 15, "lte": 25},
+        ],
+        "precipitation": [
+            {"status": "optimal", "gte": 0, "lte": 0},
+            {"status": "marginal", "gt": 0, "lte": 0.1},
+        ],
+        "humidity": [
+            {"status": "optimal", "gte": 60, "lte": 85},
+            {"status": "marginal", "gte": 45, "lt": 60},
+            {"status": "marginal", "gt": 85, "lte": 95},
+        ],
+        "delta_t": [
+            {"status": "optimal", "gte": 2, "lte": 8},
+            {"status": "marginal", "gte": 0, "lt": 2},
+            {"status": "marginal", "gt": 8, "lte": 10},
+        ],
+    },
+}
+
+# Evaluated parameters mapped to the keys of the detailed status
+PARAMETERS = {
+    "temperature": "temperature_status",
+    "wind": "wind_status",
+    "precipitation": "precipitation_status",
+    "humidity": "humidity_status",
+    "delta_t": "delta_t_status",
+}
+
+# Statuses by severity, the overall condition is the most severe one
+SEVERITY = [SprayStatus.OPTIMAL, SprayStatus.MARGINAL, SprayStatus.UNSUITABLE]
+RANK = {status: rank for rank, status in enumerate(SEVERITY)}
+
+BOUND_CHECKS = {
+    "gt": lambda value, bound: value > bound,
+    "gte": lambda value, bound: value >= bound,
+    "lt": lambda value, bound: value < bound,
+    "lte": lambda value, bound: value <= bound,
+}
+
+
+# Returns the status of the first band containing `value`. Values outside every band are unsuitable.
+def _band_status(bands: List[dict], value: float) -> SprayStatus:
+    for band in bands:
+        if all(check(value, band[key]) for key, check in BOUND_CHECKS.items() if key in band):
+            return SprayStatus(band["status"])
+    return SprayStatus.UNSUITABLE
+
+
+# Band lookup table of a single parameter.
+# The band boundaries split the real line into the boundaries themselves and the open
+# intervals between them. The status of each piece is resolved once, so evaluating a value
+# is a binary search instead of a chain of comparisons.
+class CompiledBands:
+
+    # Raises ValueError if a band has an unknown status or a non numeric bound
+    def __init__(self, bands: List[dict]):
+        for band in bands:
+            SprayStatus(band.get("status"))
+            for key in BOUND_CHECKS:
+                if key in band and (isinstance(band[key], bool) or not isinstance(band[key], Real)):
+                    raise ValueError(f"Bound {key} must be a number, got {band[key]!r}")
+        bounds = sorted({band[key] for band in bands for key in BOUND_CHECKS if key in band})
+        if bounds:
+            representatives = (
+                [bounds[0] - 1]
+                + [(low + high) / 2 for low, high in zip(bounds, bounds[1:])]
+                + [bounds[-1] + 1]
+            )
+        else:
+            representatives = [0]
+        self.bounds = bounds
+        # Severity rank at each boundary and on each interval around them
+        self.at = [RANK[_band_status(bands, bound)] for bound in bounds]
+        self.between = [RANK[_band_status(bands, value)] for value in representatives]
+
+    def ranks(self, values: List[float]) -> List[int]:
+        bounds, at, between = self.bounds, self.at, self.between
+        size = len(bounds)
+        ranks = []
+        for value in values:
+            i = bisect_left(bounds, value)
+            ranks.append(at[i] if i < size and bounds[i] == value else between[i])
+        return ranks
+
+
+# Spray profile compiled into one lookup table per parameter
+class CompiledSprayProfile:
+
+    # Raises ValueError if a parameter is unknown or its bands are malformed
+    def __init__(self, name: str, parameters: Dict[str, List[dict]]):
+        unknown = set(parameters) - set(PARAMETERS)
+        if unknown:
+            raise ValueError(f"Unknown spray parameters: {', '.join(sorted(unknown))}")
+        self.name = name
+        self.tables = {
+            parameter: CompiledBands(parameters.get(parameter, DEFAULT_PROFILE["parameters"][parameter]))
+            for parameter in PARAMETERS
+        }
+
+    # Evaluates a single set of weather parameters.
+    # Returns a tuple: (SprayStatus enum value, dictionary of individual parameter statuses)
+    def evaluate(self, temp, wind, precipitation, humidity, delta_t) -> Tuple[SprayStatus, Dict[str, SprayStatus]]:
+        return self.evaluate_many([temp], [wind], [precipitation], [humidity], [delta_t])[0]
+
+    # Evaluates columns of weather parameters, one value per forecast period
+    def evaluate_many(
+            self,
+            temp: List[float],
+            wind: List[float],
+            precipitation: List[float],
+            humidity: List[float],
+            delta_t: List[float]
+    ) -> List[Tuple[SprayStatus, Dict[str, SprayStatus]]]:
+        columns = {
+            "temperature": temp,
+            "wind": wind,
+            "precipitation": precipitation,
+            "humidity": humidity,
+            "delta_t": delta_t,
+        }
+        ranks = {parameter: self.tables[parameter].ranks(columns[parameter]) for parameter in PARAMETERS}
+
+        results = []
+        for row in zip(*(ranks[parameter] for parameter in PARAMETERS)):
+            details = {key: SEVERITY[rank] for key, rank in zip(PARAMETERS.values(), row)}
+            results.append((SEVERITY[max(row)], details))
+        return results
+
+
+default_profile = CompiledSprayProfile(DEFAULT_PROFILE_NAME, DEFAULT_PROFILE["parameters"])
+
+
+# Compiles and caches spray profiles loaded from a JSON file and from MongoDB.
+# Stored profiles are re-read once older than SPRAY_PROFILES_CACHE_SECONDS, so updates in MongoDB are picked up
+# without a restart. Invalid profiles are logged and skipped.
+class SprayProfileRegistry:
+
+    def __init__(self):
+        # Default and file profiles, never expire
+        self._profiles: Dict[str, CompiledSprayProfile] = {DEFAULT_PROFILE_NAME: default_profile}
+        # Profiles read from MongoDB with the monotonic time they were read at
+        self._stored: Dict[str, Tuple[CompiledSprayProfile, float]] = {}
+
+    def register(self, profile: dict) -> CompiledSprayProfile:
+        compiled = CompiledSprayProfile(profile["name"], profile["parameters"])
+        self._profiles[compiled.name] = compiled
+        return compiled
+
+    @property
+    def default(self) -> CompiledSprayProfile:
+        return self._profiles[DEFAULT_PROFILE_NAME]
+
+    # Compiles a stored profile and caches it until it expires
+    def _register_stored(self, profile: SprayProfile) -> CompiledSprayProfile:
+        compiled = CompiledSprayProfile(profile.name, profile.parameters)
+        self._stored[compiled.name] = (compiled, time.monotonic())
+        return compiled
+
+    # Parses and compiles a raw stored document, returns None if it is invalid
+    def _compile_stored(self, document: dict) -> Optional[CompiledSprayProfile]:
+        try:
+            return self._register_stored(SprayProfile.model_validate(document))
+        except (ValidationError, ValueError, TypeError) as e:
+            logger.warning("Skipping invalid spray profile %s stored in MongoDB: %s", document.get("name"), e)
+            return None
+
+    # Loads a JSON list of profiles. Missing files are ignored.
+    def load_file(self, path: str):
+        if not path or not os.path.isfile(path):
+            return
+        with open(path, encoding='utf-8') as profiles_file:
+            profiles = json.load(profiles_file)
+        loaded = 0
+        for profile in profiles:
+            try:
+                self.register(profile)
+                loaded += 1
+            except (KeyError, ValueError, TypeError, AttributeError) as e:
+                logger.warning("Skipping invalid spray profile in %s: %s", path, e)
+        logger.info("Loaded %d spray profiles from %s", loaded, path)
+
+    # Loads every profile stored in MongoDB. Stored profiles take precedence over file ones.
+    # Documents are read raw so a single malformed profile does not fail the whole load.
+    async def load_from_db(self):
+        documents = await SprayProfile.get_motor_collection().find().to_list(None)
+        self._stored.clear()
+        loaded = sum(self._compile_stored(document) is not None for document in documents)
+        logger.info("Loaded %d spray profiles from MongoDB", loaded)
+
+    # Drops every cached stored profile and loads them again
+    async def reload(self):
+        await self.load_from_db()
+
+    # Returns a compiled profile, falling back to MongoDB for profiles created after startup or expired.
+    # An invalid update keeps the last valid version of the profile.
+    # Raises SprayProfileNotFoundError if the profile does not exist.
+    async def get(self, name: Optional[str] = None) -> CompiledSprayProfile:
+        if not name:
+            return self.default
+        cached = self._stored.get(name)
+        if cached and time.monotonic() - cached[1] < config.SPRAY_PROFILES_CACHE_SECONDS:
+            return cached[0]
+        if not cached and name in self._profiles:
+            return self._profiles[name]
+
+        document = await SprayProfile.get_motor_collection().find_one({"name": name})
+        if document:
+            compiled = self._compile_stored(document)
+            if compiled:
+                return compiled
+            if cached:
+                self._stored[name] = (cached[0], time.monotonic())
+                return cached[0]
+        else:
+            self._stored.pop(name, None)
+        if name in self._profiles:
+            return self._profiles[name]
+        raise SprayProfileNotFoundError(name)
@@ -17,8 +17,10 @@ from fastapi import APIRouter
 import httpx
 from beanie.operators import In
 
-from src.models.spray import SprayStatus
+from src.core import config
+from src.core.context import call_timeout
 from src.models.uav import FlightStatus, UAVModel
+from src.spray_profiles import default_profile
 
 
 logger = logging.getLogger(__name__)
@@ -62,6 +64,7 @@ def generate_uuid(prefix, identifier=None):
     return f"urn:openagri:{prefix}:{identifier if identifier else uuid.uuid4()}"
 
 URN_BASE_NAMESPACE = 'urn:openagri'
+EARTH_RADIUS = 6371008.8 # meters
 
 # Generate prefix for OCSM ids
 def generate_urn_prefix(*class_names):
@@ -74,8 +77,11 @@ def generate_urn(*class_names, obj_id):
     return f'{urn_prefix}:{obj_id}'
 
 
+# GET request returning the JSON response. Within a request, the call is cut short to leave
+# REQUEST_DEADLINE_RESERVE_SECONDS of its deadline to fall back on cached data.
 async def http_get(url: str) -> dict:
-    async with httpx.AsyncClient() as client:
+    timeout = call_timeout(config.UPSTREAM_TIMEOUT_SECONDS, config.REQUEST_DEADLINE_RESERVE_SECONDS)
+    async with httpx.AsyncClient(timeout=timeout) as client:
         r = await client.get(url)
         r.raise_for_status()
         return r.json()
@@ -89,6 +95,15 @@ def calculate_thi(temperature: float, relative_humidity: float) -> float:
     return round(thi, 2)
 
 
+# Great-circle distance in meters between two (lat, lon) coordinates
+def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
 def number_to_base32_string(num: float) -> str:
     '''
     Explanation:
@@ -218,6 +233,72 @@ def calculate_wet_bulb(t_dry, rh_percent):
 
 
 
+# Saturation vapour pressure (kPa) at temperature t in Celsius (FAO-56 eq. 11)
+def saturation_vapour_pressure(t):
+    return 0.6108 * math.exp(17.27 * t / (t + 237.3))
+
+
+def calculate_et0(day_of_year, latitude, t_min, t_max, rh_mean, wind_speed, pressure, cloud_cover, elevation=0.0):
+    """
+    Calculate daily reference evapotranspiration (ET0) with the FAO-56 Penman-Monteith equation.
+    https://www.fao.org/4/x0490e/x0490e00.htm
+
+    Every parameter except elevation is a sequence with one value per day and location,
+    so many parcels and days are evaluated in a single call.
+
+    Parameters:
+    day_of_year (list[int]): Day of the year (1-366)
+    latitude (list[float]): Latitude in decimal degrees
+    t_min, t_max (list[float]): Daily minimum and maximum temperature in Celsius
+    rh_mean (list[float]): Mean relative humidity as a percentage (0-100)
+    wind_speed (list[float]): Mean wind speed at 10m in m/s
+    pressure (list[float]): Mean atmospheric pressure in hPa
+    cloud_cover (list[float]): Mean cloud cover as a percentage (0-100)
+    elevation (float): Elevation above sea level in meters
+
+    Returns:
+    list[float]: Reference evapotranspiration in mm/day
+
+    Note: Sunshine duration is not available in forecasts, so the relative sunshine duration
+    is approximated by the clear sky fraction (1 - cloud cover).
+    """
+    solar_constant = 0.0820 # MJ m-2 min-1
+    stefan_boltzmann = 4.903e-9 # MJ K-4 m-2 day-1
+    wind_height_factor = 4.87 / math.log(67.8 * 10 - 5.42) # 10m to 2m wind speed
+
+    et0 = []
+    for doy, lat, tn, tx, rh, u10, p, cc in zip(day_of_year, latitude, t_min, t_max, rh_mean, wind_speed, pressure, cloud_cover):
+        t_mean = (tx + tn) / 2
+        delta = 4098 * saturation_vapour_pressure(t_mean) / (t_mean + 237.3) ** 2
+        gamma = 0.000665 * p / 10
+        es = (saturation_vapour_pressure(tx) + saturation_vapour_pressure(tn)) / 2
+        ea = es * rh / 100
+        u2 = u10 * wind_height_factor
+
+        # Extraterrestrial radiation (eq. 21)
+        phi = math.radians(lat)
+        dr = 1 + 0.033 * math.cos(2 * math.pi * doy / 365)
+        declination = 0.409 * math.sin(2 * math.pi * doy / 365 - 1.39)
+        ws = math.acos(min(max(-math.tan(phi) * math.tan(declination), -1), 1))
+        ra = 24 * 60 / math.pi * solar_constant * dr * (
+            ws * math.sin(phi) * math.sin(declination) + math.cos(phi) * math.cos(declination) * math.sin(ws)
+        )
+
+        # Net radiation (eq. 35-40)
+        rs = (0.25 + 0.5 * (1 - cc / 100)) * ra
+        rso = (0.75 + 2e-5 * elevation) * ra
+        relative_rs = min(rs / rso, 1.0) if rso > 0 else 1.0
+        rnl = stefan_boltzmann * ((tx + 273.16) ** 4 + (tn + 273.16) ** 4) / 2 * \
+              (0.34 - 0.14 * math.sqrt(max(ea, 0))) * (1.35 * relative_rs - 0.35)
+        rn = (1 - 0.23) * rs - rnl
+
+        # Soil heat flux is negligible on a daily step
+        value = (0.408 * delta * rn + gamma * 900 / (t_mean + 273) * u2 * (es - ea)) / (delta + gamma * (1 + 0.34 * u2))
+        et0.append(round(max(value, 0.0), 2))
+
+    return et0
+
+
 # Determines flight conditions based on uav specifications and weather data
 async def evaluate_flight_conditions(uav: UAVModel, weather: dict) -> FlightStatus:
     temp = weather["temp"]
@@ -257,7 +338,7 @@ async def evaluate_flight_conditions(uav: UAVModel, weather: dict) -> FlightStat
     return FlightStatus.OK
 
 #   Evaluate spray conditions based on weather data
-#   Determines the spray condition based on weather parameters.
+#   Determines the spray condition based on weather parameters using the default spray profile.
 #   Returns a tuple: (spray_condition, detailed_status_dict)
 #
 #   Parameters:
@@ -271,55 +352,4 @@ async def evaluate_flight_conditions(uav: UAVModel, weather: dict) -> FlightStat
 #   - tuple: (SprayStatus enum value, dictionary of individual parameter statuses)
 #
 def evaluate_spray_conditions(temp, wind, precipitation, humidity, delta_t):
-    status = {}
-
-    # Temperature Check
-    if temp < 18:
-        status["temperature_status"] = SprayStatus.OPTIMAL
-    elif 18 <= temp <= 25:
-        status["temperature_status"] = SprayStatus.MARGINAL
-    else:
-        status["temperature_status"] = SprayStatus.UNSUITABLE
-
-    # Wind Speed Check
-    if wind < 15:
-        status["wind_status"] = SprayStatus.OPTIMAL
-    elif 15 <= wind <= 25:
-        status["wind_status"] = SprayStatus.MARGINAL
-    else:
-        status["wind_status"] = SprayStatus.UNSUITABLE
-
-    # Precipitation Check
-    if precipitation == 0:
-        status["precipitation_status"] = SprayStatus.OPTIMAL
-    elif 0 < precipitation <= 0.1:
-        status["precipitation_status"] = SprayStatus.MARGINAL
-    else:
-        status["precipitation_status"] = SprayStatus.UNSUITABLE
-
-    # Humidity Check
-    if 60 <= humidity <= 85:
-        status["humidity_status"] = SprayStatus.OPTIMAL
-    elif 45 <= humidity < 60 or 85 < humidity <= 95:
-        status["humidity_status"] = SprayStatus.MARGINAL
-    else:
-        status["humidity_status"] = SprayStatus.UNSUITABLE
-
-    # Delta T Check
-    if 2 <= delta_t <= 8:
-        status["delta_t_status"] = SprayStatus.OPTIMAL
-    elif 0 <= delta_t < 2 or 8 < delta_t <= 10:
-        status["delta_t_status"] = SprayStatus.MARGINAL
-    else:
-        status["delta_t_status"] = SprayStatus.UNSUITABLE
-
-    # Determine overall spray condition
-    if SprayStatus.UNSUITABLE in status.values():
-        spray_condition = SprayStatus.UNSUITABLE
-    elif SprayStatus.MARGINAL in status.values():
-        spray_condition = SprayStatus.MARGINAL
-    else:
-        spray_condition = SprayStatus.OPTIMAL
-
-    return spray_condition, status
-
+    return default_profile.evaluate(temp, wind, precipitation, humidity, delta_t)
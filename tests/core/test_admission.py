@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+from tests.fixtures import *
+
+from src.core.admission import AdmissionController
+from src.core.exceptions import ServiceOverloadedError
+from src.core.upstream import Priority, with_priority
+
+
+class TestAdmissionController:
+
+    # Test executions past the concurrency limit are queued, then shed once the queue is full
+    @pytest.mark.anyio
+    async def test_queue_and_shed(self):
+        controller = AdmissionController("test", max_concurrent=1, max_queue=1, queue_timeout=5)
+        release = asyncio.Event()
+
+        async def execution():
+            async with controller.admit():
+                await release.wait()
+
+        running = asyncio.create_task(execution())
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(execution())
+        await asyncio.sleep(0)
+        assert controller.snapshot()["running"] == 1
+        assert controller.snapshot()["waiting"] == 1
+
+        with pytest.raises(ServiceOverloadedError) as shed:
+            async with controller.admit():
+                pass
+        assert shed.value.retry_after >= 1
+
+        release.set()
+        await asyncio.gather(running, queued)
+        metrics = controller.snapshot()
+        assert (metrics["admitted"], metrics["queued"], metrics["shed"]) == (2, 1, 1)
+        assert (metrics["running"], metrics["waiting"]) == (0, 0)
+
+    # Test queued executions are shed after the queue timeout
+    @pytest.mark.anyio
+    async def test_queue_timeout(self):
+        controller = AdmissionController("test", max_concurrent=1, max_queue=10, queue_timeout=0.05)
+        async with controller.admit():
+            with pytest.raises(ServiceOverloadedError):
+                async with controller.admit():
+                    pass
+        assert controller.snapshot()["shed"] == 1
+        # The slot is free again
+        async with controller.admit():
+            pass
+
+    # Test cold-path user requests are answered with 503 and Retry-After when shed,
+    # while scheduled work is not limited
+    @pytest.mark.anyio
+    async def test_shed_request(self, test_jwt_token, async_client, openweathermap_srv):
+        openweathermap_srv.admission = AdmissionController("test", max_concurrent=1, max_queue=0, queue_timeout=1)
+        openweathermap_srv.dao.find_weather_data_for_point = AsyncMock(return_value=None)
+        openweathermap_srv.fetch_weather_data = AsyncMock(return_value="weather")
+
+        headers = {"Authorization": f"Bearer {test_jwt_token}"}
+        async with openweathermap_srv.admission.admit():
+            response = await async_client.get("/api/data/weather", params={"lat": 10.0, "lon": 20.0}, headers=headers)
+            assert response.status_code == 503
+            assert int(response.headers["Retry-After"]) >= 1
+
+            assert await with_priority(Priority.SCHEDULED, openweathermap_srv.save_weather_data_thi(10.0, 20.0)) == "weather"
+
+        response = await async_client.get("/api/admission/metrics", headers=headers)
+        assert response.json()["shed"] == 1
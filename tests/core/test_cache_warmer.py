@@ -0,0 +1,156 @@
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock
+
+import pytest
+from tests.fixtures import *
+
+from src import cache_warmer
+from src.cache_warmer import CacheWarmer
+from src.models.prediction import Prediction
+from src.models.weather_data import WeatherData
+
+
+async def cache(app, lat, lon, age: timedelta, forecast=True, weather=True):
+    point = await app.dao.find_or_create_point(lat, lon)
+    created_at = datetime.utcnow() - age
+    if forecast:
+        await Prediction(
+            value=20.0, measurement_type="ambient_temperature", timestamp=datetime.utcnow(),
+            source="openweathermaps", data_type="weather", spatial_entity=point, created_at=created_at
+        ).create()
+    if weather:
+        await WeatherData(spatial_entity=point, data={}, thi=60.0, created_at=created_at).create()
+
+
+class TestCacheWarmer:
+
+    # Test only missing and expiring entries are refreshed, soonest expiring first, within the budget
+    @pytest.mark.anyio
+    async def test_warm_within_budget(self, app, monkeypatch):
+        monkeypatch.setattr(config, "FORECAST_DATA_CACHE_TIME", 3)
+        monkeypatch.setattr(config, "CURRENT_WEATHER_DATA_CACHE_TIME", 1)
+        monkeypatch.setattr(config, "CACHE_WARMER_LEAD_MINUTES", 15)
+        monkeypatch.setattr(config, "CACHE_WARMER_MAX_CALLS", 3)
+        # Fresh
+        await cache(app, 1.0, 1.0, timedelta(minutes=10))
+        # Forecast fresh, weather expiring in 5 minutes
+        await cache(app, 2.0, 2.0, timedelta(minutes=55))
+        # Forecast expiring in 10 minutes, weather expired
+        await cache(app, 3.0, 3.0, timedelta(minutes=170))
+
+        app.weather_app.fetch_predictions = AsyncMock()
+        app.weather_app.fetch_weather_data = AsyncMock()
+        warmer = CacheWarmer(app.weather_app, app.dao)
+        # Location 4.0 is not cached at all
+        stats = await warmer.warm([(1.0, 1.0), (2.0, 2.0), (3.0, 3.0), (4.0, 4.0)])
+
+        assert stats == {"refreshed": 3, "failed": 0, "deferred": 2}
+        forecasts = [call.args for call in app.weather_app.fetch_predictions.await_args_list]
+        weather = [call.args for call in app.weather_app.fetch_weather_data.await_args_list]
+        assert forecasts == [(4.0, 4.0)]
+        assert sorted(weather) == [(3.0, 3.0), (4.0, 4.0)]
+
+        # The deferred entries are the next ones to be refreshed
+        due = await warmer.due_entries([(1.0, 1.0), (2.0, 2.0), (3.0, 3.0)], datetime.utcnow())
+        assert [(kind, lat) for _, kind, lat, _ in due] == [("weather", 3.0), ("weather", 2.0), ("forecast", 3.0)]
+
+    # Test a refreshed forecast replaces the previous one instead of duplicating it
+    @pytest.mark.anyio
+    async def test_refreshed_forecast_is_not_duplicated(self, app):
+        await cache(app, 1.0, 1.0, timedelta(minutes=170), weather=False)
+        predictions = await app.dao.find_predictions_for_point(1.0, 1.0)
+        point = predictions[0].spatial_entity
+        await Prediction(
+            value=25.0, measurement_type="ambient_temperature", timestamp=predictions[0].timestamp,
+            source="openweathermaps", data_type="weather", spatial_entity=point
+        ).create()
+
+        predictions = await app.dao.find_predictions_for_point(1.0, 1.0)
+        assert [p.value for p in predictions] == [25.0]
+
+    # Test parcels of the same tile share a single forecast entry when tiling is enabled
+    @pytest.mark.anyio
+    async def test_tiled_forecast_entries(self, app, monkeypatch):
+        monkeypatch.setattr(config, "FORECAST_TILING_ENABLED", True)
+        monkeypatch.setattr(config, "FORECAST_TILE_PRECISION", 5)
+        # About 300 m apart, in the same tile
+        parcels = [(38.0001, 23.7001), (38.0021, 23.7031)]
+        warmer = CacheWarmer(app.weather_app, app.dao)
+
+        due = await warmer.due_entries(parcels, datetime.utcnow())
+        centroid = app.weather_app.forecast_location(*parcels[0])
+        assert [(kind, lat, lon) for _, kind, lat, lon in due] == [
+            ("forecast", *centroid), ("weather", *parcels[0]), ("weather", *parcels[1])
+        ]
+
+    # Test a bounding box is prefilled with the forecast of its tiles, in the background
+    @pytest.mark.anyio
+    async def test_prefill(self, app, async_client, test_jwt_token, monkeypatch):
+        monkeypatch.setattr(config, "FORECAST_TILING_ENABLED", True)
+        monkeypatch.setattr(config, "FORECAST_TILE_PRECISION", 5)
+        monkeypatch.setattr(config, "FORECAST_TILE_PREFILL_MAX_TILES", 10)
+        app.weather_app.fetch_predictions = AsyncMock()
+        headers = {"Authorization": f"Bearer {test_jwt_token}"}
+
+        box = {"min_lat": 38.0, "min_lon": 23.7, "max_lat": 38.05, "max_lon": 23.75}
+        response = await async_client.post("/api/data/forecast5/prefill", json=box, headers=headers)
+        assert response.status_code == 202
+        assert response.json() == {"tiles": 4, "queued": 4, "precision": 5}
+        await asyncio.gather(*cache_warmer._prefills)
+        assert app.weather_app.fetch_predictions.await_count == 4
+        assert not cache_warmer._prefilling_tiles
+
+        box["max_lat"] = 39.0
+        response = await async_client.post("/api/data/forecast5/prefill", json=box, headers=headers)
+        assert response.status_code == 422
+
+        monkeypatch.setattr(config, "FORECAST_TILING_ENABLED", False)
+        response = await async_client.post("/api/data/forecast5/prefill", json=box, headers=headers)
+        assert response.status_code == 409
+
+    # Test tiles already being prefilled are not queued again, and prefills past the limit are refused
+    @pytest.mark.anyio
+    async def test_prefill_limits(self, app, async_client, test_jwt_token, monkeypatch):
+        monkeypatch.setattr(config, "FORECAST_TILING_ENABLED", True)
+        monkeypatch.setattr(config, "FORECAST_TILE_PRECISION", 5)
+        monkeypatch.setattr(config, "FORECAST_TILE_PREFILL_MAX_RUNNING", 1)
+        release = asyncio.Event()
+
+        async def fetch_predictions(lat, lon):
+            await release.wait()
+
+        app.weather_app.fetch_predictions = AsyncMock(side_effect=fetch_predictions)
+        headers = {"Authorization": f"Bearer {test_jwt_token}"}
+
+        box = {"min_lat": 38.0, "min_lon": 23.7, "max_lat": 38.05, "max_lon": 23.75}
+        response = await async_client.post("/api/data/forecast5/prefill", json=box, headers=headers)
+        assert response.json()["queued"] == 4
+        # The same tiles are already being prefilled
+        response = await async_client.post("/api/data/forecast5/prefill", json=box, headers=headers)
+        assert response.status_code == 202
+        assert response.json()["queued"] == 0
+        # Other tiles would need another prefill
+        box = {"min_lat": 39.0, "min_lon": 23.7, "max_lat": 39.01, "max_lon": 23.71}
+        response = await async_client.post("/api/data/forecast5/prefill", json=box, headers=headers)
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+
+        release.set()
+        await asyncio.gather(*cache_warmer._prefills)
+        response = await async_client.post("/api/data/forecast5/prefill", json=box, headers=headers)
+        assert response.json()["queued"] == 1
+        await asyncio.gather(*cache_warmer._prefills)
+
+    # Test only the cache entries of the requested locations are read
+    @pytest.mark.anyio
+    async def test_find_cache_times_of_locations(self, app):
+        for location in ((1.0, 1.0), (2.0, 2.0), (3.0, 3.0)):
+            await cache(app, *location, timedelta(minutes=10))
+
+        forecast_times, weather_times = await app.dao.find_cache_times([(1.0, 1.0), (4.0, 4.0)], [(2.0, 2.0)])
+        assert list(forecast_times) == [(1.0, 1.0)]
+        assert list(weather_times) == [(2.0, 2.0)]
+        assert await app.dao.find_cache_times([], []) == ({}, {})
+        indexes = await Prediction.get_motor_collection().index_information()
+        assert any(list(index["key"])[0][0] == "spatial_entity.location.coordinates" for index in indexes.values())
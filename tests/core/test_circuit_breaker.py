@@ -0,0 +1,126 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from tests.fixtures import *
+
+from src.core.circuit_breaker import CircuitBreaker
+from src.core.context import mark_stale
+from src.core.exceptions import CircuitOpenError
+from src.core.middlewares import StalenessMiddleware
+from src.external_services import providers
+from src.external_services.providers import OpenWeatherMapProvider
+
+
+async def fail():
+    raise httpx.ConnectError("down")
+
+
+async def succeed():
+    return "ok"
+
+
+class TestCircuitBreaker:
+
+    # Test the circuit opens after consecutive failures and short-circuits calls
+    @pytest.mark.anyio
+    async def test_opens_after_failures(self):
+        breaker = CircuitBreaker("test", failure_threshold=3, slow_call_seconds=1, reset_seconds=60)
+        for _ in range(3):
+            with pytest.raises(httpx.ConnectError):
+                await breaker.call(fail)
+        assert breaker.state == CircuitBreaker.OPEN
+
+        calls = 0
+
+        async def count():
+            nonlocal calls
+            calls += 1
+
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(count)
+        assert calls == 0
+
+    # Test slow calls count as failures
+    @pytest.mark.anyio
+    async def test_slow_calls_open_circuit(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, slow_call_seconds=0.01, reset_seconds=60)
+        for _ in range(2):
+            await breaker.call(asyncio.sleep, 0.02)
+        assert breaker.state == CircuitBreaker.OPEN
+
+    # Test a single trial call is let through after the reset time and closes the circuit
+    @pytest.mark.anyio
+    async def test_half_open_trial(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, slow_call_seconds=1, reset_seconds=0.01)
+        with pytest.raises(httpx.ConnectError):
+            await breaker.call(fail)
+        await asyncio.sleep(0.02)
+
+        trial = asyncio.create_task(breaker.call(asyncio.sleep, 0.01))
+        await asyncio.sleep(0)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(succeed)
+        await trial
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert await breaker.call(succeed) == "ok"
+
+        # A failed trial opens the circuit again
+        with pytest.raises(httpx.ConnectError):
+            await breaker.call(fail)
+        await asyncio.sleep(0.02)
+        with pytest.raises(httpx.ConnectError):
+            await breaker.call(fail)
+        assert breaker.state == CircuitBreaker.OPEN
+
+    # Test OpenWeatherMap calls queued for the call budget do not count as slow upstream calls
+    @pytest.mark.anyio
+    async def test_queued_calls_not_slow(self, monkeypatch):
+        monkeypatch.setattr(config, "OPENWEATHERMAP_BREAKER_SLOW_CALL_SECONDS", 0.05)
+        monkeypatch.setattr(config, "OPENWEATHERMAP_MAX_CONCURRENT_INTERACTIVE", 1)
+        monkeypatch.setattr(config, "OPENWEATHERMAP_CALLS_PER_MINUTE", 6000)
+
+        async def http_get(url):
+            await asyncio.sleep(0.01)
+            return {"main": {"temp": 20.0}}
+
+        monkeypatch.setattr(providers.utils, "http_get", http_get)
+        provider = OpenWeatherMapProvider()
+        await asyncio.gather(*(provider.fetch_current(1.0, 1.0) for _ in range(20)))
+        assert provider.breakers["weather"].snapshot() == {"state": CircuitBreaker.CLOSED, "failures": 0}
+
+        # An open circuit fails at once, without spending the call budget
+        provider.breakers["weather"].failures = config.OPENWEATHERMAP_BREAKER_FAILURES - 1
+        provider.breakers["weather"]._record_failure()
+        used = provider.gateway.used
+        with pytest.raises(CircuitOpenError):
+            await provider.fetch_current(1.0, 1.0)
+        assert provider.gateway.used == used
+
+
+class TestStalenessMiddleware:
+
+    # Test responses serving stale data are flagged in their headers
+    @pytest.mark.anyio
+    async def test_stale_response_headers(self):
+        stub = FastAPI()
+        stub.add_middleware(StalenessMiddleware)
+
+        @stub.get("/fresh")
+        async def fresh():
+            return {}
+
+        @stub.get("/stale")
+        async def stale():
+            mark_stale(datetime.utcnow() - timedelta(hours=2))
+            return {}
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=stub), base_url="http://test") as client:
+            response = await client.get("/fresh")
+            assert "X-Data-Stale" not in response.headers
+            response = await client.get("/stale")
+            assert response.headers["X-Data-Stale"] == "true"
+            assert 7190 <= int(response.headers["X-Data-Age"]) <= 7210
@@ -0,0 +1,153 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from pymongo.errors import ExecutionTimeout
+from fastapi import FastAPI, HTTPException
+from tests.fixtures import *
+
+from src.core import context
+from src.core.context import call_timeout, without_deadline
+from src.core.exceptions import DeadlineExceededError, UpstreamBudgetExceededError
+from src.core.middlewares import DeadlineMiddleware
+from src.core.upstream import UpstreamGateway
+from src.services.base import MicroserviceClient
+from src.utils import http_get
+
+
+def stub_app(cancelled: list) -> FastAPI:
+    stub = FastAPI()
+    stub.add_middleware(DeadlineMiddleware, default_timeout=5, route_timeouts={"/slow": 0.1, "/slow/unlimited": 0})
+
+    @stub.get("/slow")
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return {}
+
+    @stub.get("/slow/unlimited")
+    async def unlimited():
+        return {"time_left": context.time_left()}
+
+    @stub.get("/budget")
+    async def budget():
+        return {"time_left": context.time_left()}
+
+    return stub
+
+
+class TestDeadline:
+
+    # Test call timeouts are shortened to the time left before the deadline
+    def test_call_timeout(self):
+        assert call_timeout(5) == 5
+
+        token = context.deadline.set(time.monotonic() + 2)
+        try:
+            assert 1.9 < call_timeout(5) <= 2
+            assert 0.9 < call_timeout(5, reserve=1) <= 1
+            assert call_timeout(0.5) == 0.5
+            with pytest.raises(DeadlineExceededError):
+                call_timeout(5, reserve=3)
+        finally:
+            context.deadline.reset(token)
+
+    # Test background tasks do not inherit the deadline of the request
+    @pytest.mark.anyio
+    async def test_without_deadline(self):
+        async def background():
+            return context.time_left()
+
+        token = context.deadline.set(time.monotonic() + 2)
+        try:
+            assert await asyncio.create_task(without_deadline(background())) is None
+            assert context.time_left() is not None
+        finally:
+            context.deadline.reset(token)
+
+    # Test requests past their deadline are cancelled and answered with 504
+    @pytest.mark.anyio
+    async def test_middleware_cancels_request(self):
+        cancelled = []
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=stub_app(cancelled)), base_url="http://test") as client:
+            started = time.monotonic()
+            response = await client.get("/slow")
+            assert response.status_code == 504
+            assert time.monotonic() - started < 1
+            assert cancelled == [True]
+
+    # Test the deadline follows the route timeouts and the request header
+    @pytest.mark.anyio
+    async def test_middleware_timeouts(self):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=stub_app([])), base_url="http://test") as client:
+            assert 4.5 < (await client.get("/budget")).json()["time_left"] <= 5
+            assert (await client.get("/budget", headers={"X-Request-Timeout": "1"})).json()["time_left"] <= 1
+            # The header cannot extend the route timeout
+            assert (await client.get("/budget", headers={"X-Request-Timeout": "60"})).json()["time_left"] <= 5
+            assert (await client.get("/budget", headers={"X-Request-Timeout": "soon"})).json()["time_left"] > 4.5
+            assert (await client.get("/slow/unlimited")).json()["time_left"] is None
+
+    # Test upstream calls are not made when the deadline leaves no time to serve cached data
+    @pytest.mark.anyio
+    async def test_no_upstream_call_past_deadline(self, monkeypatch):
+        monkeypatch.setattr(config, "REQUEST_DEADLINE_RESERVE_SECONDS", 1)
+        token = context.deadline.set(time.monotonic() + 0.5)
+        try:
+            with pytest.raises(DeadlineExceededError):
+                await http_get("http://test")
+            # Nor queued past it
+            gateway = UpstreamGateway("test", calls_per_minute=1)
+            gateway.tokens = 0
+            started = time.monotonic()
+            with pytest.raises(UpstreamBudgetExceededError):
+                await gateway.call(asyncio.sleep, 0)
+            assert time.monotonic() - started < 1
+        finally:
+            context.deadline.reset(token)
+
+    # Test database queries made for a request are given the time left as maxTimeMS
+    @pytest.mark.anyio
+    async def test_dao_time_limit(self, app):
+        assert app.dao._time_limit() == {}
+
+        token = context.deadline.set(time.monotonic() + 2)
+        try:
+            assert 1900 < app.dao._time_limit()["max_time_ms"] <= 2000
+            assert await app.dao.find_predictions_for_point(1.0, 2.0) == []
+            point = await app.dao.find_or_create_point(1.0, 2.0)
+            assert (await app.dao.find_point(1.0, 2.0)).id == point.id
+        finally:
+            context.deadline.reset(token)
+
+    # Test microservice calls past the deadline are answered with 504 without being made
+    @pytest.mark.anyio
+    async def test_microservice_call_past_deadline(self):
+        calls = []
+        client = MicroserviceClient("http://service", "Test", FastAPI())
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: calls.append(request) or httpx.Response(200, json={})))
+
+        token = context.deadline.set(time.monotonic() - 1)
+        try:
+            with pytest.raises(HTTPException) as exc:
+                await client.get("/items", auth_required=False)
+            assert exc.value.status_code == 504
+            assert not calls
+        finally:
+            context.deadline.reset(token)
+        assert await client.get("/items", auth_required=False) == {}
+
+    # Test database queries cut short by their time limit are answered with 504
+    @pytest.mark.anyio
+    async def test_query_timeout_answered_with_504(self, app, async_client, test_jwt_token):
+        timeout = ExecutionTimeout("operation exceeded time limit")
+        app.weather_app.dao.find_predictions_for_point = AsyncMock(side_effect=timeout)
+        app.weather_app.dao.find_weather_data_for_point = AsyncMock(side_effect=timeout)
+        headers = {"Authorization": f"Bearer {test_jwt_token}"}
+
+        for route in ("/api/data/forecast5", "/api/data/weather"):
+            response = await async_client.get(route, params={"lat": 10.0, "lon": 20.0}, headers=headers)
+            assert response.status_code == 504, route
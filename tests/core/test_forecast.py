@@ -0,0 +1,55 @@
+import pytest
+from tests.fixtures import *
+
+from src.forecast import ForecastSeries, InterpolationMethod
+
+
+HOUR = 3600
+
+
+def make_series():
+    timestamps = [0, 3 * HOUR, 6 * HOUR]
+    columns = {
+        'ambient_temperature': [10.0, 16.0, 13.0],
+        'ambient_humidity': [90.0, 100.0, 70.0],
+        'wind_direction': [350.0, 10.0, 20.0],
+        'precipitation': [None, 3.0, 1.5],
+    }
+    return ForecastSeries(timestamps, columns)
+
+
+class TestForecastSeries:
+
+    # Test linear upsampling of 3-hour slots to hourly resolution
+    @pytest.mark.anyio
+    async def test_linear_interpolation(self):
+        hourly = make_series().interpolate(HOUR)
+        assert hourly.timestamps == [i * HOUR for i in range(7)]
+        assert hourly.columns['ambient_temperature'][:4] == [10.0, 12.0, 14.0, 16.0]
+        # Interpolated through north, not through south
+        assert hourly.columns['wind_direction'][1] == pytest.approx(356.6666, rel=1e-4)
+
+    # Test precipitation is split proportionally and its total is preserved
+    @pytest.mark.anyio
+    async def test_precipitation_split(self):
+        hourly = make_series().interpolate(HOUR)
+        assert hourly.columns['precipitation'] == pytest.approx([0, 1, 1, 1, 0.5, 0.5, 0.5])
+        assert sum(hourly.columns['precipitation']) == pytest.approx(4.5)
+
+    # Test cubic interpolation does not overshoot physical bounds
+    @pytest.mark.anyio
+    async def test_cubic_interpolation_within_bounds(self):
+        hourly = make_series().interpolate(HOUR / 2, InterpolationMethod.CUBIC)
+        assert all(0 <= v <= 100 for v in hourly.columns['ambient_humidity'])
+        assert hourly.columns['ambient_temperature'][6] == 16.0
+
+    # Test inverse distance weighting of the series of nearby locations
+    @pytest.mark.anyio
+    async def test_weighted_average(self):
+        near = ForecastSeries([0, 3 * HOUR], {'ambient_temperature': [10.0, 12.0], 'wind_direction': [350.0, 0.0]})
+        far = ForecastSeries([3 * HOUR, 6 * HOUR], {'ambient_temperature': [18.0, 20.0], 'wind_direction': [30.0, 0.0]})
+        estimated = ForecastSeries.weighted_average([near, far], [3.0, 1.0])
+        assert estimated.interpolated
+        assert estimated.timestamps == [3 * HOUR]
+        assert estimated.columns['ambient_temperature'] == [13.5]
+        assert estimated.columns['wind_direction'][0] == pytest.approx(7.37, abs=0.01)
@@ -0,0 +1,27 @@
+
+from src import geohash
+
+
+class TestGeohash:
+
+    # Test encoding against a known geohash and decoding it back to its tile
+    def test_encode_bounds(self):
+        assert geohash.encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+        min_lat, min_lon, max_lat, max_lon = geohash.bounds("u4pru")
+        assert min_lat <= 57.64911 <= max_lat and min_lon <= 10.40744 <= max_lon
+        assert (max_lat - min_lat, max_lon - min_lon) == geohash.tile_size(5)
+
+    # Test the centroid of a tile lies in the tile, so that tiling a centroid is stable
+    def test_centroid(self):
+        for tile in ("u4pru", "sw8zb", "6gkzw", "00000", "zzzzz"):
+            assert geohash.encode(*geohash.centroid(tile), len(tile)) == tile
+
+    # Test the tiles covering a bounding box cover each of its points once
+    def test_covering(self):
+        box = (37.9, 23.6, 38.1, 23.9)
+        tiles = geohash.covering(*box, 5)
+        assert len(tiles) == len(set(tiles)) == geohash.count_covering(*box, 5)
+        for lat in (37.9, 37.95, 38.0, 38.1):
+            for lon in (23.6, 23.75, 23.9):
+                assert geohash.encode(lat, lon, 5) in tiles
+        assert geohash.covering(38.0, 23.7, 38.0, 23.7, 5) == [geohash.encode(38.0, 23.7, 5)]
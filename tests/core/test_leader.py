@@ -0,0 +1,122 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+import mongomock
+import pytest
+from tests.fixtures import *
+
+from src import scheduler
+from src.core.leader import LeaderElection
+
+
+class TestLeaderElection:
+
+    # Test a single process holds the lease and another one takes over once it is released
+    @pytest.mark.anyio
+    async def test_single_leader(self, app):
+        elections = [
+            LeaderElection(app.dao, "scheduler", 30, 10, on_elected=AsyncMock(), on_demoted=AsyncMock())
+            for _ in range(2)
+        ]
+        for election in elections:
+            await election.step()
+        assert [election.is_leader for election in elections] == [True, False]
+
+        # Renewals keep the leader
+        await asyncio.sleep(0)
+        await elections[0].step()
+        await elections[1].step()
+        assert [election.is_leader for election in elections] == [True, False]
+        elections[0].on_elected.assert_awaited_once()
+
+        await elections[0].stop()
+        elections[0].on_demoted.assert_awaited_once()
+        await elections[1].step()
+        assert elections[1].is_leader
+
+    # Test an expired lease is taken over and the previous leader steps down
+    @pytest.mark.anyio
+    async def test_expired_lease_take_over(self, app):
+        leader = LeaderElection(app.dao, "scheduler", 0, 10, on_elected=AsyncMock(), on_demoted=AsyncMock())
+        follower = LeaderElection(app.dao, "scheduler", 30, 10, on_elected=AsyncMock(), on_demoted=AsyncMock())
+        await leader.step()
+        await follower.step()
+        assert follower.is_leader
+        await leader.step()
+        assert not leader.is_leader
+        leader.on_demoted.assert_awaited_once()
+
+    # Test a demoted leader can be elected again with a usable database and a running scheduler
+    @pytest.mark.anyio
+    async def test_demote_and_reelect_scheduler(self, app, monkeypatch):
+        monkeypatch.setattr(config, "SCHEDULER_JOBSTORE", "mongodb")
+        monkeypatch.setattr(config, "PUSH_THI_TO_FARMCALENDAR", "true")
+        monkeypatch.setattr(config, "CACHE_WARMER_ENABLED", False)
+        monkeypatch.setattr(scheduler, "scheduler", AsyncIOScheduler())
+        database = mongomock.MongoClient()
+        database.close = MagicMock()
+        monkeypatch.setattr(scheduler, "MongoClient", lambda uri: database)
+        app.dao.db.close = MagicMock()
+        app.state.locations = [(1.0, 1.0)]
+        app.state.uavmodels = []
+
+        async def elected():
+            scheduler.start_scheduler(app)
+
+        # The lease of the leader expires at once, so that the rival takes it over
+        leader = LeaderElection(app.dao, "scheduler", 0, 10, on_elected=elected, on_demoted=scheduler.stop_scheduler)
+        rival = LeaderElection(app.dao, "scheduler", 30, 10, on_elected=AsyncMock(), on_demoted=AsyncMock())
+        try:
+            await leader.step()
+            await asyncio.sleep(0)
+            assert scheduler.scheduler.running
+            await rival.step()
+            await leader.step()
+            assert not leader.is_leader
+            assert not scheduler.scheduler.running
+            # Only the job store's own client is closed
+            database.close.assert_called_once()
+            app.dao.db.close.assert_not_called()
+
+            await rival.stop()
+            await leader.step()
+            await asyncio.sleep(0)
+            assert leader.is_leader
+            assert scheduler.scheduler.running
+            assert scheduler.scheduler.get_job("location_task_1.0_1.0")
+            point = await app.dao.find_or_create_point(1.0, 1.0)
+            assert (await app.dao.find_point(1.0, 1.0)).id == point.id
+        finally:
+            await scheduler.stop_scheduler()
+
+    # Test the lease keeps being renewed while the leader is starting, and a failed start is retried
+    @pytest.mark.anyio
+    async def test_renew_while_starting(self, app):
+        release = asyncio.Event()
+        attempts = 0
+
+        async def elected():
+            nonlocal attempts
+            attempts += 1
+            await release.wait()
+            if attempts == 1:
+                raise RuntimeError("Farm Calendar unavailable")
+
+        leader = LeaderElection(app.dao, "scheduler", 30, 10, on_elected=elected, on_demoted=AsyncMock())
+        rival = LeaderElection(app.dao, "scheduler", 30, 10, on_elected=AsyncMock(), on_demoted=AsyncMock())
+        await leader.step()
+        await asyncio.sleep(0)
+        # Renewals go on during the startup
+        await asyncio.wait_for(leader.step(), 1)
+        await rival.step()
+        assert leader.is_leader and not rival.is_leader
+
+        release.set()
+        await asyncio.sleep(0)
+        assert not leader.is_leader
+        await leader.step()
+        await asyncio.sleep(0)
+        assert leader.is_leader and attempts == 2
+        await leader.stop()
+        leader.on_demoted.assert_awaited_once()
@@ -3,6 +3,7 @@ import pytest
 from tests.fixtures import *
 from pydantic import ValidationError
 
+from src.models.outbox import OutboxEntry
 from src.models.point import Point
 from src.models.prediction import Prediction
 from src.models.weather_data import WeatherData
@@ -92,3 +93,11 @@ class TestModels:
         with pytest.raises(ValidationError):
             WeatherData(**valid_weeatherdata)
 
+
+    # Test the outbox indexes are created on startup, not only by the database init script
+    @pytest.mark.anyio
+    async def test_outbox_indexes(self, app):
+        indexes = await OutboxEntry.get_motor_collection().index_information()
+        keys = {tuple(index["key"]): index for index in indexes.values()}
+        assert (("status", 1), ("next_attempt_at", 1)) in keys
+        assert keys[(("sent_at", 1),)]["expireAfterSeconds"] == 604800
@@ -0,0 +1,126 @@
+import pytest
+from tests.fixtures import *
+
+from src.core import rate_limit
+from src.core.rate_limit import RateLimits, SlidingWindowRateLimiter, parse_limit
+
+
+class Clock:
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class TestRateLimit:
+
+    # Test hits over the limit of the window are rejected with the time after which to retry
+    def test_limit(self, monkeypatch):
+        clock = Clock(6000.0)
+        monkeypatch.setattr(rate_limit, "time", clock)
+        limiter = SlidingWindowRateLimiter("test", limit=3, window=60)
+
+        assert [limiter.hit("a") for _ in range(3)] == [None, None, None]
+        assert limiter.hit("a") == pytest.approx(60)
+        # Other clients have their own limit
+        assert limiter.hit("b") is None
+        assert limiter.limited == 1
+
+    # Test the hits of the previous window are weighted by the part still covered by the sliding window
+    def test_sliding_window(self, monkeypatch):
+        clock = Clock(6000.0)
+        monkeypatch.setattr(rate_limit, "time", clock)
+        limiter = SlidingWindowRateLimiter("test", limit=4, window=60)
+        for _ in range(4):
+            assert limiter.hit("a") is None
+
+        # A tenth into the next window, 3.6 of the 4 previous hits still count
+        clock.now += 66
+        assert limiter.hit("a") is None
+        # Until a quarter into it
+        assert limiter.hit("a") == pytest.approx(9)
+        clock.now += 9.5
+        assert limiter.hit("a") is None
+        # Two windows later, none
+        clock.now += 120
+        assert [limiter.hit("a") for _ in range(4)] == [None] * 4
+
+    # Test clients without hits in the sliding window are forgotten
+    def test_prune(self, monkeypatch):
+        clock = Clock(6000.0)
+        monkeypatch.setattr(rate_limit, "time", clock)
+        limiter = SlidingWindowRateLimiter("test", limit=4, window=60)
+        limiter.hit("a")
+        clock.now += 120
+        limiter.hit("b")
+        assert list(limiter.counters) == ["b"]
+
+    # Test the route groups are resolved by their longest prefix
+    def test_route_groups(self):
+        limits = RateLimits(
+            parse_limit("100/60"),
+            {"/api/data/flight_forecast5": parse_limit("10/60"), "/api/data/flight_forecast5/free": parse_limit("0")}
+        )
+        assert limits.for_route("/api/data/flight_forecast5/{uavmodel}").limit == 10
+        assert limits.for_route("/api/data/flight_forecast5/free") is None
+        assert limits.for_route("/api/data/weather") is limits.default
+        assert RateLimits(None, {}).for_route("/api/data/weather") is None
+
+    # Test shared limits count the hits of all the processes
+    @pytest.mark.anyio
+    async def test_shared(self, app):
+        first = SlidingWindowRateLimiter("test", limit=4, window=60, shared=True, sync_seconds=3600)
+        second = SlidingWindowRateLimiter("test", limit=4, window=60, shared=True, sync_seconds=3600)
+        first.dao = second.dao = app.dao
+
+        assert first.hit("a") is None and first.hit("a") is None
+        assert second.hit("a") is None
+        await first.sync()
+        await second.sync()
+        assert second.hit("a") is None
+        assert second.hit("a") is not None
+
+        assert first.hit("a") is None
+        await first.sync()
+        assert first.counters["a"].others_current == 1
+        assert first.hit("a") is not None
+
+    # Test clients over the limit of a route get 429 with the rate limit headers
+    @pytest.mark.anyio
+    async def test_too_many_requests(self, app, async_client, test_jwt_token):
+        app.rate_limits = RateLimits(None, {"/api/scheduler/metrics": (2, 60)})
+        headers = {"Authorization": f"Bearer {test_jwt_token}"}
+
+        for _ in range(2):
+            assert (await async_client.get("/api/scheduler/metrics", headers=headers)).status_code == 200
+        response = await async_client.get("/api/scheduler/metrics", headers=headers)
+        assert response.status_code == 429
+        assert 1 <= int(response.headers["Retry-After"]) <= 60
+        assert response.headers["RateLimit-Limit"] == "2"
+        assert response.headers["RateLimit-Remaining"] == "0"
+        assert response.headers["RateLimit-Policy"] == "2;w=60"
+        # Other routes are not limited
+        assert (await async_client.get("/api/admission/metrics", headers=headers)).status_code == 200
+
+    # Test clients are identified by the first claim present, and tokens without any of them are rejected
+    @pytest.mark.anyio
+    async def test_client_claims(self, app, async_client):
+        app.rate_limits = RateLimits(None, {"/api/scheduler/metrics": (1, 60)})
+
+        def headers(**claims):
+            payload = {"exp": datetime.utcnow() + timedelta(hours=1), **claims}
+            return {"Authorization": f"Bearer {jwt.encode(payload, config.KEY, algorithm=config.ALGORITHM)}"}
+
+        response = await async_client.get("/api/scheduler/metrics", headers=headers())
+        assert response.status_code == 403
+        # Tokens without a subject do not share a bucket
+        for user_id in (1, 2):
+            assert (await async_client.get("/api/scheduler/metrics", headers=headers(user_id=user_id))).status_code == 200
+        assert (await async_client.get("/api/scheduler/metrics", headers=headers(user_id=1))).status_code == 429
+        # Routes without a limit do not need to identify the client
+        assert (await async_client.get("/api/admission/metrics", headers=headers())).status_code == 200
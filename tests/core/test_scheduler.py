@@ -0,0 +1,121 @@
+import asyncio
+from datetime import datetime, timedelta
+import time
+from unittest.mock import MagicMock
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+import mongomock
+import pytest
+from tests.fixtures import *
+
+from src import scheduler
+from src.scheduler_engine import HeapScheduler
+
+
+class TestScheduler:
+
+    # Test runs are spread deterministically over the whole interval, on slots that do not depend on the start time
+    @pytest.mark.anyio
+    async def test_slot_run_time_spread(self):
+        now = datetime(2025, 6, 1, 8)
+        interval = timedelta(hours=8)
+        runs = [scheduler.slot_run_time(f"location_task_{i}_{i}", interval, now) for i in range(200)]
+        assert all(now <= run < now + interval for run in runs)
+        assert len(set(runs)) > 190
+        # Every hour of the interval gets a share of the jobs
+        assert {int((run - now) / timedelta(hours=1)) for run in runs} == set(range(8))
+        later = now + timedelta(hours=3, minutes=17)
+        assert scheduler.slot_run_time("location_task_1_1", interval, later) in (runs[1], runs[1] + interval)
+
+    # Test no more than the configured number of jobs run at the same time
+    @pytest.mark.anyio
+    async def test_run_limited_concurrency(self):
+        running = peak = 0
+
+        async def job():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        completed = scheduler.metrics.completed
+        await asyncio.gather(*(scheduler.run_limited(job) for _ in range(3 * config.SCHEDULER_MAX_CONCURRENT_JOBS)))
+        assert peak == config.SCHEDULER_MAX_CONCURRENT_JOBS
+        assert scheduler.metrics.completed == completed + 3 * config.SCHEDULER_MAX_CONCURRENT_JOBS
+        assert scheduler.metrics.snapshot()["queued"] == 0
+
+    # Test refreshes only add, update or remove the jobs of changed parcels
+    @pytest.mark.anyio
+    async def test_schedule_tasks_reconciles_jobs(self, monkeypatch):
+        monkeypatch.setattr(config, "PUSH_THI_TO_FARMCALENDAR", "true")
+        app = MagicMock()
+        app.state.locations = [(1.0, 1.0), (2.0, 2.0)]
+        app.state.uavmodels = ["DJI"]
+        scheduler.scheduler.remove_all_jobs()
+        try:
+            assert scheduler.schedule_tasks(app) == {"added": 2, "updated": 0, "removed": 0}
+            first_run = scheduler.scheduler.get_job("location_task_1.0_1.0").next_run_time
+
+            app.state.locations = [(1.0, 1.0), (3.0, 3.0)]
+            app.state.uavmodels = ["DJI", "Parrot"]
+            assert scheduler.schedule_tasks(app) == {"added": 1, "updated": 1, "removed": 1}
+            job = scheduler.scheduler.get_job("location_task_1.0_1.0")
+            assert job.next_run_time == first_run
+            assert job.args[3] == ["DJI", "Parrot"]
+            assert scheduler.schedule_tasks(app) == {"added": 0, "updated": 0, "removed": 0}
+        finally:
+            scheduler.scheduler.remove_all_jobs()
+
+    # Test location jobs keep their next run time across restarts with the MongoDB job store
+    @pytest.mark.anyio
+    async def test_location_jobs_survive_restart(self, monkeypatch):
+        monkeypatch.setattr(config, "PUSH_THI_TO_FARMCALENDAR", "true")
+        monkeypatch.setattr(config, "SCHEDULER_JOBSTORE", "mongodb")
+        app = MagicMock()
+        # The database outlives the clients of the job stores
+        database = mongomock.MongoClient()
+        monkeypatch.setattr(scheduler, "MongoClient", lambda uri: database)
+        app.state.locations = [(1.0, 1.0)]
+        app.state.uavmodels = []
+
+        next_run_times = []
+        for expected in ({"added": 1, "updated": 0, "removed": 0}, {"added": 0, "updated": 0, "removed": 0}):
+            # A new scheduler for each run of the service
+            monkeypatch.setattr(scheduler, "scheduler", AsyncIOScheduler())
+            scheduler.configure_scheduler(app)
+            scheduler.scheduler.start(paused=True)
+            assert scheduler.schedule_tasks(app) == expected
+            next_run_times.append(scheduler.scheduler.get_job("location_task_1.0_1.0").next_run_time)
+            scheduler.scheduler.shutdown(wait=False)
+
+        assert next_run_times[0] == next_run_times[1]
+        # The job store never closes the app's client
+        app.dao.db.delegate.close.assert_not_called()
+
+    # Test the heap engine runs due jobs on their interval with bounded workers
+    @pytest.mark.anyio
+    async def test_heap_engine(self):
+        engine = HeapScheduler(workers=2)
+        runs = []
+
+        async def job(name):
+            runs.append(name)
+
+        now = time.time()
+        engine.add_job("a", job, ["a"], 0.05, now)
+        engine.add_job("b", job, ["b"], 3600, now + 0.02)
+        engine.add_job("c", job, ["c"], 3600, now)
+        engine.remove_job("c")
+        engine.start()
+        try:
+            await asyncio.sleep(0.12)
+        finally:
+            engine.shutdown()
+        assert runs.count("a") >= 2
+        assert runs.count("b") == 1
+        assert "c" not in runs
+        # Missed runs are coalesced into one
+        engine.add_job("d", job, ["d"], 10, now - 35)
+        assert [j.id for j in engine._pop_due(now) if j.id == "d"] == ["d"]
+        assert engine.get_job("d").next_run_time == now + 5
@@ -0,0 +1,92 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock
+
+import httpx
+import jwt
+import pytest
+from fastapi import FastAPI, Request, Response
+from tests.fixtures import *
+
+from src.core.tokens import TokenManager, token_expiry
+from src.services.base import MicroserviceClient
+
+
+def make_token(expires_in: float) -> str:
+    return jwt.encode({"exp": int(time.time() + expires_in), "sub": "weather"}, key="key", algorithm="HS256")
+
+
+# Login stub returning a new token, valid for an hour, on every call
+def login_stub(delay: float = 0.01) -> AsyncMock:
+    async def login():
+        await asyncio.sleep(delay)
+        return make_token(3600 + login.await_count), "refresh"
+    login = AsyncMock(side_effect=login)
+    return login
+
+
+class TestTokenManager:
+
+    # Test the expiry of a token is decoded without verifying its signature
+    def test_token_expiry(self):
+        token = make_token(100)
+        assert token_expiry(token) == pytest.approx(time.time() + 100, abs=2)
+        assert token_expiry("not-a-jwt") is None
+
+    # Test concurrent callers without a token share a single login
+    @pytest.mark.anyio
+    async def test_concurrent_refreshes_are_coalesced(self):
+        login = login_stub()
+        manager = TokenManager(login)
+
+        tokens = await asyncio.gather(*(manager.get_token() for _ in range(20)))
+        assert login.await_count == 1
+        assert len(set(tokens)) == 1
+
+        stale = manager.access_token
+        await asyncio.gather(*(manager.refresh(stale=stale) for _ in range(20)))
+        assert login.await_count == 2
+
+    # Test a token about to expire is refreshed before it is used
+    @pytest.mark.anyio
+    async def test_refreshes_ahead_of_expiry(self):
+        login = login_stub()
+        manager = TokenManager(login, refresh_margin=60)
+        manager.set_tokens(make_token(3600))
+        assert await manager.get_token() == manager.access_token
+        assert login.await_count == 0
+
+        expiring = make_token(30)
+        manager.set_tokens(expiring)
+        assert await manager.get_token() != expiring
+        assert login.await_count == 1
+
+    # Test a failed early refresh keeps the token still valid
+    @pytest.mark.anyio
+    async def test_keeps_valid_token_if_refresh_fails(self):
+        manager = TokenManager(AsyncMock(side_effect=httpx.ConnectError("down")), refresh_margin=60)
+        expiring = make_token(30)
+        manager.set_tokens(expiring)
+        assert await manager.get_token() == expiring
+
+    # Test a burst of 401 responses triggers a single login and the requests are retried
+    @pytest.mark.anyio
+    async def test_unauthorized_requests_refresh_once(self):
+        login = login_stub()
+        app = FastAPI()
+        app.token_manager = TokenManager(login)
+        app.token_manager.set_tokens("expired")
+
+        stub = FastAPI()
+
+        @stub.get("/resource")
+        async def resource(request: Request, response: Response):
+            if request.headers["Authorization"] == "Bearer expired":
+                response.status_code = 401
+            return {}
+
+        client = MicroserviceClient("http://service", "Service", app)
+        client.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=stub))
+
+        await asyncio.gather(*(client.get("/resource") for _ in range(10)))
+        assert login.await_count == 1
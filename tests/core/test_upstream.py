@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from tests.fixtures import *
+
+from src.core.exceptions import UpstreamBudgetExceededError
+from src.core.upstream import Priority, UpstreamGateway, with_priority
+
+
+async def noop():
+    return "ok"
+
+
+class TestUpstreamGateway:
+
+    # Test waiting calls are admitted by priority, then in arrival order
+    @pytest.mark.anyio
+    async def test_priority_order(self):
+        gateway = UpstreamGateway("test", calls_per_minute=6000)
+        gateway.tokens = 0
+        served = []
+
+        async def call(priority, name):
+            await with_priority(priority, gateway.call(noop))
+            served.append(name)
+
+        await asyncio.gather(
+            call(Priority.WARMING, "warming"),
+            call(Priority.SCHEDULED, "scheduled-1"),
+            call(Priority.SCHEDULED, "scheduled-2"),
+            call(Priority.INTERACTIVE, "interactive"),
+        )
+        assert served == ["interactive", "scheduled-1", "scheduled-2", "warming"]
+
+    # Test the end of the daily quota is reserved for interactive calls
+    @pytest.mark.anyio
+    async def test_daily_quota_reserve(self):
+        gateway = UpstreamGateway("test", calls_per_minute=60, calls_per_day=10, reserve=0.2)
+        gateway.used = 8
+        with pytest.raises(UpstreamBudgetExceededError):
+            await with_priority(Priority.WARMING, gateway.call(noop))
+        assert await gateway.call(noop) == "ok"
+        assert await gateway.call(noop) == "ok"
+        with pytest.raises(UpstreamBudgetExceededError):
+            await gateway.call(noop)
+        assert gateway.snapshot()["rejected"] == {"interactive": 1, "scheduled": 0, "warming": 1}
+
+    # Test calls give up when the rate limit queue is too long
+    @pytest.mark.anyio
+    async def test_queue_timeout(self):
+        gateway = UpstreamGateway("test", calls_per_minute=1, queue_timeout=0.01)
+        assert await gateway.call(noop) == "ok"
+        with pytest.raises(UpstreamBudgetExceededError):
+            await gateway.call(noop)
+
+    # Test the daily count is shared through the database
+    @pytest.mark.anyio
+    async def test_usage_persisted(self, app):
+        gateway = UpstreamGateway("test", calls_per_minute=60, calls_per_day=100)
+        gateway.dao = app.dao
+        for _ in range(3):
+            await gateway.call(noop)
+        await gateway.sync()
+
+        restarted = UpstreamGateway("test", calls_per_minute=60, calls_per_day=100)
+        restarted.dao = app.dao
+        await restarted.sync()
+        assert restarted.used == 3
@@ -1,7 +1,18 @@
 import pytest
 from tests.fixtures import *
 
-from src.utils import calculate_thi
+import calendar
+from datetime import datetime
+from uuid import uuid4
+
+from src.core.exceptions import SprayProfileNotFoundError
+from src.indicators import accumulate, backfill_accumulated_indicators, season_start, update_accumulated_indicators
+from src.models.indicators import AccumulatedIndicators
+from src.models.prediction import Prediction
+from src.models.spray import SprayProfile, SprayStatus
+from src.models.weather_data import WeatherData
+from src.spray_profiles import CompiledSprayProfile, SprayProfileRegistry
+from src.utils import calculate_et0, calculate_thi, evaluate_spray_conditions
 
 
 class TestUtils:
@@ -14,3 +25,163 @@ class TestUtils:
         # Test edge cases
         assert calculate_thi(14.5, 100) == 58.1
         assert calculate_thi(-10.0, 50.0) == 26.2
+
+    # Test spray conditions with the default profile thresholds
+    @pytest.mark.anyio
+    async def test_spray_conditions_default_profile(self):
+        condition, status = evaluate_spray_conditions(15, 10, 0, 70, 5)
+        assert condition == SprayStatus.OPTIMAL
+        # Boundaries are inclusive as in the band definitions
+        condition, status = evaluate_spray_conditions(18, 25, 0.1, 95, 10)
+        assert condition == SprayStatus.MARGINAL
+        assert set(status.values()) == {SprayStatus.MARGINAL}
+        condition, status = evaluate_spray_conditions(25.1, 10, 0, 70, 5)
+        assert condition == SprayStatus.UNSUITABLE
+        assert status["temperature_status"] == SprayStatus.UNSUITABLE
+
+    # Test a custom profile overrides only the parameters it defines
+    @pytest.mark.anyio
+    async def test_spray_conditions_custom_profile(self):
+        profile = CompiledSprayProfile("vineyard", {
+            "temperature": [{"status": "optimal", "gte": 10, "lte": 28}],
+        })
+        results = profile.evaluate_many([5, 27], [10, 10], [0, 0], [70, 70], [5, 5])
+        assert [condition for condition, _ in results] == [SprayStatus.UNSUITABLE, SprayStatus.OPTIMAL]
+        assert results[1][1]["wind_status"] == SprayStatus.OPTIMAL
+
+    # Test incremental accumulation of growing degree days, chill and heat stress hours
+    @pytest.mark.anyio
+    async def test_accumulate_indicators(self):
+        acc = AccumulatedIndicators(
+            point_id=uuid4(), location={"type": "Point", "coordinates": [39.1, 26.4]}, season_start=datetime(2025, 1, 1)
+        )
+        assert accumulate(acc, datetime(2025, 6, 1, 12), 20.0, 70.0)
+        assert acc.hours == 0
+        assert accumulate(acc, datetime(2025, 6, 1, 15), 24.0, 76.0)
+        assert acc.growing_degree_days == pytest.approx(12 * 3 / 24)
+        assert acc.heat_stress_hours == 3
+        # Older samples are ignored and gaps are capped
+        assert not accumulate(acc, datetime(2025, 6, 1, 13), 5.0, 40.0)
+        assert accumulate(acc, datetime(2025, 6, 3), 4.0, 40.0)
+        assert acc.hours == 3 + 6
+        assert acc.chill_hours == 0
+        assert season_start(datetime(2025, 6, 1)) == datetime(2025, 1, 1)
+
+    # Test concurrent stores for the same point neither lose increments nor create duplicate accumulators
+    @pytest.mark.anyio
+    async def test_update_accumulated_indicators_concurrently(self, app, monkeypatch):
+        point = await app.dao.find_or_create_point(39.1, 26.4)
+        find_one = AccumulatedIndicators.find_one
+        raced = []
+
+        # Another store integrates a sample between the first read of the accumulator and its update
+        def racing_find_one(*args, **kwargs):
+            query = find_one(*args, **kwargs)
+            if len(args) != 2 or raced:
+                return query
+
+            async def stale_read():
+                acc = await query
+                raced.append(True)
+                await update_accumulated_indicators(point, [(datetime(2025, 6, 1, 15), 24.0, None)])
+                return acc
+            return stale_read()
+
+        await update_accumulated_indicators(point, [(datetime(2025, 6, 1, 12), 20.0, None)])
+        monkeypatch.setattr(AccumulatedIndicators, "find_one", racing_find_one)
+        await update_accumulated_indicators(point, [(datetime(2025, 6, 1, 15), 24.0, None), (datetime(2025, 6, 1, 18), 24.0, None)])
+
+        assert raced
+        accumulators = await AccumulatedIndicators.find_all().to_list()
+        assert len(accumulators) == 1
+        assert accumulators[0].hours == 6
+        assert accumulators[0].growing_degree_days == pytest.approx((12 * 3 + 14 * 3) / 24)
+        assert accumulators[0].last_timestamp == datetime(2025, 6, 1, 18)
+
+        # Same when both stores create the accumulator of a new season
+        raced.clear()
+        await update_accumulated_indicators(point, [(datetime(2026, 6, 1, 15), 24.0, None), (datetime(2026, 6, 1, 18), 24.0, None)])
+        assert raced
+        accumulators = await AccumulatedIndicators.find(AccumulatedIndicators.season_start == datetime(2026, 1, 1)).to_list()
+        assert len(accumulators) == 1
+        assert accumulators[0].hours == 3
+
+    # Test the backfill rebuilds accumulators in place from stored weather data and past forecast periods
+    @pytest.mark.anyio
+    async def test_backfill_accumulated_indicators(self, app):
+        point = await app.dao.find_or_create_point(39.1, 26.4)
+        await WeatherData(
+            spatial_entity=point, data={"main": {"temp": 20.0}, "dt": calendar.timegm(datetime(2025, 6, 1, 12).timetuple())},
+            thi=60.0, created_at=datetime(2025, 6, 1, 12, 5)
+        ).create()
+        # The 15:00 period was past when the forecast was stored, the 21:00 one was not
+        for timestamp, temperature in ((datetime(2025, 6, 1, 15), 24.0), (datetime(2025, 6, 1, 21), 30.0)):
+            for measurement, value in (("ambient_temperature", temperature), ("ambient_humidity", 50.0)):
+                await Prediction(
+                    value=value, measurement_type=measurement, timestamp=timestamp, source="openweathermaps",
+                    data_type="weather", spatial_entity=point, created_at=datetime(2025, 6, 1, 16)
+                ).create()
+        # A diverged accumulator of the point and one stored before accumulators were keyed by point
+        await update_accumulated_indicators(point, [(datetime(2025, 6, 1, 9), 10.0, None)])
+        await AccumulatedIndicators.get_motor_collection().insert_one({"season_start": datetime(2025, 1, 1)})
+
+        await backfill_accumulated_indicators()
+
+        accumulators = await AccumulatedIndicators.get_motor_collection().find().to_list(None)
+        assert len(accumulators) == 1
+        acc = await AccumulatedIndicators.find_one(AccumulatedIndicators.point_id == point.id)
+        assert acc.hours == 3
+        assert acc.last_timestamp == datetime(2025, 6, 1, 15)
+        assert acc.growing_degree_days == pytest.approx(max(22.0 - config.GDD_BASE_TEMPERATURE, 0) * 3 / 24)
+        assert acc.last_thi == calculate_thi(24.0, 50.0)
+
+    # Test malformed stored spray profiles are skipped instead of failing the load
+    @pytest.mark.anyio
+    async def test_load_spray_profiles_skips_invalid(self, app):
+        await SprayProfile(name="orchard", parameters={"wind": [{"status": "optimal", "lt": 12}]}).create()
+        await SprayProfile.get_motor_collection().insert_many([
+            {"name": "bad_status", "parameters": {"wind": [{"status": "perfect", "lt": 12}]}},
+            {"name": "bad_bound", "parameters": {"wind": [{"status": "optimal", "lt": "12"}]}},
+            {"name": "no_parameters"},
+        ])
+        registry = SprayProfileRegistry()
+
+        await registry.load_from_db()
+
+        assert (await registry.get("orchard")).name == "orchard"
+        for name in ("bad_status", "bad_bound", "no_parameters"):
+            with pytest.raises(SprayProfileNotFoundError):
+                await registry.get(name)
+
+    # Test stored spray profiles are read again once expired, keeping the last valid version on an invalid update
+    @pytest.mark.anyio
+    async def test_reload_updated_spray_profile(self, app, monkeypatch):
+        profile = await SprayProfile(name="orchard", parameters={"wind": [{"status": "optimal", "lt": 12}]}).create()
+        registry = SprayProfileRegistry()
+        await registry.load_from_db()
+        assert (await registry.get("orchard")).evaluate(15, 14, 0, 70, 5)[1]["wind_status"] == SprayStatus.UNSUITABLE
+
+        profile.parameters = {"wind": [{"status": "optimal", "lt": 20}]}
+        await profile.save()
+        assert (await registry.get("orchard")).evaluate(15, 14, 0, 70, 5)[1]["wind_status"] == SprayStatus.UNSUITABLE
+        monkeypatch.setattr(config, "SPRAY_PROFILES_CACHE_SECONDS", 0)
+        assert (await registry.get("orchard")).evaluate(15, 14, 0, 70, 5)[1]["wind_status"] == SprayStatus.OPTIMAL
+
+        await SprayProfile.get_motor_collection().update_one(
+            {"name": "orchard"}, {"$set": {"parameters.wind": [{"status": "perfect"}]}}
+        )
+        assert (await registry.get("orchard")).evaluate(15, 14, 0, 70, 5)[1]["wind_status"] == SprayStatus.OPTIMAL
+
+        await profile.delete()
+        with pytest.raises(SprayProfileNotFoundError):
+            await registry.get("orchard")
+
+    # Test FAO-56 reference evapotranspiration evaluated for several days at once
+    @pytest.mark.anyio
+    async def test_et0(self):
+        # FAO-56 example 18 (Brussels, 6 July), reference value 3.9 mm/day
+        summer, winter = calculate_et0(
+            [187, 15], [50.8, 50.8], [12.3, -2.0], [21.5, 3.0], [72.0, 90.0], [3.3, 2.0], [1001.0, 1013.0], [40.0, 90.0]
+        )
+        assert summer == pytest.approx(3.9, abs=0.2)
+        assert 0 <= winter < summer
@@ -0,0 +1,219 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+from uuid import uuid4
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from tests.fixtures import *
+
+from src.core.tokens import TokenManager
+from src.models.outbox import OutboxEntry, OutboxStatus
+from src.services.farmcalendar_service import FarmCalendarServiceClient
+
+
+# Local Farm Calendar stub recording the observations received.
+# The first `failures` observation requests fail.
+def farmcalendar_stub(bulk: bool, failures: int = 0) -> FastAPI:
+    stub = FastAPI()
+    stub.state.requests = []
+    stub.state.idempotency_keys = []
+    stub.state.patches = []
+    stub.state.in_flight = stub.state.max_in_flight = 0
+    stub.state.failures = failures
+
+    @stub.post("/api/v1/Observations/")
+    async def post_observation(request: Request):
+        if stub.state.failures:
+            stub.state.failures -= 1
+            raise HTTPException(status_code=503)
+        stub.state.in_flight += 1
+        stub.state.max_in_flight = max(stub.state.max_in_flight, stub.state.in_flight)
+        await asyncio.sleep(0.01)
+        stub.state.requests.append(await request.json())
+        stub.state.idempotency_keys.append(request.headers.get("Idempotency-Key"))
+        stub.state.in_flight -= 1
+        return {"@id": f"urn:farmcalendar:Observation:{uuid4()}"}
+
+    @stub.patch("/api/v1/Observations/{observation_id}/")
+    async def patch_observation(observation_id: str, request: Request):
+        stub.state.patches.append((observation_id, await request.json()))
+        return {}
+
+    if bulk:
+        @stub.post("/api/v1/Observations/bulk/")
+        async def post_observations(request: Request):
+            chunk = await request.json()
+            stub.state.requests.append(chunk)
+            stub.state.idempotency_keys.append(request.headers.get("Idempotency-Key"))
+            return [{"@id": f"urn:farmcalendar:Observation:{uuid4()}"} for _ in chunk]
+
+    return stub
+
+
+def farmcalendar_client(stub: FastAPI, app: FastAPI = None) -> FarmCalendarServiceClient:
+    app = app or FastAPI()
+    app.token_manager = TokenManager(AsyncMock(return_value=("token", "refresh")))
+    app.token_manager.set_tokens("token")
+    client = FarmCalendarServiceClient(app)
+    client.base_url = "http://farmcalendar"
+    client.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=stub))
+    return client
+
+
+class TestFarmCalendarServiceClient:
+
+    # Test observations are posted in chunks to the bulk endpoint when supported
+    @pytest.mark.anyio
+    async def test_post_observations_bulk(self, monkeypatch):
+        monkeypatch.setattr(config, "FARM_CALENDAR_BULK_SIZE", 50)
+        stub = farmcalendar_stub(bulk=True)
+        client = farmcalendar_client(stub)
+
+        results = await client.post_observations([{"title": str(i)} for i in range(120)])
+        assert len(results) == 120
+        assert not any(isinstance(result, Exception) for result in results)
+        assert client.bulk_supported
+        assert [len(chunk) for chunk in stub.state.requests] == [50, 50, 20]
+
+    # Test observations are posted concurrently, within the limit, when bulk is not supported
+    @pytest.mark.anyio
+    async def test_post_observations_concurrently(self, monkeypatch):
+        monkeypatch.setattr(config, "FARM_CALENDAR_MAX_CONCURRENT_REQUESTS", 4)
+        stub = farmcalendar_stub(bulk=False)
+        client = farmcalendar_client(stub)
+
+        await client.post_observations([{"title": str(i)} for i in range(20)])
+        assert client.bulk_supported is False
+        assert sorted(int(o["title"]) for o in stub.state.requests) == list(range(20))
+        assert stub.state.max_in_flight == 4
+
+    # Test the outbox posts each observation once and retries only the failed ones
+    @pytest.mark.anyio
+    async def test_drain_outbox_retries_failures(self, app, monkeypatch):
+        monkeypatch.setattr(config, "FARM_CALENDAR_BULK_ENDPOINT", "")
+        monkeypatch.setattr(config, "FARM_CALENDAR_OUTBOX_RETRY_BASE_SECONDS", 0)
+        stub = farmcalendar_stub(bulk=False, failures=2)
+        client = farmcalendar_client(stub, app)
+
+        observations = [client._outbox_entry(f"spray:1:1:{i}", {"title": str(i)}, True) for i in range(5)]
+        await client.enqueue_observations(observations)
+        # Enqueuing the same observations again is a no-op
+        await client.enqueue_observations(observations)
+        await client.drain_outbox()
+
+        entries = await OutboxEntry.find_all().to_list()
+        assert len(entries) == 5
+        assert all(entry.status == OutboxStatus.SENT for entry in entries)
+        assert sorted(entry.attempts for entry in entries) == [1, 1, 1, 2, 2]
+        assert len(stub.state.requests) == 5
+
+    # Test only changed observations are posted again, updating the posted ones when enabled
+    @pytest.mark.anyio
+    async def test_drain_outbox_pushes_only_changes(self, app, monkeypatch):
+        monkeypatch.setattr(config, "FARM_CALENDAR_BULK_ENDPOINT", "")
+        monkeypatch.setattr(config, "FARM_CALENDAR_PATCH_CHANGED", True)
+        stub = farmcalendar_stub(bulk=False)
+        client = farmcalendar_client(stub, app)
+
+        def observations(changed_value):
+            return [
+                client._outbox_entry("spray:1:1:0", {"title": "0", "hasResult": {"hasValue": "1"}}, True),
+                client._outbox_entry("spray:1:1:1", {"title": "1", "hasResult": {"hasValue": changed_value}}, True),
+            ]
+
+        await client.enqueue_observations(observations("1"))
+        await client.drain_outbox()
+        assert len(stub.state.requests) == 2
+
+        await client.enqueue_observations(observations("1"))
+        await client.drain_outbox()
+        assert len(stub.state.requests) == 2
+        assert not stub.state.patches
+
+        await client.enqueue_observations(observations("2"))
+        await client.drain_outbox()
+        assert len(stub.state.requests) == 2
+        entry = await OutboxEntry.get("spray:1:1:1")
+        assert stub.state.patches == [(entry.remote_id.rsplit(":", 1)[-1], entry.payload)]
+        assert entry.status == OutboxStatus.SENT
+
+    # Test bulk posts carry an idempotency key per chunk and record the ids created, while observations
+    # to be updated later are posted one by one
+    @pytest.mark.anyio
+    async def test_drain_outbox_bulk_with_patch(self, app, monkeypatch):
+        monkeypatch.setattr(config, "FARM_CALENDAR_PATCH_CHANGED", True)
+        stub = farmcalendar_stub(bulk=True)
+        client = farmcalendar_client(stub, app)
+
+        await client.enqueue_observations([
+            client._outbox_entry("thi:1:1:0", {"title": "thi"}, False),
+            client._outbox_entry("spray:1:1:0", {"title": "spray"}, True),
+        ])
+        await client.drain_outbox()
+
+        assert stub.state.requests == [{"title": "spray"}, [{"title": "thi"}]]
+        single_key, chunk_key = stub.state.idempotency_keys
+        assert single_key.startswith("spray:1:1:0:") and chunk_key
+        entries = await OutboxEntry.find_all().to_list()
+        assert all(entry.status == OutboxStatus.SENT and entry.remote_id for entry in entries)
+
+    # Test changed observations posted again as new ones are sent with a new idempotency key
+    @pytest.mark.anyio
+    async def test_drain_outbox_changed_idempotency_key(self, app, monkeypatch):
+        monkeypatch.setattr(config, "FARM_CALENDAR_BULK_ENDPOINT", "")
+        monkeypatch.setattr(config, "FARM_CALENDAR_PATCH_CHANGED", False)
+        stub = farmcalendar_stub(bulk=False)
+        client = farmcalendar_client(stub, app)
+
+        for value in ("1", "2"):
+            await client.enqueue_observations([client._outbox_entry("spray:1:1:0", {"title": "0", "hasResult": {"hasValue": value}}, True)])
+            await client.drain_outbox()
+        assert len(stub.state.requests) == 2
+        assert len(set(stub.state.idempotency_keys)) == 2
+        assert all(key.startswith("spray:1:1:0:") for key in stub.state.idempotency_keys)
+
+    # Test THI observations are keyed by the time of the reading
+    @pytest.mark.anyio
+    async def test_thi_observation_per_reading(self, app):
+        client = farmcalendar_client(farmcalendar_stub(bulk=False), app)
+        client.thi_activity_type = "urn:farmcalendar:FarmActivityType:thi"
+
+        def reading(dt):
+            return SimpleNamespace(id=uuid4(), thi=70.0, data={"dt": dt, "timezone": 0})
+
+        first, same, later = (client.thi_observation(1.0, 1.0, reading(dt)) for dt in (1730201901, 1730201901, 1730205501))
+        assert first.id == same.id and first.fingerprint == same.fingerprint
+        # An equal THI read later is a new observation
+        assert later.id != first.id
+        assert later.payload["phenomenonTime"] == "2024-10-29T12:38:21+00:00"
+        assert await app.dao.enqueue_outbox([first]) == (1, 0)
+        assert await app.dao.enqueue_outbox([same, later]) == (1, 0)
+
+    # Test an observation changed while its previous value is being posted is posted again
+    @pytest.mark.anyio
+    async def test_drain_outbox_changed_while_posting(self, app, monkeypatch):
+        monkeypatch.setattr(config, "FARM_CALENDAR_BULK_ENDPOINT", "")
+        monkeypatch.setattr(config, "FARM_CALENDAR_PATCH_CHANGED", False)
+        stub = farmcalendar_stub(bulk=False)
+        client = farmcalendar_client(stub, app)
+
+        def observation(value):
+            return client._outbox_entry("spray:1:1:0", {"title": "0", "hasResult": {"hasValue": value}}, True)
+
+        post_observations = client.post_observations
+
+        async def racing_post_observations(observations, keys=None, bulk=True):
+            if observations and not stub.state.requests:
+                await client.enqueue_observations([observation("2")])
+            return await post_observations(observations, keys, bulk)
+
+        client.post_observations = racing_post_observations
+        await client.enqueue_observations([observation("1")])
+        await client.drain_outbox()
+
+        assert [request["hasResult"]["hasValue"] for request in stub.state.requests] == ["1", "2"]
+        entry = await OutboxEntry.get("spray:1:1:0")
+        assert entry.status == OutboxStatus.SENT
+        assert entry.fingerprint == observation("2").fingerprint
@@ -1,4 +1,7 @@
-from fastapi import HTTPException
+import asyncio
+import json
+import time
+
 import pytest
 from unittest.mock import MagicMock, AsyncMock, patch
 from tests.fixtures import *
@@ -7,8 +10,12 @@ from datetime import datetime, timedelta
 
 from httpx import HTTPError
 
+from src.core import context
 from src.external_services import openweathermap
 from src.external_services.openweathermap import SourceError
+from src.core.upstream import Priority, upstream_priority, with_priority
+from src.external_services.providers import HedgedProvider, OpenWeatherMapProvider, ReplayProvider, WeatherProvider, create_provider
+from src.forecast import ForecastSeries
 from src.models.prediction import Prediction
 from src.models.point import Point
 from src.models.weather_data import WeatherData
@@ -62,11 +69,8 @@ class TestOpenWeatherMap:
         openweathermap_srv.dao.find_predictions_for_point.return_value = []
         openweathermap_srv.dao.find_or_create_point.return_value = Point(type="station")
 
-        mock_get = AsyncMock(return_value={})
-        openweathermap.utils.http_get = mock_get
-
-        mock_parseForecast5dayResponse = AsyncMock(return_value=[prediction])
-        openweathermap_srv.parseForecast5dayResponse = mock_parseForecast5dayResponse
+        openweathermap_srv.provider.fetch_forecast = AsyncMock(return_value=ForecastSeries([], {}))
+        openweathermap_srv.store_forecast = AsyncMock(return_value=[prediction])
 
         lat, lon = (42.424242, 24.242424)
         result = await openweathermap_srv.get_weather_forecast5days(lat, lon)
@@ -135,11 +139,8 @@ class TestOpenWeatherMap:
         openweathermap_srv.dao.find_predictions_for_point.return_value = []
         openweathermap_srv.dao.find_or_create_point.return_value = Point(type="station")
 
-        mock_get = AsyncMock(return_value={})
-        openweathermap.utils.http_get = mock_get
-
-        mock_parseForecast5dayResponse = AsyncMock(return_value=[new_prediction])
-        openweathermap_srv.parseForecast5dayResponse = mock_parseForecast5dayResponse
+        openweathermap_srv.provider.fetch_forecast = AsyncMock(return_value=ForecastSeries([], {}))
+        openweathermap_srv.store_forecast = AsyncMock(return_value=[new_prediction])
 
         lat, lon = (42.424242, 24.242424)
         result = await openweathermap_srv.get_weather_forecast5days(lat, lon)
@@ -148,6 +149,37 @@ class TestOpenWeatherMap:
         assert len(result) == 1  # No predictions should be returned since it's too old
 
 
+    # Test a cache miss estimated from the fresh forecasts of nearby locations.
+    @pytest.mark.anyio
+    async def test_get_weather_forecast5days_nearby(self, openweathermap_srv):
+        timestamp = datetime(2025, 6, 1, 12)
+
+        def prediction(value):
+            return Prediction(
+                value=value,
+                measurement_type="ambient_temperature",
+                timestamp=timestamp,
+                data_type="weather",
+                source="openweathermaps",
+                spatial_entity=Point(type="station"),
+            )
+
+        openweathermap_srv.dao.find_predictions_for_point.return_value = []
+        openweathermap_srv.dao.find_predictions_for_radius.return_value = [
+            (100.0, [prediction(10.0)]),
+            (200.0, [prediction(20.0)]),
+        ]
+        mock_get = AsyncMock(return_value={})
+        openweathermap.utils.http_get = mock_get
+
+        lat, lon = (42.424242, 24.242424)
+        result = await openweathermap_srv.get_weather_forecast5days(lat, lon, nearby=True)
+        mock_get.assert_not_awaited()
+        assert len(result) == 1
+        assert result[0].interpolated
+        assert result[0].value == pytest.approx(12.0)
+        assert result[0].spatial_entity.location.coordinates == [lat, lon]
+
     # Test if the service raises a SourceError when the HTTP request fails.
     @pytest.mark.anyio
     async def test_get_weather_forecast5days_http_get_throws_error(
@@ -173,8 +205,8 @@ class TestOpenWeatherMap:
         openweathermap_srv.dao.find_predictions_for_point.return_value = []
         openweathermap_srv.dao.find_or_create_point.return_value = Point(type="station")
 
-        mock = AsyncMock(side_effect=Exception)
-        openweathermap_srv.parseForecast5dayResponse = mock
+        openweathermap_srv.provider.fetch_forecast = AsyncMock(return_value=ForecastSeries([], {}))
+        openweathermap_srv.store_forecast = AsyncMock(side_effect=Exception)
 
         lat, lon = (42.424242, 24.242424)
         with pytest.raises(Exception):
@@ -291,6 +323,118 @@ class TestOpenWeatherMap:
         assert result['data']['main']['temp'] == 43.0
         assert (datetime.utcnow() - weather_data.created_at).total_seconds() > 3 * 3600  # More than 3 hours
 
+    # Test stale weather data is served at once and refreshed once in the background
+    @pytest.mark.anyio
+    async def test_get_weather_stale_data_revalidated(self, app, openweathermap_srv, monkeypatch):
+        monkeypatch.setattr(config, "CURRENT_WEATHER_DATA_CACHE_TIME", 1)
+        monkeypatch.setattr(config, "CURRENT_WEATHER_DATA_MAX_STALE_TIME", 3)
+        weather_data = WeatherData(
+            data={'main': {'temp': 42.0}},
+            spatial_entity=Point(type="station"),
+            created_at=datetime.utcnow() - timedelta(hours=2)
+        )
+        openweathermap_srv.dao.find_weather_data_for_point.return_value = weather_data
+        refreshed = asyncio.Event()
+
+        async def fetch_weather_data(lat, lon):
+            await refreshed.wait()
+
+        openweathermap_srv.fetch_weather_data = AsyncMock(side_effect=fetch_weather_data)
+
+        lat, lon = (42.424242, 24.242424)
+        results = await asyncio.gather(*(openweathermap_srv.get_weather(lat, lon) for _ in range(5)))
+
+        assert all(result.data['main']['temp'] == 42.0 for result in results)
+        openweathermap_srv.dao.find_weather_data_for_point.assert_awaited_with(lat, lon, 3)
+        # The refresh is still running while the stale data is served
+        await asyncio.sleep(0)
+        assert [not task.done() for task in openweathermap_srv._revalidating.values()] == [True]
+        refreshed.set()
+        await asyncio.gather(*openweathermap_srv._revalidating.values())
+        openweathermap_srv.fetch_weather_data.assert_awaited_once_with(lat, lon)
+        assert not openweathermap_srv._revalidating
+
+    # Test fresh predictions are served without a background refresh
+    @pytest.mark.anyio
+    async def test_get_predictions_fresh_not_revalidated(self, app, openweathermap_srv):
+        prediction = Prediction(
+            value=42,
+            measurement_type="type",
+            timestamp=datetime.now(),
+            data_type="weather",
+            source="openweathermaps",
+            spatial_entity=Point(type="station"),
+            created_at=datetime.utcnow()
+        )
+        openweathermap_srv.dao.find_predictions_for_point.return_value = [prediction]
+        openweathermap_srv.fetch_predictions = AsyncMock()
+
+        result = await openweathermap_srv.get_predictions(42.424242, 24.242424)
+        assert result == [prediction]
+        assert not openweathermap_srv._revalidating
+        openweathermap_srv.fetch_predictions.assert_not_awaited()
+
+    # Test the last cached forecast is served, flagged as stale, when OpenWeatherMap cannot be reached
+    @pytest.mark.anyio
+    async def test_get_predictions_fallback_when_unavailable(self, app, openweathermap_srv, monkeypatch):
+        monkeypatch.setattr(config, "OPENWEATHERMAP_BREAKER_FAILURES", 1)
+        openweathermap_srv.provider = OpenWeatherMapProvider()
+        prediction = Prediction(
+            value=42,
+            measurement_type="type",
+            timestamp=datetime.now(),
+            data_type="weather",
+            source="openweathermaps",
+            spatial_entity=Point(type="station"),
+            created_at=datetime.utcnow() - timedelta(hours=12)
+        )
+        # Nothing within the serving limits, only older data
+        openweathermap_srv.dao.find_predictions_for_point.side_effect = (
+            lambda lat, lon, max_age: [prediction] if max_age >= 12 else []
+        )
+        openweathermap_srv.dao.find_or_create_point.return_value = Point(type="station")
+        monkeypatch.setattr(openweathermap.utils, "http_get", AsyncMock(side_effect=HTTPError("down")))
+
+        state = context.ResponseStaleness()
+        token = context.staleness.set(state)
+        try:
+            assert await openweathermap_srv.get_predictions(42.424242, 24.242424) == [prediction]
+            # The circuit is open, OpenWeatherMap is not called again
+            assert await openweathermap_srv.get_predictions(42.424242, 24.242424) == [prediction]
+        finally:
+            context.staleness.reset(token)
+        assert openweathermap.utils.http_get.await_count == 1
+        assert state.created_at == prediction.created_at
+
+    # Test flight and spray forecasts are generated from the last cached forecast when OpenWeatherMap cannot be reached
+    @pytest.mark.anyio
+    async def test_fetch_forecast_fallback_when_unavailable(self, app, openweathermap_srv):
+        prediction = Prediction(
+            value=12.0,
+            measurement_type="ambient_temperature",
+            timestamp=datetime.utcnow(),
+            data_type="weather",
+            source="openweathermaps",
+            spatial_entity=Point(type="station"),
+            created_at=datetime.utcnow() - timedelta(hours=12)
+        )
+        openweathermap_srv.provider.fetch_forecast = AsyncMock(side_effect=HTTPError("down"))
+        openweathermap_srv.dao.find_predictions_for_point = AsyncMock(return_value=[prediction])
+
+        state = context.ResponseStaleness()
+        token = context.staleness.set(state)
+        try:
+            series = await openweathermap_srv.fetch_forecast(42.424242, 24.242424)
+        finally:
+            context.staleness.reset(token)
+        assert series.column("ambient_temperature") == [12.0]
+        assert state.created_at == prediction.created_at
+
+        # Nothing cached to fall back to
+        openweathermap_srv.dao.find_predictions_for_point.return_value = []
+        with pytest.raises(HTTPError):
+            await openweathermap_srv.fetch_forecast(42.424242, 24.242424)
+
     # Test the THI (Temperature Humidity Index) JSON-LD.
     @pytest.mark.anyio
     async def test_get_thi_ld(self, openweathermap_srv):
@@ -382,3 +526,261 @@ class TestOpenWeatherMap:
         data = response.json()
         assert len(data["forecasts"]) == 1
         assert data["forecasts"][0]["status"] == "MARGINAL"
+
+    # Test parcels of the same tile are served the forecast cached for the tile when tiling is enabled
+    @pytest.mark.anyio
+    async def test_get_predictions_tiled(self, openweathermap_srv, monkeypatch):
+        monkeypatch.setattr(config, "FORECAST_TILING_ENABLED", True)
+        monkeypatch.setattr(config, "FORECAST_TILE_PRECISION", 5)
+        openweathermap_srv.dao.find_predictions_for_point = AsyncMock(return_value=[])
+        openweathermap_srv.fetch_predictions = AsyncMock(return_value=["prediction"])
+
+        for lat, lon in [(38.0001, 23.7001), (38.0021, 23.7031)]:
+            assert await openweathermap_srv.get_predictions(lat, lon) == ["prediction"]
+
+        centroid = openweathermap_srv.forecast_location(38.0001, 23.7001)
+        assert centroid != (38.0001, 23.7001)
+        assert [call.args for call in openweathermap_srv.fetch_predictions.await_args_list] == [centroid, centroid]
+
+    # Test flight and spray forecasts of the parcels of a tile share its cached forecast when tiling is enabled
+    @pytest.mark.anyio
+    async def test_fetch_forecast_tiled(self, openweathermap_srv, monkeypatch):
+        monkeypatch.setattr(config, "FORECAST_TILING_ENABLED", True)
+        monkeypatch.setattr(config, "FORECAST_TILE_PRECISION", 5)
+        openweathermap_srv.dao.find_predictions_for_point = AsyncMock(return_value=[])
+        openweathermap_srv.provider.fetch_forecast = AsyncMock()
+
+        async def fetch_predictions(lat, lon):
+            await asyncio.sleep(0.01)
+            # Not bound to the deadline nor the priority of the request that started it
+            assert context.deadline.get() is None
+            assert upstream_priority.get() == Priority.SCHEDULED
+            return []
+
+        openweathermap_srv.fetch_predictions = AsyncMock(side_effect=fetch_predictions)
+        token = context.deadline.set(time.monotonic() + 20)
+        try:
+            await asyncio.gather(*(openweathermap_srv.fetch_forecast(lat, lon) for lat, lon in [(38.0001, 23.7001), (38.0021, 23.7031)]))
+        finally:
+            context.deadline.reset(token)
+
+        centroid = openweathermap_srv.forecast_location(38.0001, 23.7001)
+        openweathermap_srv.fetch_predictions.assert_awaited_once_with(*centroid)
+        openweathermap_srv.provider.fetch_forecast.assert_not_awaited()
+        assert not openweathermap_srv._tile_fetches
+
+    # Test ET0 in linked-data format is served for the tile centroid when tiling is enabled
+    @pytest.mark.anyio
+    async def test_get_et0_ld_tiled(self, app, openweathermap_srv, monkeypatch):
+        monkeypatch.setattr(config, "FORECAST_TILING_ENABLED", True)
+        monkeypatch.setattr(config, "FORECAST_TILE_PRECISION", 5)
+        centroid = openweathermap_srv.forecast_location(38.0001, 23.7001)
+        point = Point(type="POI", location={"type": "Point", "coordinates": list(centroid)})
+        openweathermap_srv.get_forecast_series = AsyncMock(return_value=ForecastSeries([], {}, spatial_entity=point))
+        openweathermap_srv.dao.find_point = AsyncMock(return_value=None)
+
+        graph = await openweathermap_srv.get_et0(38.0001, 23.7001, ocsm=True)
+        location = graph.graph[0]
+        assert (location["lat"], location["lon"]) == centroid
+
+    # Test ET0 batches load a bounded number of forecasts at once and report failing locations separately
+    @pytest.mark.anyio
+    async def test_get_et0_batch_bounded_and_partial(self, openweathermap_srv, monkeypatch):
+        monkeypatch.setattr(config, "ET0_BATCH_CONCURRENCY", 2)
+        running, peak = 0, 0
+
+        async def get_forecast_series(lat, lon):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            if lat == 3.0:
+                raise SourceError("upstream failed")
+            return ForecastSeries([], {})
+
+        openweathermap_srv.get_forecast_series = get_forecast_series
+        results = await openweathermap_srv.get_et0_batch([(float(i), 20.0) for i in range(10)])
+        assert peak == 2
+        assert [result["error"] for result in results] == [None] * 3 + ["upstream failed"] + [None] * 6
+        assert results[3]["lat"] == 3.0 and results[3]["et0"] == []
+
+        # Only a batch failing for every location fails
+        with pytest.raises(SourceError):
+            await openweathermap_srv.get_et0_batch([(3.0, 20.0)])
+
+    # Test the scheduled location pipeline fetches the forecast once for flight and spray forecasts
+    @pytest.mark.anyio
+    async def test_location_observations_single_forecast_fetch(self, openweathermap_srv, mock_weather_data):
+        series = ForecastSeries([1.0], {"ambient_temperature": [10.0]})
+
+        async def ensure_flight(lat, lon, uavmodels, return_existing, load_forecast):
+            return await load_forecast()
+
+        async def ensure_spray(lat, lon, return_existing, load_forecast):
+            return await load_forecast()
+
+        openweathermap_srv.fetch_forecast = AsyncMock(return_value=series)
+        openweathermap_srv.save_weather_data_thi = AsyncMock(return_value="weather")
+        openweathermap_srv.ensure_forecast_for_uavs_and_location = ensure_flight
+        openweathermap_srv.ensure_spray_forecast_for_location = ensure_spray
+
+        weather, flights, sprays = await openweathermap_srv.location_observations(52.0, 13.0, ["DJI"])
+        assert weather == "weather"
+        assert flights is sprays is series
+        openweathermap_srv.fetch_forecast.assert_awaited_once_with(52.0, 13.0)
+
+
+class TestReplayProvider:
+
+    # Test the recorded forecast is parsed and shifted to start at the next 3-hour slot
+    @pytest.mark.anyio
+    async def test_fetch_forecast_shifted(self, tmp_path):
+        payload = {"list": [
+            {"dt": 1000 + 3 * 3600, "main": {"temp": 12.0, "humidity": 70}, "wind": {"speed": 2.0}},
+            {"dt": 1000, "main": {"temp": 10.0, "humidity": 80}, "wind": {"speed": 1.0}},
+        ]}
+        (tmp_path / "forecast.json").write_text(json.dumps(payload))
+
+        series = await ReplayProvider(str(tmp_path)).fetch_forecast(52.0, 13.0)
+        now = datetime.now().timestamp()
+        assert series.timestamps[0] % (3 * 3600) == 0
+        assert now < series.timestamps[0] <= now + 3 * 3600
+        assert series.timestamps[1] - series.timestamps[0] == 3 * 3600
+        assert series.column("ambient_temperature") == [10.0, 12.0]
+        assert "precipitation" not in series.columns
+
+    # Test the payload recorded for a location takes precedence over the default one
+    @pytest.mark.anyio
+    async def test_fetch_current_location_payload(self, tmp_path):
+        (tmp_path / "weather.json").write_text(json.dumps({"main": {"temp": 1.0}, "dt": 0}))
+        (tmp_path / "weather_52.0_13.0.json").write_text(json.dumps({"main": {"temp": 2.0}, "dt": 0}))
+        provider = ReplayProvider(str(tmp_path))
+
+        assert (await provider.fetch_current(52.0, 13.0))["main"]["temp"] == 2.0
+        current = await provider.fetch_current(40.0, 20.0)
+        assert current["main"]["temp"] == 1.0
+        assert current["dt"] > 0
+
+    # Test errors are injected at the configured rate and missing payloads fail as not found
+    @pytest.mark.anyio
+    async def test_errors(self, tmp_path):
+        (tmp_path / "weather.json").write_text(json.dumps({"main": {"temp": 1.0}}))
+
+        with pytest.raises(HTTPError):
+            await ReplayProvider(str(tmp_path), error_rate=1.0).fetch_current(52.0, 13.0)
+        with pytest.raises(HTTPError):
+            await ReplayProvider(str(tmp_path)).fetch_forecast(52.0, 13.0)
+
+    # Test the weather app stores the forecast served by a replay provider, marked as replayed
+    @pytest.mark.anyio
+    async def test_weather_app_with_replay(self, app, tmp_path):
+        payload = {"list": [{"dt": 1000, "main": {"temp": 10.0, "humidity": 80}, "wind": {"speed": 1.0}}]}
+        (tmp_path / "forecast.json").write_text(json.dumps(payload))
+        weather_app = openweathermap.OpenWeatherMap(ReplayProvider(str(tmp_path)))
+        weather_app.setup_dao(MagicMock())
+        weather_app.dao.find_or_create_point = AsyncMock(return_value=Point(
+            type="station", location={"type": "Point", "coordinates": [13.0, 52.0]}
+        ))
+
+        predictions = await weather_app.fetch_predictions(52.0, 13.0)
+        assert {p.measurement_type for p in predictions} == {"ambient_temperature", "ambient_humidity", "wind_speed"}
+        assert all(p.source == "replay" for p in predictions)
+
+
+class StubProvider(WeatherProvider):
+
+    def __init__(self, name, delay=0.0, error=None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    async def fetch_current(self, lat, lon):
+        return {}
+
+    async def fetch_forecast(self, lat, lon):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error:
+            raise self.error
+        return ForecastSeries([1.0], {"ambient_temperature": [10.0]}, source=self.name)
+
+
+class TestHedgedProvider:
+
+    # Test a fast primary answers alone
+    @pytest.mark.anyio
+    async def test_primary_in_time(self):
+        primary, secondary = StubProvider("primary"), StubProvider("secondary")
+        provider = HedgedProvider(primary, secondary, initial_delay=0.5)
+
+        series = await provider.fetch_forecast(52.0, 13.0)
+        assert series.source == "primary"
+        assert secondary.calls == 0
+        assert len(provider.latencies) == 1
+
+    # Test a slow primary is hedged, the secondary answers and the primary is cancelled
+    @pytest.mark.anyio
+    async def test_slow_primary_hedged(self):
+        primary, secondary = StubProvider("primary", delay=5), StubProvider("secondary")
+        provider = HedgedProvider(primary, secondary, initial_delay=0.05, min_delay=0.01)
+
+        series = await provider.fetch_forecast(52.0, 13.0)
+        await asyncio.sleep(0)
+        assert series.source == "secondary"
+        assert primary.cancelled == 1
+        assert provider.stats == {"calls": 1, "hedged": 1, "secondary_won": 1}
+        # The cancelled primary took at least the hedge delay
+        assert len(provider.latencies) == 1 and provider.latencies[0] >= 0.05
+
+    # Test the secondary is queried at once when the primary fails, and the primary error raised if both fail
+    @pytest.mark.anyio
+    async def test_primary_failure(self):
+        primary = StubProvider("primary", error=HTTPError("primary"))
+        provider = HedgedProvider(primary, StubProvider("secondary"), initial_delay=5)
+        assert (await asyncio.wait_for(provider.fetch_forecast(52.0, 13.0), 1)).source == "secondary"
+
+        provider = HedgedProvider(primary, StubProvider("secondary", error=HTTPError("secondary")), initial_delay=5)
+        with pytest.raises(HTTPError, match="primary"):
+            await provider.fetch_forecast(52.0, 13.0)
+
+    # Test background calls are not hedged
+    @pytest.mark.anyio
+    async def test_background_not_hedged(self):
+        primary, secondary = StubProvider("primary", delay=0.05), StubProvider("secondary")
+        provider = HedgedProvider(primary, secondary, initial_delay=0.01, min_delay=0.01)
+
+        series = await with_priority(Priority.SCHEDULED, provider.fetch_forecast(52.0, 13.0))
+        assert series.source == "primary"
+        assert secondary.calls == 0
+
+    # Test the hedge delay follows the percentile of the recent primary latencies
+    def test_hedge_delay(self):
+        provider = HedgedProvider(StubProvider("primary"), StubProvider("secondary"), percentile=90, initial_delay=2, min_delay=0.05, window=10, min_samples=10)
+        assert provider.hedge_delay() == 2
+        provider.latencies.extend([0.1] * 9 + [3.0])
+        assert provider.hedge_delay() == 0.1
+        provider.latencies.extend([0.01] * 10)
+        assert provider.hedge_delay() == 0.05
+
+    # Test unknown providers and hedging a provider to itself are refused
+    def test_create_provider_invalid(self, monkeypatch):
+        monkeypatch.setattr(config, "WEATHER_PROVIDER", "openweathermpa")
+        with pytest.raises(ValueError, match="Unknown"):
+            create_provider()
+
+        monkeypatch.setattr(config, "WEATHER_PROVIDER", "openweathermap")
+        monkeypatch.setattr(config, "WEATHER_PROVIDER_HEDGE", "openweathermap")
+        with pytest.raises(ValueError, match="itself"):
+            create_provider()
+
+        monkeypatch.setattr(config, "WEATHER_PROVIDER_HEDGE", "replay")
+        provider = create_provider()
+        assert isinstance(provider.primary, OpenWeatherMapProvider)
+        assert isinstance(provider.secondary, ReplayProvider)